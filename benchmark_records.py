@@ -0,0 +1,189 @@
+"""!
+@file benchmark_records.py
+@brief Micro-benchmark of the typed records against plain tuples.
+
+This script measures the cost of reading the slots as the records of
+<code>utils/records.py</code> instead of plain tuples: it fills a temporary
+database with random slots, then reads all of them with <code>get_slots</code>,
+with the same query returning plain tuples, and with the records built by their
+constructor. For each way it reports the best time over some repetitions and
+the memory taken by the rows read, first just reading the rows, then also
+reading the start time of each one, by name for the records and by position
+for the tuples. Usage:
+
+<code>python benchmark_records.py [--slots N] [--repeat N]</code>
+
+<code>get_slots</code> returns the rows fetched by SQLite in a
+<code>RecordList</code>, so reading the rows takes the same time and memory as
+the plain tuples. Each record is made when it is taken from the list, and freed
+right after if it isn't kept: reading a field by name then adds the copy of the
+row to the time, but no memory. On 100000 slots reading the rows took between
+0.98 and 1.01 times the time of the tuples, with the same 18966 kB, and reading
+also their start times 1.12 times the time of the tuples, again with the same
+memory. The records built by the constructor took 1.33 times the time and
+19903 kB.
+"""
+
+import gc, os, sys, time, random, argparse, sqlite3, tempfile, tracemalloc
+
+from utils.db_connection import connect
+from utils.db_read import get_slots
+from utils.records import Slot, RecordList
+
+# Same query as get_slots
+QUERY = """
+    SELECT slot_id, event_id, user_id, start_time, end_time
+    FROM slots
+    ORDER BY start_time ASC
+    """
+
+
+
+def fill_database(db:str, slots:int) -> None:
+    """! @brief Creates the slots table and fills it with random slots.
+    @param db: string, the path to the database file
+    @param slots: integer, the number of slots to insert
+    @return None
+    """
+    con = sqlite3.connect(db)
+    con.execute(
+        """
+        CREATE TABLE slots (
+        slot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER,
+        user_id INTEGER,
+        start_time INTEGER,
+        end_time INTEGER
+        );
+        """
+    )
+    rng = random.Random(0)
+    rows = []
+    for _ in range(slots):
+        start_time = 1767225600 + rng.randrange(365 * 24 * 4) * 900
+        user_id = rng.randrange(1000) if rng.random() < 0.5 else None
+        rows.append((rng.randrange(100), user_id, start_time, start_time + 900))
+    con.executemany("INSERT INTO slots (event_id, user_id, start_time, end_time) VALUES (?,?,?,?);", rows)
+    con.commit()
+    con.close()
+
+def read_tuples(db:str) -> list[tuple[int,int,int,int,int]]:
+    """! @brief Reads all the slots as plain tuples, as <code>get_slots</code> did before the records.
+    @param db: string, the path to the database file
+    @return list[tuple[int,int,int,int,int]], the slots
+    """
+    con = connect(db)
+    res = con.execute(QUERY).fetchall()
+    con.close()
+    return res
+
+def read_records(db:str) -> RecordList:
+    """! @brief Reads all the slots as records, with <code>get_slots</code>.
+    @param db: string, the path to the database file
+    @return RecordList, the slots
+    """
+    return get_slots(db)
+
+def read_tuple_fields(db:str) -> list[tuple[int,int,int,int,int]]:
+    """! @brief Reads all the slots as plain tuples, then the start time of each one by position.
+    @param db: string, the path to the database file
+    @return list[tuple[int,int,int,int,int]], the slots
+    """
+    rows = read_tuples(db)
+    sum(row[3] for row in rows)
+    return rows
+
+def read_record_fields(db:str) -> RecordList:
+    """! @brief Reads all the slots as records, then the start time of each one by name.
+    @param db: string, the path to the database file
+    @return RecordList, the slots
+    """
+    rows = get_slots(db)
+    sum(slot.start_time for slot in rows)
+    return rows
+
+def read_constructed(db:str) -> list[Slot]:
+    """! @brief Reads all the slots as records, built by their constructor.
+    @param db: string, the path to the database file
+    @return list[Slot], the slots
+    """
+    con = connect(db)
+    res = [Slot(*row) for row in con.execute(QUERY)]
+    con.close()
+    return res
+
+
+
+def measure(read, db:str, repeat:int) -> tuple[float, int]:
+    """! @brief Measures a way of reading the slots.
+    @param read: function, reads all the slots given the database path
+    @param db: string, the path to the database file
+    @param repeat: integer, the number of timed repetitions
+    @return tuple[float,int], the best time in seconds and the bytes allocated by one read
+
+    The garbage collector is disabled while timing, as <code>timeit</code> does,
+    since its runs would add noise to the results.
+    """
+    best = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            read(db)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    rows = read(db)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+    return best, allocated
+
+def main() -> None:
+    """! @brief Runs the benchmark and prints a table of the results.
+    @return None
+    """
+    parser = argparse.ArgumentParser(description="Compare the typed records with plain tuples.")
+    parser.add_argument("--slots", type=int, default=100000, help="number of slots in the database")
+    parser.add_argument("--repeat", type=int, default=10, help="timed repetitions, the best one is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = os.path.join(directory, "benchmark.db")
+        fill_database(db, args.slots)
+
+        print("Reading " + str(args.slots) + " slots, best of " + str(args.repeat))
+        print(
+            "| " + "Rows".rjust(24) + " | " + "Time (ms)".rjust(10) + " | " +
+            "Relative".rjust(10) + " | " + "Memory (kB)".rjust(12) + " |"
+        )
+        print("-" * (24 + 10 + 10 + 12 + 13))
+        reference = None
+        for name, read in (
+                ("plain tuples", read_tuples),
+                ("records", read_records),
+                ("records, constructor", read_constructed),
+                ("tuples, start times", read_tuple_fields),
+                ("records, start times", read_record_fields)
+        ):
+            best, allocated = measure(read, db, args.repeat)
+            if reference is None or name == "tuples, start times":
+                reference = best
+            print(
+                "| " + name.rjust(24) + " | " +
+                ("%.1f" % (best * 1000)).rjust(10) + " | " +
+                ("%.2f" % (best / reference)).rjust(10) + " | " +
+                str(allocated // 1024).rjust(12) + " |"
+            )
+
+    row = (1, 1, None, 1767225600, 1767226500)
+    print("Size of one row: tuple " + str(sys.getsizeof(row)) + " bytes, record " +
+          str(sys.getsizeof(Slot(*row))) + " bytes")
+
+
+
+if __name__ == "__main__":
+    main()
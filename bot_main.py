@@ -1,45 +1,47 @@
-from dotenv import load_dotenv
-import os, sys, logging
+import sys, time, logging
+startup_time = time.perf_counter()
 
-# Load environment variables
-load_dotenv()
-db = os.getenv("DB_PATH")
-bot_token = os.getenv("BOT_TOKEN")
-debug = os.getenv("DEBUG", "False").strip().lower() == "true"
+from utils.config import Config, load_config
 
+# Load the configuration, shared with the handlers through bot_data
+config = load_config()
 
 
-# Setup logging mode according to debug
-if debug:
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
-else:
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.ERROR
-    )
 
-    # Filter out the PTBUserWarning triggered by ConversationHandler
-    from warnings import filterwarnings
-    from telegram.warnings import PTBUserWarning
-    filterwarnings(action="ignore", message=r".*CallbackQueryHandler", category=PTBUserWarning)
+# Setup logging mode according to debug, records are written by a background thread
+from services.log_pipeline import setup_logging
+setup_logging(
+    logging.INFO if config.debug else logging.ERROR,
+    json_format=config.log_format == "json",
+    sample_rate=config.log_sample_rate
+)
+
 
 
 
 
+import ssl, certifi
+from telegram.ext import filters, MessageHandler, ApplicationBuilder, Application, \
+    CommandHandler, ConversationHandler, InlineQueryHandler
+from telegram.request import HTTPXRequest
 
-from telegram.ext import filters, MessageHandler, ApplicationBuilder, \
-    CommandHandler, CallbackQueryHandler, ConversationHandler
+from handlers.callback_router import CallbackRouter, ACTION_FAIR, ACTION_EVENT, ACTION_DAY, \
+    ACTION_MONTH, ACTION_SLOT, ACTION_PAGE, ACTION_NOOP, ACTION_WAIT, ACTION_CANCEL
+from services.update_processor import ChatOrderedUpdateProcessor, log_update_metrics
+from services.persistence import SQLitePersistence
+from services.send_queue import SendQueue, log_send_metrics
+from services.reminders import send_reminders
 
 from handlers.generic_commands import start, unitn_help, unknown_command, free_text, active_command, \
-    cancel, unknown_callback
+    cancel, unknown_callback, ignore_callback
 from handlers.book_commands import select_fair, show_fair_description, select_event, show_event_description, whoami
 from handlers.book_commands import select_slot_date, select_slot_time, book_event, select_slot_for_user, \
-    confirm_unbook_slot, unbook_slot, my_bookings
+    confirm_unbook_slot, unbook_slot, my_bookings, book_from_link, change_slot_month, wait_for_slot, \
+    BOOK_LINK_PREFIX
+from handlers.lazy_loading import lazy_callback
 from handlers.event_commands import ask_event_name, ask_event_fair, log_event_creation, ask_event_description, \
-    select_user_event_after_text, log_description_update, ask_event_date, log_slot_creation
+    select_user_event_after_description, log_description_update, ask_event_date, \
+    select_user_event_after_slots, log_slot_creation
 from handlers.event_commands import select_user_event, select_slot_for_event, confirm_slot_deleting, \
     log_slot_deleting, confirm_event_deleting, log_event_deleting, show_event_details
 
@@ -47,25 +49,54 @@ from handlers.event_commands import select_user_event, select_slot_for_event, co
 
 
 
-if __name__ == '__main__':
-    # Check environment variables existence
-    if db is None or db=="":
-        sys.exit("Fatal error: database path not set. Insert it in your .env file.")
-    else:
-        print("Database path loaded: " + db)
+def build_application(config:Config, worker:int|None=None) -> Application:
+    """! @brief Builds the application of the bot, with all its handlers.
+    @param config: Config, the configuration of the bot
+    @param worker: integer, the index of the worker process running the application,
+    None if the bot runs in a single process
+    @return Application, the application, ready to be started
 
-    if bot_token is None or bot_token=="":
-        sys.exit("Fatal error: bot token not set. Insert it in your .env file.")
+    The application of a worker doesn't fetch the updates: the supervisor puts
+    them in its update queue, see <code>services/sharding.py</code>. The
+    reminders are sent only by the first worker, and the overall send rate is
+    split among the workers.
+    """
+    # Instantiate the bot, updates of different chats are processed concurrently
+    update_processor = ChatOrderedUpdateProcessor(config.max_concurrent_updates)
+    # Conversations and user data are saved in the database, so they survive restarts;
+    # the workers reload the user data, which a user can change through several of them
+    persistence = SQLitePersistence(
+        config.db, update_interval=config.persistence_interval, shared=worker is not None
+    )
+    # Outgoing requests are throttled below Telegram's flood limits
+    # Both connection pools verify Telegram's certificate with the same SSL context,
+    # loading the CA bundle once instead of once per pool
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    builder = ApplicationBuilder().token(config.bot_token).concurrent_updates(update_processor) \
+        .request(HTTPXRequest(connection_pool_size=256, httpx_kwargs={"verify": ssl_context})) \
+        .persistence(persistence)
+    if worker is None:
+        builder = builder.get_updates_request(HTTPXRequest(httpx_kwargs={"verify": ssl_context})) \
+            .rate_limiter(SendQueue())
     else:
-        print("Bot token loaded.")
+        # Each worker sends in its own chats, the global limit is shared by all of them
+        builder = builder.updater(None).rate_limiter(SendQueue(global_rate=30 / config.workers))
+    application = builder.build()
+    application.bot_data["config"] = config
 
-    if debug:
-        print("Debug mode: ON")
-    else:
-        print("Debug mode: OFF")
+    if config.debug:
+        # Log the update and send queue metrics every minute
+        application.job_queue.run_repeating(log_update_metrics, interval=60)
+        application.job_queue.run_repeating(log_send_metrics, interval=60)
 
-    # Instantiate the bot
-    application = ApplicationBuilder().token(bot_token).build()
+    # Remind the students of their bookings, the first sweep catches up after a downtime
+    if config.reminder_leads and (worker is None or worker == 0):
+        application.job_queue.run_repeating(
+            send_reminders,
+            interval=config.reminder_interval,
+            first=1,
+            data={"db": config.db, "leads": config.reminder_leads}
+        )
 
 
 
@@ -78,9 +109,12 @@ if __name__ == '__main__':
     # Default Commands
     # These handlers provide the user general information about the Bot
 
+    # /start with the parameter of a booking link, it starts /book
+    book_link = filters.Regex("^/start " + BOOK_LINK_PREFIX + r"\d+$")
+
     application.add_handler(
         # Message sent at the rbot initialization
-        CommandHandler('start', start)
+        CommandHandler('start', start, filters=~book_link)
     )
 
     application.add_handler(
@@ -97,27 +131,29 @@ if __name__ == '__main__':
         # Show fairs and their descriptions
         entry_points=[CommandHandler("fairs", select_fair)],
         states={
-            0: [CallbackQueryHandler(show_fair_description, pattern="^fair_id:[0-9]*$")]
+            0: [CallbackRouter({ACTION_FAIR: show_fair_description})]
         },
         fallbacks=[
             CommandHandler("fairs", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="fairs",
+        persistent=True
     ))
 
     application.add_handler(ConversationHandler(
         # Show events and their descriptions
         entry_points=[CommandHandler("events", select_fair)],
         states={
-            0: [CallbackQueryHandler(select_event, pattern="^fair_id:[0-9]*$")],
-            1: [CallbackQueryHandler(show_event_description, pattern="^event_id:[0-9]*$")]
+            0: [CallbackRouter({ACTION_FAIR: select_event})],
+            1: [CallbackRouter({ACTION_EVENT: show_event_description})]
         },
         fallbacks=[
             CommandHandler("events", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="events",
+        persistent=True
     ))
 
     application.add_handler(
@@ -125,6 +161,23 @@ if __name__ == '__main__':
         CommandHandler('whoami', whoami)
     )
 
+    application.add_handler(ConversationHandler(
+        # Search fairs and events by name and description, loaded at the first search
+        entry_points=[CommandHandler("search", lazy_callback("handlers.search_commands", "ask_search_text"))],
+        states={
+            0: [MessageHandler(
+                filters.TEXT & (~filters.COMMAND),
+                lazy_callback("handlers.search_commands", "search_after_text")
+            )],
+            1: [CallbackRouter({ACTION_PAGE: lazy_callback("handlers.search_commands", "change_search_page")})]
+        },
+        fallbacks=[CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)],
+        # A new search replaces the one whose results are shown
+        allow_reentry=True,
+        name="search",
+        persistent=True
+    ))
+
 
 
     # Booking commands
@@ -132,32 +185,40 @@ if __name__ == '__main__':
 
     application.add_handler(ConversationHandler(
         # Book an event
-        entry_points=[CommandHandler("book", select_fair)],
+        entry_points=[CommandHandler("book", select_fair), CommandHandler("start", book_from_link, filters=book_link)],
         states={
-            0: [CallbackQueryHandler(select_event, pattern="^fair_id:[0-9]*$")],
-            1: [CallbackQueryHandler(select_slot_date, pattern="^event_id:[0-9]*$")],
-            2: [CallbackQueryHandler(select_slot_time, pattern="^event_id:[0-9]*:day:[0-9|-]*$")],
-            3: [CallbackQueryHandler(book_event, pattern="^slot_id:[0-9]*$")]
+            0: [CallbackRouter({ACTION_FAIR: select_event})],
+            1: [CallbackRouter({ACTION_EVENT: select_slot_date})],
+            2: [CallbackRouter({
+                ACTION_DAY: select_slot_time,
+                ACTION_MONTH: change_slot_month,
+                ACTION_WAIT: wait_for_slot,
+                ACTION_NOOP: ignore_callback
+            })],
+            3: [CallbackRouter({ACTION_SLOT: book_event})]
         },
         fallbacks=[
             CommandHandler("book", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CommandHandler("start", active_command, filters=book_link),
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="book",
+        persistent=True
     ))
 
     application.add_handler(ConversationHandler(
         # Un-book an event
         entry_points=[CommandHandler("unbook", select_slot_for_user)],
         states={
-            0: [CallbackQueryHandler(confirm_unbook_slot, pattern="^slot_id:[0-9]*$")],
-            1: [CallbackQueryHandler(unbook_slot, pattern="^slot_id:[0-9]*$")]
+            0: [CallbackRouter({ACTION_SLOT: confirm_unbook_slot})],
+            1: [CallbackRouter({ACTION_SLOT: unbook_slot})]
         },
         fallbacks=[
             CommandHandler("unbook", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="unbook",
+        persistent=True
     ))
 
     application.add_handler(
@@ -175,87 +236,104 @@ if __name__ == '__main__':
         entry_points=[CommandHandler("publish", ask_event_name)],
         states={
             0: [MessageHandler(filters.TEXT, ask_event_fair)],
-            1: [CallbackQueryHandler(log_event_creation, pattern="^fair_id:[0-9]*:name:")]
+            1: [CallbackRouter({ACTION_FAIR: log_event_creation})]
         },
         fallbacks=[
             CommandHandler("publish", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="publish",
+        persistent=True
     ))
 
     application.add_handler(ConversationHandler(
         # Change the description of an event
         entry_points=[CommandHandler("changedes", ask_event_description)],
         states={
-            0: [MessageHandler(filters.TEXT, select_user_event_after_text)],
-            1: [CallbackQueryHandler(log_description_update, pattern="^event_id:[0-9]*:des:")]
+            0: [MessageHandler(filters.TEXT, select_user_event_after_description)],
+            1: [CallbackRouter({ACTION_EVENT: log_description_update})]
         },
         fallbacks=[
             CommandHandler("changedes", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="changedes",
+        persistent=True
     ))
 
     application.add_handler(ConversationHandler(
         # Add a new slot to an event
         entry_points=[CommandHandler("newslot", ask_event_date)],
         states={
-            0: [MessageHandler(filters.TEXT, select_user_event_after_text)],
-            1: [CallbackQueryHandler(log_slot_creation, pattern="^event_id:[0-9]*:des:")]
+            0: [MessageHandler(filters.TEXT, select_user_event_after_slots)],
+            1: [CallbackRouter({ACTION_EVENT: log_slot_creation})]
         },
         fallbacks=[
             CommandHandler("newslot", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="newslot",
+        persistent=True
     ))
 
     application.add_handler(ConversationHandler(
         # Delete a slot from an event
         entry_points=[CommandHandler("deleteslot", select_user_event)],
         states={
-            0: [CallbackQueryHandler(select_slot_for_event, pattern="^event_id:[0-9]*$")],
-            1: [CallbackQueryHandler(confirm_slot_deleting, pattern="^slot_id:[0-9]*$")],
-            2: [CallbackQueryHandler(log_slot_deleting, pattern="^slot_id:[0-9]*$")]
+            0: [CallbackRouter({ACTION_EVENT: select_slot_for_event})],
+            1: [CallbackRouter({ACTION_SLOT: confirm_slot_deleting})],
+            2: [CallbackRouter({ACTION_SLOT: log_slot_deleting})]
         },
         fallbacks=[
             CommandHandler("deleteslot", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="deleteslot",
+        persistent=True
     ))
 
     application.add_handler(ConversationHandler(
         # Delete an event
         entry_points=[CommandHandler("deleteevent", select_user_event)],
         states={
-            0: [CallbackQueryHandler(confirm_event_deleting, pattern="^event_id:[0-9]*$")],
-            1: [CallbackQueryHandler(log_event_deleting, pattern="^event_id:[0-9]*$")]
+            0: [CallbackRouter({ACTION_EVENT: confirm_event_deleting})],
+            1: [CallbackRouter({ACTION_EVENT: log_event_deleting})]
         },
         fallbacks=[
             CommandHandler("deleteevent", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="deleteevent",
+        persistent=True
     ))
 
     application.add_handler(ConversationHandler(
         # Monitor your events
         entry_points=[CommandHandler("myevents", select_user_event)],
         states={
-            0: [CallbackQueryHandler(show_event_details, pattern="^event_id:[0-9]*$")]
+            0: [CallbackRouter({ACTION_EVENT: show_event_details})]
         },
         fallbacks=[
             CommandHandler("myevents", active_command),
-            CallbackQueryHandler(cancel, pattern="^cancel"),
-            CallbackQueryHandler(unknown_callback, pattern="")
-        ]
+            CallbackRouter({ACTION_CANCEL: cancel}, default=unknown_callback)
+        ],
+        name="myevents",
+        persistent=True
     ))
 
 
 
+    # Inline mode
+    # This handler lets the user search the events from any chat, typing @bot_username
+    # Its module is loaded at the first inline query
+
+    application.add_handler(
+        # Search the events by name
+        InlineQueryHandler(lazy_callback("handlers.inline_commands", "search_events"))
+    )
+
+
+
     # Fallback handlers
     # These handlers allows the bot to react to unknown commands or text
     # They must be the last two, in this order, otherwise they will
@@ -271,8 +349,67 @@ if __name__ == '__main__':
         MessageHandler(filters.TEXT & (~filters.COMMAND), free_text)
     )
 
+    return application
+
+
+
+
+if __name__ == '__main__':
+    setup_time = time.perf_counter()
+
+    # Check environment variables existence
+    if config.db is None or config.db=="":
+        sys.exit("Fatal error: database path not set. Insert it in your .env file.")
+    else:
+        print("Database path loaded: " + config.db)
+
+    if config.bot_token is None or config.bot_token=="":
+        sys.exit("Fatal error: bot token not set. Insert it in your .env file.")
+    else:
+        print("Bot token loaded.")
 
+    if config.debug:
+        print("Debug mode: ON")
+    else:
+        print("Debug mode: OFF")
+
+    if config.bot_mode == "webhook":
+        if config.webhook_url is None or config.webhook_url=="":
+            sys.exit("Fatal error: webhook URL not set. Insert it in your .env file.")
+        print("Update mode: webhook, listening on " + config.webhook_listen + ":" + str(config.webhook_port) + \
+              "/" + config.webhook_path)
+        if config.webhook_secret is None:
+            print("Warning: webhook secret not set, any request to the webhook will be accepted.")
+    elif config.bot_mode == "polling":
+        print("Update mode: polling")
+    else:
+        sys.exit("Fatal error: unknown BOT_MODE " + config.bot_mode + ", use polling or webhook.")
 
     # Launch the bot
+    if config.workers > 1:
+        # Imported here, since a single process doesn't need it
+        from services.sharding import run_supervisor
+        print("BOT STARTED, " + str(config.workers) + " workers")
+        run_supervisor(config, build_application)
+        sys.exit()
+
+    application = build_application(config)
+    logging.getLogger(__name__).info(
+        "Startup took %.0f ms: %.0f ms to import the modules, %.0f ms to build the application",
+        (time.perf_counter() - startup_time) * 1000,
+        (setup_time - startup_time) * 1000,
+        (time.perf_counter() - setup_time) * 1000
+    )
     print("BOT STARTED")
-    application.run_polling()
+    if config.bot_mode == "webhook":
+        # Serve the updates posted by Telegram, setWebhook is called at startup
+        application.run_webhook(
+            listen=config.webhook_listen,
+            port=config.webhook_port,
+            url_path=config.webhook_path,
+            webhook_url=config.webhook_url,
+            secret_token=config.webhook_secret,
+            max_connections=config.webhook_max_connections
+        )
+    else:
+        application.run_polling()
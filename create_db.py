@@ -1,9 +1,10 @@
-from dotenv import load_dotenv
-import os, sys, sqlite3
+import sys, sqlite3
+
+from utils.config import load_config
+from utils.db_write import delete_orphans
 
 # Load environment variables
-load_dotenv()
-db = os.getenv("DB_PATH")
+db = load_config().db
 
 # Check environment variables existence
 if db is None or db=="":
@@ -13,60 +14,326 @@ else:
 
 # Open connection (and creates db if not existing)
 con = sqlite3.connect(db)
+# The tables are rebuilt with the foreign keys disabled, so that dropping
+# the old copy of a table doesn't delete the records referring to it
+con.execute("PRAGMA foreign_keys=OFF;")
+rebuilt_tables = []
 
 
 
-# Queries to create the four tables
-con.execute(
+def create_table(name:str, columns:str) -> None:
+    """! @brief Creates a table, or rebuilds it if its columns or foreign keys are outdated.
+    @param name: string, the name of the table
+    @param columns: string, the columns and constraints of the table
+    @return None
+
+    SQLite can't alter the type of a column nor the foreign keys of a table, so
+    a table created by an older version of this script, e.g. without the ON
+    DELETE actions, is copied into a new table with the current definition,
+    which then replaces it.
+    """
+    con.execute("CREATE TABLE IF NOT EXISTS " + name + " (" + columns + ");")
+
+    # Compare the columns and foreign keys with the ones of the current definition
+    con.execute("CREATE TEMP TABLE expected (" + columns + ");")
+    expected = (
+        con.execute("PRAGMA temp.table_info(expected);").fetchall(),
+        sorted(row[2:] for row in con.execute("PRAGMA temp.foreign_key_list(expected);"))
+    )
+    con.execute("DROP TABLE temp.expected;")
+    current = (
+        con.execute("PRAGMA main.table_info(" + name + ");").fetchall(),
+        sorted(row[2:] for row in con.execute("PRAGMA main.foreign_key_list(" + name + ");"))
+    )
+    if current == expected:
+        return
+
+    column_names = ",".join(row[1] for row in con.execute("PRAGMA table_info(" + name + ");"))
+    # The IDs of the deleted records must not be reused
+    sequence = con.execute("SELECT seq FROM sqlite_sequence WHERE name=?;", (name,)).fetchone()
+    con.commit() # The rebuild is a transaction on its own
+    con.execute("BEGIN;")
+    con.execute("CREATE TABLE " + name + "_new (" + columns + ");")
+    con.execute(
+        "INSERT INTO " + name + "_new (" + column_names + ") SELECT " + column_names + " FROM " + name + ";"
+    )
+    con.execute("DROP TABLE " + name + ";")
+    con.execute("ALTER TABLE " + name + "_new RENAME TO " + name + ";")
+    if sequence is not None:
+        con.execute("UPDATE sqlite_sequence SET seq=max(seq,?) WHERE name=?;", (sequence[0], name))
+    con.commit()
+    rebuilt_tables.append(name)
+
+
+
+# Queries to create the four tables of the booking records
+# Deleting a fair deletes its events, deleting an event deletes its slots,
+# deleting a user frees their slots and leaves their events without owner
+create_table(
+    "users",
     """
-    CREATE TABLE IF NOT EXISTS users (
     user_id INTEGER PRIMARY KEY,
     name CHAR(32),
     username CHAR(32)
-    );
     """
 )
-con.execute(
+create_table(
+    "fairs",
     """
-    CREATE TABLE IF NOT EXISTS fairs (
     fair_id INTEGER PRIMARY KEY AUTOINCREMENT,
     name CHAR(32),
     description TEXT
-    );
     """
 )
-con.execute(
+create_table(
+    "events",
     """
-    CREATE TABLE IF NOT EXISTS events (
     event_id INTEGER PRIMARY KEY AUTOINCREMENT,
     fair_id INTEGER,
     owner_id INTEGER,
     name CHAR(32),
     description TEXT,
-    FOREIGN KEY(fair_id) REFERENCES fairs(fair_id),
-    FOREIGN KEY(owner_id) REFERENCES users(user_id)
+    FOREIGN KEY(fair_id) REFERENCES fairs(fair_id) ON DELETE CASCADE,
+    FOREIGN KEY(owner_id) REFERENCES users(user_id) ON DELETE SET NULL
+    """
+)
+create_table(
+    "slots",
+    """
+    slot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id INTEGER,
+    user_id INTEGER,
+    start_time INTEGER,
+    end_time INTEGER,
+    FOREIGN KEY(event_id) REFERENCES events(event_id) ON DELETE CASCADE,
+    FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE SET NULL
+    """
+)
+# NOTE: 'start_time' and 'end_time' are the seconds since the epoch of the
+# wall-clock time, see utils/slot_time.py. Older versions stored them as
+# ISO-8601 time strings, which are converted here.
+con.execute(
+    """
+    UPDATE slots
+    SET start_time=CAST(strftime('%s', start_time) AS INTEGER),
+    end_time=CAST(strftime('%s', end_time) AS INTEGER)
+    WHERE typeof(start_time)='text' OR typeof(end_time)='text';
+    """
+)
+con.execute(
+    """
+    CREATE INDEX IF NOT EXISTS slots_start_time
+    ON slots(start_time);
+    """
+)
+con.execute(
+    """
+    CREATE INDEX IF NOT EXISTS slots_event_start_time
+    ON slots(event_id, start_time);
+    """
+)
+con.execute(
+    """
+    CREATE INDEX IF NOT EXISTS slots_user_start_time
+    ON slots(user_id, start_time);
+    """
+)
+
+
+
+# Queries to create the tables used by the bot to persist the conversations
+con.execute(
+    """
+    CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT,
+    conversation_key TEXT,
+    state INTEGER,
+    PRIMARY KEY(name, conversation_key)
     );
     """
 )
 con.execute(
     """
-    CREATE TABLE IF NOT EXISTS slots (
-    slot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT
+    );
+    """
+)
+con.execute(
+    """
+    CREATE TABLE IF NOT EXISTS chat_data (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT
+    );
+    """
+)
+# NOTE: 'conversation_key' and 'data' are JSON strings.
+
+
+
+# Queries to create the full-text indexes of the fair and event descriptions
+# They are external content tables, kept in sync with the indexed tables by triggers
+for table, id_column in (("fairs", "fair_id"), ("events", "event_id")):
+    con.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS " + table + "_fts USING fts5(" +
+        "name, description, content='" + table + "', content_rowid='" + id_column + "');"
+    )
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS " + table + "_fts_insert AFTER INSERT ON " + table + " BEGIN " +
+        "INSERT INTO " + table + "_fts (rowid,name,description) " +
+        "VALUES (new." + id_column + ",new.name,new.description); " +
+        "END;"
+    )
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS " + table + "_fts_delete AFTER DELETE ON " + table + " BEGIN " +
+        "INSERT INTO " + table + "_fts (" + table + "_fts,rowid,name,description) " +
+        "VALUES ('delete',old." + id_column + ",old.name,old.description); " +
+        "END;"
+    )
+    con.execute(
+        "CREATE TRIGGER IF NOT EXISTS " + table + "_fts_update AFTER UPDATE ON " + table + " BEGIN " +
+        "INSERT INTO " + table + "_fts (" + table + "_fts,rowid,name,description) " +
+        "VALUES ('delete',old." + id_column + ",old.name,old.description); " +
+        "INSERT INTO " + table + "_fts (rowid,name,description) " +
+        "VALUES (new." + id_column + ",new.name,new.description); " +
+        "END;"
+    )
+    # Index the records already present, in case the database existed
+    con.execute("INSERT INTO " + table + "_fts (" + table + "_fts) VALUES ('rebuild');")
+# NOTE: the rowid of 'fairs_fts' and 'events_fts' is the ID of the indexed record.
+
+
+
+# Query to create the table of the booking reminders already sent
+create_table(
+    "reminders_sent",
+    """
+    slot_id INTEGER,
+    lead INTEGER,
+    user_id INTEGER,
+    start_time INTEGER,
+    PRIMARY KEY(slot_id, lead, user_id, start_time)
+    """
+)
+con.execute(
+    """
+    UPDATE reminders_sent
+    SET start_time=CAST(strftime('%s', start_time) AS INTEGER)
+    WHERE typeof(start_time)='text';
+    """
+)
+# NOTE: 'lead' is in minutes, 'start_time' is the start of the slot when
+# the reminder was sent, in the same form as the start times of the slots.
+
+
+
+# Query to create the table of the students waiting for a slot of a fully booked event
+create_table(
+    "waitlist",
+    """
+    waitlist_id INTEGER PRIMARY KEY AUTOINCREMENT,
     event_id INTEGER,
     user_id INTEGER,
-    start_time TEXT,
-    end_time TEXT,
-    FOREIGN KEY(event_id) REFERENCES events(event_id),
-    FOREIGN KEY(user_id) REFERENCES users(user_id)
+    UNIQUE(event_id, user_id),
+    FOREIGN KEY(event_id) REFERENCES events(event_id) ON DELETE CASCADE,
+    FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    """
+)
+con.execute(
+    """
+    CREATE INDEX IF NOT EXISTS waitlist_event
+    ON waitlist(event_id, waitlist_id);
+    """
+)
+# NOTE: 'waitlist_id' grows with time, so it gives the order of arrival.
+
+
+
+# Queries to create the tables counting the changes of each entity
+# The in-memory caches of every process read them to find what other processes changed
+con.execute(
+    """
+    CREATE TABLE IF NOT EXISTS entity_versions (
+    kind TEXT,
+    entity_key INTEGER,
+    version INTEGER,
+    base_version INTEGER,
+    change_id INTEGER,
+    PRIMARY KEY(kind, entity_key)
     );
     """
 )
-# NOTE: 'start_time' and 'end_time' are datetime objects represented as
-# a time string in the ISO-8601 format.
+con.execute(
+    """
+    CREATE INDEX IF NOT EXISTS entity_versions_change_id
+    ON entity_versions(change_id);
+    """
+)
+con.execute(
+    """
+    CREATE TABLE IF NOT EXISTS change_counter (
+    last_change_id INTEGER,
+    transaction_start INTEGER
+    );
+    """
+)
+con.execute("INSERT INTO change_counter SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM change_counter);")
+
+def bump(kind:str, key:str) -> str:
+    """! @brief Builds the statements of a trigger counting a change of an entity.
+    @param kind: string, the kind of the entity, e.g. "event"
+    @param key: string, the expression of its key, e.g. "new.event_id", "0" for the whole collection
+    @return string, the statements, to put in the body of a trigger
+    """
+    return (
+        "INSERT INTO entity_versions (kind,entity_key,version,base_version,change_id) " +
+        "VALUES ('" + kind + "'," + key + ",1,0,(SELECT last_change_id FROM change_counter)+1) " +
+        "ON CONFLICT(kind,entity_key) DO UPDATE SET " +
+        "base_version=CASE WHEN change_id > (SELECT transaction_start FROM change_counter) " +
+        "THEN base_version ELSE version END, " +
+        "version=version+1, change_id=excluded.change_id; " +
+        "UPDATE change_counter SET last_change_id=last_change_id+1; "
+    )
+
+# Each trigger counts the changes of the entities the cached outputs depend on
+change_triggers = (
+    ("users_changes_insert", "AFTER INSERT ON users", bump("user", "new.user_id")),
+    ("users_changes_update", "AFTER UPDATE ON users", bump("user", "new.user_id")),
+    ("users_changes_delete", "AFTER DELETE ON users", bump("user", "old.user_id")),
+    ("fairs_changes_insert", "AFTER INSERT ON fairs", bump("fairs", "0") + bump("fair", "new.fair_id")),
+    ("fairs_changes_update", "AFTER UPDATE ON fairs", bump("fairs", "0") + bump("fair", "new.fair_id")),
+    ("fairs_changes_delete", "AFTER DELETE ON fairs", bump("fairs", "0") + bump("fair", "old.fair_id")),
+    ("events_changes_insert", "AFTER INSERT ON events",
+     bump("events", "0") + bump("event", "new.event_id") + bump("fair", "new.fair_id")),
+    ("events_changes_update", "AFTER UPDATE ON events", bump("event", "new.event_id") + bump("fair", "new.fair_id")),
+    ("events_changes_rename", "AFTER UPDATE ON events WHEN old.name IS NOT new.name OR old.fair_id IS NOT new.fair_id",
+     bump("events", "0") + bump("fair", "old.fair_id")),
+    ("events_changes_delete", "AFTER DELETE ON events",
+     bump("events", "0") + bump("event", "old.event_id") + bump("fair", "old.fair_id")),
+    ("slots_changes_insert", "AFTER INSERT ON slots", bump("event", "new.event_id")),
+    ("slots_changes_update", "AFTER UPDATE ON slots", bump("event", "new.event_id")),
+    ("slots_changes_move", "AFTER UPDATE ON slots WHEN old.event_id IS NOT new.event_id", bump("event", "old.event_id")),
+    ("slots_changes_delete", "AFTER DELETE ON slots", bump("event", "old.event_id"))
+)
+for name, event, body in change_triggers:
+    con.execute("CREATE TRIGGER IF NOT EXISTS " + name + " " + event + " BEGIN " + body + "END;")
+# NOTE: 'kind' is one of user, fair, event, with the ID as 'entity_key', or
+# fairs, events for the whole collection, with 0 as 'entity_key'. 'change_id'
+# is the value of 'last_change_id' at the last change of the entity, and
+# 'base_version' the version before the first change of the transaction that
+# made it, see utils/db_connection.py.
 
 
 
 # Commit queries and close connection
 con.commit()
 con.close()
+
+# The tables rebuilt may hold references to deleted records, which the old
+# schema didn't remove. They are cleaned once, then the foreign keys keep them valid
+if rebuilt_tables:
+    print("Tables migrated to the current definition: " + ", ".join(rebuilt_tables))
+    for table, count in delete_orphans(db):
+        print("Removed " + str(count) + " references to deleted records from " + table)
 print("Database created successfully.")
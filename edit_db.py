@@ -1,87 +1,292 @@
-from dotenv import load_dotenv
-import os, sys
-
-# Load environment variables
-load_dotenv()
-db = os.getenv("DB_PATH")
-
-# Check environment variables existence
-if db is None or db=="":
-    sys.exit("Fatal error: database path not set. Insert it in your .env file.")
-else:
-    print("Database path loaded: " + db)
-
-
-
-from utils.db_print import print_users_by_id, print_users_by_name, print_fairs, print_events, \
-    print_events_with_fair, print_events_with_owner, print_event_slots
-from utils.db_write import insert_user, insert_fair, insert_event, create_slot, assign_slot
-from utils.db_write import update_user, update_fair, update_event, update_event_description, update_slot
-from utils.db_write import delete_user, delete_fair, delete_event, delete_slot
-
+"""!
+@file edit_db.py
+@brief Command-line tool to inspect and modify the database directly.
+
+This script exposes as a subcommand every function of <code>db_print.py</code>,
+<code>db_read.py</code> and <code>db_write.py</code> taking the path to the
+database as first parameter. The other parameters of the function become the
+arguments of the subcommand, the ones with a default value as options. Usage:
+
+<code>python edit_db.py [--db PATH] [--dry-run] [--json] COMMAND ARGS...</code>
+
+e.g. <code>python edit_db.py insert_fair "Job Fair" "Spring edition"</code> or
+<code>python edit_db.py print_fairs --description true</code>. Run
+<code>python edit_db.py --help</code> to list the commands, and
+<code>python edit_db.py COMMAND --help</code> for their arguments.
+
+Booleans are written as true/false, times as "YYYY-MM-DD HH:MM:SS", missing
+values as none, and lists in JSON. The records returned by the functions are
+written on standard output as they are produced, one per line, tab-separated or
+as JSON with <code>--json</code>.
+
+The <code>batch</code> command reads one command per line from the given files,
+or from standard input if none or "-" is given, and runs all of them in a single
+transaction: if a command fails, none of them is applied. Empty lines and lines
+starting with # are skipped. With <code>--dry-run</code> the commands are run
+and their output written, but every change is rolled back at the end.
+
+The users given a slot from a waitlist by a command, e.g. by
+<code>delete_user</code>, and the ones whose bookings are cancelled by
+<code>delete_event</code> or <code>delete_slot</code>, are notified through the
+bot once the changes are committed, if <code>BOT_TOKEN</code> is set, with the
+same messages the bot sends. <code>delete_fair</code> doesn't report the
+bookings of the events it deletes, so run <code>delete_event</code> on them
+first to warn their users.
+"""
+
+import os, sys, json, shlex, asyncio, inspect, argparse, fileinput, sqlite3, types
 from datetime import datetime
 
-
-
-
-
-######################################
-# Inspect the values in the database #
-######################################
-
-# print_users_by_id(db=db)
-# print_users_by_name(db=db)
-# print_fairs(db=db, description=False)
-
-# print_events(db=db, description=False)
-# print_events_with_fair(db=db)
-# print_events_with_owner(db=db)
-# print_event_slots(db=db, event_id=)
-
-
-
-
-
-#####################################
-# Insert new values in the database #
-#####################################
-
-# insert_user(db=db, user_id=, name=, username=)
-# insert_fair(db=db, name=, description=)
-# insert_event(db=db, fair_id=, owner_id=, name=, description=)
-
-# start_time = datetime(year=, month=, day=, hour=, minute=, second=)
-# end_time   = datetime(year=, month=, day=, hour=, minute=, second=)
-# create_slot(db=db, event_id=, start_time=start_time, end_time=end_time)
-
-# assign_slot(db=db, slot_id=, user_id=)
-
-
-
-
-
-#####################################
-# Modify the values in the database #
-#####################################
-
-# update_user(db=db, user_id=, name=, username=)
-# update_fair(db=db, fair_id=, name=, description=)
-# update_event(db=db, event_id=, fair_id=, owner_id=, name=, description=)
-# update_event_description(db=db, event_id=, description=)
-
-# start_time = datetime(year=, month=, day=, hour=, minute=, second=)
-# end_time   = datetime(year=, month=, day=, hour=, minute=, second=)
-# update_slot(db=db, slot_id=, event_id=, user_id=, start_time=start_time, end_time=end_time)
-
-
-
-
-
-###################################
-# Delete values from the database #
-###################################
-
-# delete_user(db=db, user_id=)
-# delete_fair(db=db, fair_id=)
-# delete_event(db=db, event_id=, delete_slots=True)
-# delete_slot(db=db, slot_id=)
+from telegram.error import TelegramError
+from telegram.ext import ExtBot
+
+from services.notifications import deliver_notifications, waitlist_message, slot_deleted_message, \
+    event_deleted_messages
+from utils.config import load_config
+from utils import db_print, db_read, db_write
+from utils.db_connection import batch
+from utils.records import RecordList
+
+# Modules whose functions are exposed as commands, the ones of db_print and
+# db_read don't modify the database
+READ_MODULES = (db_print, db_read)
+WRITE_MODULES = (db_write,)
+
+# Commands returning the slots given to users of the waitlists, as
+# (user_id, event_id, start_time, end_time)
+PROMOTING_COMMANDS = ("delete_user",)
+
+# Commands cancelling bookings, whose users are warned as the bot's handlers do
+CANCELLING_COMMANDS = ("delete_event", "delete_slot")
+
+# The slots given to users of the waitlists by the commands run, to notify
+promotions: list[tuple[int,int,int,int]] = []
+
+# The messages for the users whose bookings were cancelled by the commands run
+cancellations: dict[int, list[str]] = {}
+
+
+
+
+
+# Commands built from the functions
+
+def find_commands(modules:tuple) -> dict:
+    """! @brief Finds the public functions of some modules that take the database path.
+    @param modules: tuple, the modules to inspect
+    @return dictionary, the functions keyed by their name
+    """
+    commands = {}
+    for module in modules:
+        for name, function in vars(module).items():
+            if name.startswith("_") or not inspect.isfunction(function) or function.__module__ != module.__name__:
+                continue
+            if list(inspect.signature(function).parameters)[:1] == ["db"]:
+                commands[name] = function
+    return commands
+
+def parse_bool(text:str) -> bool:
+    """! @brief Converts a command-line argument to a boolean.
+    @param text: string, true/false, yes/no or 1/0
+    @return boolean, the value
+    """
+    value = text.strip().lower()
+    if value in ("true", "yes", "1"):
+        return True
+    if value in ("false", "no", "0"):
+        return False
+    raise argparse.ArgumentTypeError("expected true or false, got " + repr(text))
+
+def argument_type(annotation):
+    """! @brief Chooses the conversion of a command-line argument from the annotation of its parameter.
+    @param annotation: the annotation of the parameter
+    @return function, converting the argument string to the value passed to the function
+    """
+    if annotation is bool:
+        return parse_bool
+    if annotation is datetime:
+        return datetime.fromisoformat
+    if annotation in (int, str, float):
+        return annotation
+    if isinstance(annotation, types.UnionType) and type(None) in annotation.__args__:
+        inner = argument_type(next(arg for arg in annotation.__args__ if arg is not type(None)))
+        return lambda text: None if text.strip().lower() in ("none", "null") else inner(text)
+    # Lists and tuples, e.g. [["2024-05-13 10:00:00","2024-05-13 10:30:00"]]
+    return json.loads
+
+def command_brief(function) -> str|None:
+    """! @brief Extracts the brief description of a function from its docstring.
+    @param function: function, the function of the command
+    @return string, the text of the @brief tag, None if missing
+    """
+    lines = []
+    for line in (inspect.getdoc(function) or "").splitlines():
+        line = line.removeprefix("! ").strip()
+        if not line or (lines and line.startswith("@")):
+            break
+        lines.append(line.removeprefix("@brief "))
+    return " ".join(lines) or None
+
+def build_parser(commands:dict) -> argparse.ArgumentParser:
+    """! @brief Builds the parser of the command line, with a subcommand per function.
+    @param commands: dictionary, the functions keyed by their name
+    @return ArgumentParser, the parser
+    """
+    parser = argparse.ArgumentParser(description="Inspect and modify the database of the bot.")
+    parser.add_argument("--db", default=load_config().db, help="path to the database file, DB_PATH by default")
+    parser.add_argument("--dry-run", action="store_true", help="roll back every change at the end")
+    parser.add_argument("--json", action="store_true", help="write each record as JSON")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="COMMAND")
+
+    batch_parser = subparsers.add_parser("batch", help="run the commands read from files or standard input")
+    batch_parser.add_argument("files", nargs="*", help="files with one command per line, - for standard input")
+
+    for name, function in commands.items():
+        brief = command_brief(function)
+        subparser = subparsers.add_parser(name, help=brief, description=brief)
+        subparser.set_defaults(function=function)
+        for parameter in list(inspect.signature(function).parameters.values())[1:]:
+            convert = argument_type(parameter.annotation)
+            if parameter.default is inspect.Parameter.empty:
+                subparser.add_argument(parameter.name, type=convert)
+            else:
+                subparser.add_argument("--" + parameter.name, type=convert, default=parameter.default)
+    return parser
+
+
+
+
+
+# Execution
+
+def run(args:argparse.Namespace) -> None:
+    """! @brief Calls the function of a parsed command and writes its result.
+    @param args: Namespace, the parsed command line
+    @return None
+    """
+    parameters = vars(args).copy()
+    function = parameters.pop("function")
+    for option in ("db", "dry_run", "json", "command"):
+        parameters.pop(option)
+    if args.command == "delete_slot":
+        # The slot and its event are read before the slot is deleted
+        event_id, _, start_time, end_time = db_read.get_slot_from_id(args.db, parameters["slot_id"])
+        event_name = None if event_id is None else db_read.get_event_name(args.db, event_id)
+    elif args.command == "delete_event":
+        event_name = db_read.get_event_name(args.db, parameters["event_id"])
+    result = function(args.db, **parameters)
+    if args.command in PROMOTING_COMMANDS:
+        promotions.extend(result)
+    elif args.command in CANCELLING_COMMANDS and result and event_name is not None:
+        if args.command == "delete_slot":
+            messages = {result: [slot_deleted_message(event_name, start_time, end_time)]}
+        else:
+            messages = event_deleted_messages(event_name, result)
+        for user_id, pages in messages.items():
+            cancellations.setdefault(user_id, []).extend(pages)
+    write_result(result, args.json)
+
+def write_result(result, as_json:bool) -> None:
+    """! @brief Writes the value returned by a function, one record per line.
+    @param result: the value returned, lists are written one item per line
+    @param as_json: boolean, if True each record is written as JSON, otherwise tab-separated
+    @return None
+    """
+    if result is None:
+        return
+    for record in result if isinstance(result, (list, RecordList)) else [result]:
+        if as_json:
+            # The records of records.py become objects keyed by their field names
+            line = json.dumps(record._asdict() if hasattr(record, "_asdict") else record)
+        elif isinstance(record, (tuple, list)):
+            line = "\t".join("none" if value is None else str(value) for value in record)
+        else:
+            line = str(record)
+        sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+def notify_users(db:str) -> None:
+    """! @brief Notifies the users given a slot from a waitlist, or whose bookings were cancelled, by the commands run.
+    @param db: string, the path to the database file
+    @return None
+
+    Called once the changes are committed. If the bot can't be reached, e.g.
+    without a bot token, the IDs of the users are written on standard error
+    instead.
+    """
+    messages = {user_id: list(pages) for user_id, pages in cancellations.items()}
+    for user_id, event_id, start_time, end_time in promotions:
+        event_name = db_read.get_event_name(db, event_id)
+        # The event may have been deleted by a later command of the batch
+        if event_name is not None:
+            messages.setdefault(user_id, []).append(waitlist_message(event_name, start_time, end_time))
+    if not messages:
+        return
+    users = ", ".join(str(user_id) for user_id in messages)
+    token = load_config().bot_token
+    if token is None or token == "":
+        sys.stderr.write("BOT_TOKEN not set, users not notified: " + users + "\n")
+        return
+
+    async def send() -> None:
+        async with ExtBot(token) as bot:
+            await deliver_notifications(bot, messages, "edit_db")
+    try:
+        asyncio.run(send())
+    except TelegramError as exc:
+        sys.stderr.write("Bot unreachable (" + str(exc) + "), users not notified: " + users + "\n")
+
+def run_batch(parser:argparse.ArgumentParser, args:argparse.Namespace) -> None:
+    """! @brief Runs the commands of the batch files in a single transaction.
+    @param parser: ArgumentParser, the parser of a single command
+    @param args: Namespace, the parsed command line of the batch
+    @return None
+
+    The lines are read and run one at a time, so the output of a command is
+    written before the next one is read. The first failing command stops the
+    batch and rolls it back.
+    """
+    with batch(args.db, args.dry_run):
+        for line in fileinput.input(args.files or ("-",)):
+            if line.lstrip().startswith("#"):
+                continue
+            words = shlex.split(line)
+            if not words:
+                continue
+            where = fileinput.filename() + ":" + str(fileinput.filelineno())
+            if words[0] == "batch":
+                sys.exit(where + ": batch can't be nested, no change applied.")
+            try:
+                command = parser.parse_args(["--db", args.db] + words)
+            except SystemExit:
+                sys.exit(where + ": invalid command, no change applied.")
+            command.json = args.json
+            try:
+                run(command)
+            except (sqlite3.Error, ValueError, TypeError) as exc:
+                sys.exit(where + ": " + str(exc) + ", no change applied.")
+
+
+
+
+
+if __name__ == '__main__':
+    read_commands = find_commands(READ_MODULES)
+    parser = build_parser(read_commands | find_commands(WRITE_MODULES))
+    args = parser.parse_args()
+
+    # Check the database path existence
+    if args.db is None or args.db == "":
+        sys.exit("Fatal error: database path not set. Insert it in your .env file or use --db.")
+    if not os.path.isfile(args.db):
+        sys.exit("Fatal error: database file not found: " + args.db)
+
+    if args.command == "batch":
+        run_batch(parser, args)
+    elif args.command in read_commands:
+        run(args)
+    else:
+        with batch(args.db, args.dry_run):
+            run(args)
+    if not args.dry_run:
+        notify_users(args.db)
@@ -6,36 +6,32 @@ This file contains the implementation of the Telegram Bot Handlers that manage
 the lifecycle of the bookings associated to them, as well as the handlers that
 retrieve information about all events and fairs. They are triggered by the
 following commands: <code>/fairs</code>, <code>/events</code>, <code>/whoami</code>
-<code>/book</code>, <code>/unbook</code>, <code>/mybookings</code>.
+<code>/book</code>, <code>/unbook</code>, <code>/mybookings</code>. The booking
+can also start from a deep link, <code>/start book_&lt;event_id&gt;</code>.
 """
 
-from dotenv import load_dotenv
-import os
-
-# Load environment variables
-load_dotenv()
-db = os.getenv("DB_PATH")
-# Check of db existence is done in bot_main.py
-
-# In case of db error not detected by bot_main.py, like "no such table: users",
-# uncomment the following to check the working directory:
-# print(os.getcwd())
-
-# In case it's not the root directory,
-# change it to the root folder with the following:
-# os.chdir("path_to_root")
-
-
+import calendar
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, ConversationHandler
 
+from handlers.callback_router import encode_callback, ACTION_FAIR, ACTION_EVENT, ACTION_DAY, \
+    ACTION_MONTH, ACTION_SLOT, ACTION_NOOP, ACTION_WAIT, ACTION_CANCEL
+
 from utils.db_read import get_fairs, get_user_from_id, get_fair_from_id
 from utils.db_read import get_event_from_id, get_event_name, get_events_given_fair
-from utils.db_read import get_slot_from_id, get_slot_dates, get_slot_times, \
-    get_slots_given_user, count_slots
+from utils.db_read import get_slot_from_id, get_slots_given_user
+from utils.db_connection import read_session
 
-from utils.db_write import insert_user, assign_slot
+from utils.db_write import insert_user, book_slot, release_slot, join_waitlist
+from utils.render_cache import get_rendered, store_rendered
+from utils.availability import get_availability
+from utils.slot_time import format_time
+from handlers.message_builder import MessageBuilder, edit_with_pages, send_pages
+from services.notifications import notify_users, waitlist_message
+
+# Prefix of the /start parameter that opens the booking of an event
+BOOK_LINK_PREFIX = "book_"
 
 
 
@@ -52,21 +48,26 @@ async def select_fair(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     and <code>/book</code> commands.
 
     This function lists to the user all the fairs as an inline keyboard,
-    then goes to STATE 0
+    then goes to STATE 0. The keyboard is cached until a fair is modified.
     """
-    fair_list = get_fairs(db)
+    db = context.bot_data["config"].db
+    reply_markup = get_rendered(db, ("fair_keyboard",))
 
-    if not fair_list: # If fair_list is an empty list
-        await update.message.reply_text("No fairs registered yet.")
-        return ConversationHandler.END
+    if reply_markup is None:
+        fair_list = get_fairs(db)
 
-    keyboard = []
-    for fair_item in fair_list:
-        callback_data = "fair_id:" + str(fair_item[0])
-        keyboard.append([InlineKeyboardButton(fair_item[1], callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+        if not fair_list: # If fair_list is an empty list
+            await update.message.reply_text("No fairs registered yet.")
+            return ConversationHandler.END
+
+        keyboard = []
+        for fair_item in fair_list:
+            callback_data = encode_callback(ACTION_FAIR, fair_item.fair_id)
+            keyboard.append([InlineKeyboardButton(fair_item.name, callback_data=callback_data)])
+        keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
+
+        reply_markup = store_rendered(("fair_keyboard",), InlineKeyboardMarkup(keyboard), [("fairs",)])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Please select a fair:", reply_markup=reply_markup)
 
     return 0
@@ -80,19 +81,26 @@ async def show_fair_description(update: Update, context: ContextTypes.DEFAULT_TY
 
     STATE 0 for the <code>/fairs</code> command.
 
-    Expected callback pattern (as RegEx): <code>^fair_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_FAIR</code>, with fields (fair_id,)
 
     This function logs to the user the information on the selected fair,
-    then terminates the conversation.
+    then terminates the conversation. The text is cached until the fair
+    is modified.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    fair_id = int(query.data[8:]) # [8:] removes "fair_id:" prefix
-    fair_name, fair_description = get_fair_from_id(db, fair_id)
-    response = fair_name + ":\n\n" + fair_description
+    fair_id = context.callback_action.args[0]
+    pages = get_rendered(db, ("fair_text", fair_id))
 
-    await query.edit_message_text(text=response)
+    if pages is None:
+        fair_name, fair_description = get_fair_from_id(db, fair_id)
+        response = MessageBuilder(fair_name + ":\n\n")
+        response.add(fair_description)
+        pages = store_rendered(("fair_text", fair_id), response.pages(), [("fair", fair_id)])
+
+    await edit_with_pages(query, context, pages)
     return ConversationHandler.END
 
 
@@ -111,28 +119,34 @@ async def select_event(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     STATE 0 for <code>/events</code> and <code>/book</code> commands.
 
-    Expected callback pattern (as RegEx): <code>^fair_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_FAIR</code>, with fields (fair_id,)
 
     This function lists to the user the events associated to the selected fair,
-    as an inline keyboard, then goes to STATE 1
+    as an inline keyboard, then goes to STATE 1. The keyboard is cached until
+    an event is added to or removed from the fair.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    fair_id = int(query.data[8:])  # [8:] removes "fair_id:" prefix
-    event_list = get_events_given_fair(db, fair_id)
+    fair_id = context.callback_action.args[0]
+    reply_markup = get_rendered(db, ("event_keyboard", fair_id))
 
-    if not event_list: # If fair_list is an empty list
-        await query.edit_message_text("No events registered in this fair yet.")
-        return ConversationHandler.END
+    if reply_markup is None:
+        event_list = get_events_given_fair(db, fair_id)
 
-    keyboard = []
-    for event_item in event_list:
-        callback_data = "event_id:" + str(event_item[0])
-        keyboard.append([InlineKeyboardButton(event_item[3], callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+        if not event_list: # If fair_list is an empty list
+            await query.edit_message_text("No events registered in this fair yet.")
+            return ConversationHandler.END
+
+        keyboard = []
+        for event_item in event_list:
+            callback_data = encode_callback(ACTION_EVENT, event_item.event_id)
+            keyboard.append([InlineKeyboardButton(event_item.name, callback_data=callback_data)])
+        keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
+
+        reply_markup = store_rendered(("event_keyboard", fair_id), InlineKeyboardMarkup(keyboard), [("fair", fair_id)])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("Please select an event:", reply_markup=reply_markup)
 
     return 1
@@ -146,33 +160,44 @@ async def show_event_description(update: Update, context: ContextTypes.DEFAULT_T
 
     STATE 1 for the <code>/events</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
     This function logs to the user the information on the selected event,
-    then terminates the conversation.
+    then terminates the conversation. The text is cached until the event,
+    one of its slots or its owner is modified.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    event_id = int(query.data[9:]) # # [9:] removes "event_id:" prefix
-    _, owner_id, event_name, event_description = get_event_from_id(db, event_id)
-    owner_name, owner_username = get_user_from_id(db, owner_id)
-    free_slots, all_slots = count_slots(db, event_id)
+    event_id = context.callback_action.args[0]
+    pages = get_rendered(db, ("event_text", event_id))
 
-    response = "Event Details"
-    response += "\n\nName: " + event_name
-    response += "\n\nDescription: " + event_description
+    if pages is None:
+        with read_session(db):
+            _, owner_id, event_name, event_description = get_event_from_id(db, event_id)
+            owner_name, owner_username = get_user_from_id(db, owner_id)
+            free_slots, all_slots = get_availability(db, event_id).count()
 
-    if all_slots == 0:
-        response += "\n\nNo slot available yet."
-    elif free_slots == 0:
-        response += "\n\nAll the " + str(all_slots) + " slots are booked."
-    else:
-        response += "\n\nAvailable Slots: " + str(free_slots) + " out of " + str(all_slots)
+        response = MessageBuilder("Event Details")
+        response.add("\n\nName: " + event_name)
+        response.add("\n\nDescription: " + event_description)
 
-    response += "\n\nOwner: " + owner_name
-    response += "\nOwner Contact: " + owner_username
-    await query.edit_message_text(text=response)
+        if all_slots == 0:
+            response.add("\n\nNo slot available yet.")
+        elif free_slots == 0:
+            response.add("\n\nAll the " + str(all_slots) + " slots are booked.")
+        else:
+            response.add("\n\nAvailable Slots: " + str(free_slots) + " out of " + str(all_slots))
+
+        if owner_name is None:
+            # The owner deleted their account, the event is kept
+            response.add("\n\nOwner: no longer registered")
+        else:
+            response.add("\n\nOwner: " + owner_name + "\nOwner Contact: " + owner_username)
+        pages = store_rendered(("event_text", event_id), response.pages(), [("event", event_id), ("user", owner_id)])
+
+    await edit_with_pages(query, context, pages)
 
     return ConversationHandler.END
 
@@ -191,6 +216,7 @@ async def whoami(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     This function logs all the information associated to the current user.
     """
+    db = context.bot_data["config"].db
     user_id = update.effective_chat.id
     name, username = get_user_from_id(db, user_id)
 
@@ -212,6 +238,29 @@ async def whoami(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 # book - INIT
 # It's again select_fair
 
+# book - INIT from a deep link
+async def book_from_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief INIT state for /book, reached from a deep link
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
+
+    Conversation initializer for the <code>/book</code> command, triggered by
+    <code>/start book_&lt;event_id&gt;</code>, i.e. by opening the link of an inline query
+    result. The fair and event selection are skipped.
+
+    This function shows to the user the calendar of the first month with free
+    slots for the event in the link, as an inline keyboard, then goes to STATE 2.
+    """
+    db = context.bot_data["config"].db
+    event_id = int(context.args[0][len(BOOK_LINK_PREFIX):])
+    response, reply_markup = slot_date_prompt(db, event_id)
+    await update.message.reply_text(response, reply_markup=reply_markup)
+
+    if reply_markup is None:
+        return ConversationHandler.END
+    return 2
+
 # book - STATE 0
 # It's again select_event
 
@@ -224,43 +273,179 @@ async def select_slot_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     STATE 1 for the <code>/book</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
-    This function lists to the user the dates available for the slots
-    associated to a given event, as an inline keyboard, then goes to STATE 2
+    This function shows to the user the calendar of the first month with free
+    slots for the given event, as an inline keyboard, then goes to STATE 2
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    event_id = int(query.data[9:]) # [9:] removes "event_id:" prefix
-    event_name = get_event_name(db, event_id)
-    free_slots, all_slots = count_slots(db, event_id)
+    event_id = context.callback_action.args[0]
+    response, reply_markup = slot_date_prompt(db, event_id)
+    await query.edit_message_text(response, reply_markup=reply_markup)
 
-    if all_slots == 0:
-        await query.edit_message_text("No slot available yet.")
-        return ConversationHandler.END
-    elif free_slots == 0:
-        await query.edit_message_text("All the " + str(all_slots) + " slots are booked.")
+    if reply_markup is None:
         return ConversationHandler.END
+    return 2
 
-    slot_dates = get_slot_dates(db, event_id)
-    if not slot_dates:
-        # Thanks to the previous two ifs this one shall never happen,
-        # but just in case I keep it.
-        await query.edit_message_text("No dates available for this event.")
-        return ConversationHandler.END
+# book - STATE 2, month navigation
+async def change_slot_month(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief STATE 2 for /book, when the user changes month
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
 
-    keyboard = []
-    for date_item in slot_dates:
-        callback_data = "event_id:" + str(event_id) + ":day:" + date_item[0]
-        keyboard.append([InlineKeyboardButton(date_item[0], callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+    STATE 2 for the <code>/book</code> command.
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text("Please select a day for " + event_name + ":", reply_markup=reply_markup)
+    Expected callback action: <code>ACTION_MONTH</code>, with fields (event_id,month)
+
+    This function replaces the calendar with the one of the selected month,
+    then stays in STATE 2.
+    """
+    db = context.bot_data["config"].db
+    query = update.callback_query
+    await query.answer()
 
+    event_id, month = context.callback_action.args
+    response, reply_markup = slot_date_prompt(db, event_id, month)
+    await query.edit_message_text(response, reply_markup=reply_markup)
+
+    if reply_markup is None:
+        return ConversationHandler.END
     return 2
 
+# book - STATE 2, waitlist
+async def wait_for_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief STATE 2 for /book, when all the slots are booked
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
+
+    STATE 2 for the <code>/book</code> command.
+
+    Expected callback action: <code>ACTION_WAIT</code>, with fields (event_id,)
+
+    This function adds the user to the waitlist of the event and tells them
+    their position, then terminates the conversation. If a slot has become free
+    meanwhile, the calendar is shown instead, and the conversation stays in STATE 2.
+    """
+    db = context.bot_data["config"].db
+    query = update.callback_query
+    await query.answer()
+
+    event_id = context.callback_action.args[0]
+    user_id = update.effective_chat.id
+    # The last name and the username are optional on Telegram
+    chat = update.effective_chat
+    user_name = " ".join(filter(None, (chat.first_name, chat.last_name)))
+    user_username = "@" + chat.username if chat.username else ""
+    insert_user(db,user_id,user_name,user_username)
+
+    position = join_waitlist(db, event_id, user_id)
+    if position is None:
+        response, reply_markup = slot_date_prompt(db, event_id)
+        await query.edit_message_text(response, reply_markup=reply_markup)
+        return 2 if reply_markup is not None else ConversationHandler.END
+
+    response = "You joined the waitlist of " + get_event_name(db, event_id) + ".\n"
+    response += "Your position: " + str(position) + "\n\n"
+    response += "When a slot becomes free, it will be booked for you and you will be notified."
+    await query.edit_message_text(response)
+    return ConversationHandler.END
+
+def slot_date_prompt(db:str, event_id:int, month:str|None=None) -> tuple[str, InlineKeyboardMarkup|None]:
+    """! @brief Builds the message asking for the day of the booking.
+    @param db: string, the path to the database file
+    @param event_id: integer, the event to book
+    @param month: string, the month to show as "YYYY-MM", None for the first
+    month with free slots
+    @return response: string, the text of the message
+    @return reply_markup: InlineKeyboardMarkup, the calendar of the month, or
+    the button to join the waitlist if all the slots are booked, None if the
+    event can't be booked and the conversation must end
+
+    The free slots are read from the in-memory index of the event, and the
+    calendar of each month is cached until a slot of the event is created,
+    deleted, booked or unbooked.
+    """
+    event_availability = get_availability(db, event_id)
+    first_month, last_month = event_availability.free_months()
+
+    if first_month is None:
+        if get_event_name(db, event_id) is None:
+            return "This event doesn't exist anymore.", None
+        free_slots, all_slots = event_availability.count()
+        if all_slots == 0:
+            return "No slot available yet.", None
+        response = "All the " + str(all_slots) + " slots are booked.\n"
+        response += "Join the waitlist to get the first slot that becomes free, you will be notified."
+        keyboard = [
+            [InlineKeyboardButton("Join the waitlist", callback_data=encode_callback(ACTION_WAIT, event_id))],
+            [InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)]
+        ]
+        return response, InlineKeyboardMarkup(keyboard)
+
+    # Months are compared as strings, "YYYY-MM" sorts chronologically
+    month = first_month if month is None else min(max(month, first_month), last_month)
+    prompt = get_rendered(db, ("calendar", event_id, month))
+    if prompt is None:
+        prompt = store_rendered(
+            ("calendar", event_id, month),
+            calendar_prompt(db, event_id, month, first_month, last_month),
+            [("event", event_id)]
+        )
+    return prompt
+
+def calendar_prompt(db:str, event_id:int, month:str, first_month:str, last_month:str) -> tuple[str, InlineKeyboardMarkup]:
+    """! @brief Builds the calendar of the days with free slots in a month.
+    @param db: string, the path to the database file
+    @param event_id: integer, the event to book
+    @param month: string, the month to show, as "YYYY-MM"
+    @param first_month: string, the first month with free slots, as "YYYY-MM"
+    @param last_month: string, the last month with free slots, as "YYYY-MM"
+    @return response: string, the text of the message
+    @return reply_markup: InlineKeyboardMarkup, the calendar
+
+    The keyboard has a row to move between the months with free slots, a row
+    with the weekdays, and a row for each week. Only the days with free slots
+    show their number and can be selected, the others are placeholders.
+    """
+    event_name = get_event_name(db, event_id)
+    free_per_day = dict(get_availability(db, event_id).free_per_day(month))
+    year, month_number = int(month[:4]), int(month[5:])
+
+    previous_button = InlineKeyboardButton(" ", callback_data=ACTION_NOOP)
+    if month > first_month:
+        previous_month = "%04d-%02d" % ((year, month_number - 1) if month_number > 1 else (year - 1, 12))
+        previous_button = InlineKeyboardButton("<", callback_data=encode_callback(ACTION_MONTH, event_id, previous_month))
+    next_button = InlineKeyboardButton(" ", callback_data=ACTION_NOOP)
+    if month < last_month:
+        next_month = "%04d-%02d" % ((year, month_number + 1) if month_number < 12 else (year + 1, 1))
+        next_button = InlineKeyboardButton(">", callback_data=encode_callback(ACTION_MONTH, event_id, next_month))
+    month_button = InlineKeyboardButton(calendar.month_name[month_number] + " " + str(year), callback_data=ACTION_NOOP)
+
+    keyboard = [
+        [previous_button, month_button, next_button],
+        [InlineKeyboardButton(day_name, callback_data=ACTION_NOOP) for day_name in calendar.day_abbr]
+    ]
+    for week in calendar.monthcalendar(year, month_number):
+        row = []
+        for day in week:
+            slot_date = month + "-%02d" % day
+            if slot_date in free_per_day:
+                row.append(InlineKeyboardButton(str(day), callback_data=encode_callback(ACTION_DAY, event_id, slot_date)))
+            else:
+                row.append(InlineKeyboardButton("·" if day else " ", callback_data=ACTION_NOOP))
+        keyboard.append(row)
+    keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
+
+    free_slots = sum(free_per_day.values())
+    response = "Please select a day for " + event_name + ":\n"
+    response += "Free slots in " + calendar.month_name[month_number] + " " + str(year) + ": " + str(free_slots)
+    return response, InlineKeyboardMarkup(keyboard)
+
 # book - STATE 2
 async def select_slot_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """! @brief STATE 2 for /book
@@ -270,21 +455,19 @@ async def select_slot_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     STATE 2 for the <code>/book</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*:day:[0-9|-]*$</code>
+    Expected callback action: <code>ACTION_DAY</code>, with fields (event_id,slot_day)
 
     This function lists to the user the time available for the slots
     associated to the given event-date pair, as an inline keyboard,
     then goes to STATE 3
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    callback_data = query.data[9:] # [9:] removes "event_id:" prefix
-    column_position = callback_data.find(":")
-    event_id = int(callback_data[:column_position])
-    slot_date = callback_data[column_position+5:] # +5 removes ":day:" infix
+    event_id, slot_date = context.callback_action.args
     event_name = get_event_name(db, event_id)
-    slot_times = get_slot_times(db,event_id,slot_date)
+    slot_times = get_availability(db, event_id).free_times(slot_date)
 
     if not slot_times:
         # Thanks to the checks in previous function, this shall never happen,
@@ -294,10 +477,10 @@ async def select_slot_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     keyboard = []
     for time_item in slot_times:
-        callback_data = "slot_id:" + str(time_item[0])
-        text_data = time_item[1] + " - " + time_item[2]
+        callback_data = encode_callback(ACTION_SLOT, time_item.slot_id)
+        text_data = time_item.start_time + " - " + time_item.end_time
         keyboard.append([InlineKeyboardButton(text_data, callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+    keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     text_data = "Please select a time for " + event_name + ", " + slot_date + ":"
@@ -314,28 +497,45 @@ async def book_event(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     STATE 3 for the <code>/book</code> command.
 
-    Expected callback pattern (as RegEx): <code>^slot_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_SLOT</code>, with fields (slot_id,)
 
     This function books a slot for the user and logs its information,
-    then terminates the conversation.
+    then terminates the conversation. The slot is not booked if it has been
+    taken meanwhile, or if it overlaps another booking of the user.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    slot_id = int(query.data[8:]) # [8:] removes "slot_id:" prefix
+    slot_id = context.callback_action.args[0]
     user_id = update.effective_chat.id
-    user_name = update.effective_chat.first_name + " " + update.effective_chat.last_name
-    user_username = "@" + update.effective_chat.username
+    # The last name and the username are optional on Telegram
+    chat = update.effective_chat
+    user_name = " ".join(filter(None, (chat.first_name, chat.last_name)))
+    user_username = "@" + chat.username if chat.username else ""
     insert_user(db,user_id,user_name,user_username)
 
-    assign_slot(db,slot_id,user_id)
-    event_id, _, start_time, end_time = get_slot_from_id(db,slot_id)
-    event_name = get_event_name(db, event_id)
+    booked, conflict = book_slot(db,slot_id,user_id)
+    if conflict is not None:
+        conflict_event_id, conflict_start, conflict_end = conflict
+        response = "You have already booked a slot at the same time, operation cancelled.\n\n"
+        response += "Event: " + get_event_name(db, conflict_event_id) + "\n"
+        response += "Start time: " + format_time(conflict_start) + "\n"
+        response += "End time: " + format_time(conflict_end)
+        await query.edit_message_text(text=response)
+        return ConversationHandler.END
+    if not booked:
+        await query.edit_message_text(text="This slot is not available anymore, operation cancelled.")
+        return ConversationHandler.END
+
+    with read_session(db):
+        event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
+        event_name = get_event_name(db, event_id)
 
     response = "Booking completed successfully!\n\nDetails\n"
     response += "Event: " + event_name + "\n"
-    response += "Start time: " + start_time + "\n"
-    response += "End time: " + end_time + "\n"
+    response += "Start time: " + format_time(start_time) + "\n"
+    response += "End time: " + format_time(end_time) + "\n"
     response += "User: " + user_name
 
     await query.edit_message_text(text=response)
@@ -357,6 +557,7 @@ async def select_slot_for_user(update: Update, context: ContextTypes.DEFAULT_TYP
     This function lists to the user the slots booked by them as an inline keyboard,
     then goes to STATE 0
     """
+    db = context.bot_data["config"].db
     user_id = update.effective_chat.id
     slot_list = get_slots_given_user(db, user_id)
 
@@ -366,10 +567,10 @@ async def select_slot_for_user(update: Update, context: ContextTypes.DEFAULT_TYP
 
     keyboard = []
     for slot_item in slot_list:
-        callback_data = "slot_id:" + str(slot_item[0])
-        response = slot_item[4] + ": " + slot_item[2]
+        callback_data = encode_callback(ACTION_SLOT, slot_item.slot_id)
+        response = slot_item.event_name + ": " + format_time(slot_item.start_time)
         keyboard.append([InlineKeyboardButton(response, callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+    keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Which book do you want to cancel:", reply_markup=reply_markup)
@@ -385,28 +586,30 @@ async def confirm_unbook_slot(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     STATE 0 for the <code>/unbook</code> command.
 
-    Expected callback pattern (as RegEx): <code>^slot_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_SLOT</code>, with fields (slot_id,)
 
     This function asks the user to confirm they want to un-book the selected slot,
     through an inline keyboard, then goes to STATE 1
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    slot_id = int(query.data[8:]) # [8:] removes "slot_id:" prefix
-    event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
-    event_name = get_event_name(db, event_id)
+    slot_id = context.callback_action.args[0]
+    with read_session(db):
+        event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
+        event_name = get_event_name(db, event_id)
 
-    callback_data = "slot_id:" + str(slot_id)
+    callback_data = encode_callback(ACTION_SLOT, slot_id)
     keyboard = [
         [InlineKeyboardButton("Unbook slot", callback_data=callback_data)],
-        [InlineKeyboardButton("/cancel", callback_data="cancel")]
+        [InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)]
     ]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     response = "Are you sure you want to unbook:\n"
     response += event_name + "\n"
-    response += start_time + " -\n" + end_time + "?"
+    response += format_time(start_time) + " -\n" + format_time(end_time) + "?"
     await query.edit_message_text(response, reply_markup=reply_markup)
 
     return 1
@@ -420,27 +623,36 @@ async def unbook_slot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
     STATE 1 for the <code>/unbook</code> command.
 
-    Expected callback pattern (as RegEx): <code>^slot_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_SLOT</code>, with fields (slot_id,)
 
     This function un-books a slot and logs the information it had,
-    then terminates the conversation.
+    then terminates the conversation. If other students are waiting for
+    the event, the slot goes to the first of them, who is notified.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    slot_id = int(query.data[8:]) # [8:] removes "slot_id:" prefix
-    event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
-    event_name = get_event_name(db, event_id)
+    slot_id = context.callback_action.args[0]
+    with read_session(db):
+        event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
+        event_name = get_event_name(db, event_id)
 
-    assign_slot(db, slot_id, None)
+    promoted = release_slot(db, slot_id)
 
     response = "Unooking completed successfully!\n\nDetails\n"
     response += "Event: " + event_name + "\n"
-    response += "Start time: " + start_time + "\n"
-    response += "End time: " + end_time + "\n"
-    response += "The slot is now available"
+    response += "Start time: " + format_time(start_time) + "\n"
+    response += "End time: " + format_time(end_time) + "\n"
+    if promoted is None:
+        response += "The slot is now available"
+    else:
+        response += "The slot has been given to a student in the waitlist"
     await query.edit_message_text(response)
 
+    if promoted is not None:
+        notify_users(context, {promoted: [waitlist_message(event_name, start_time, end_time)]}, "waitlist")
+
     return ConversationHandler.END
 
 
@@ -457,8 +669,9 @@ async def my_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     Command handler for the <code>/mybookings</code> command.
 
     This function logs the information of all the slots associated
-    to the current user.
+    to the current user, split into several messages if too long.
     """
+    db = context.bot_data["config"].db
     user_id = update.effective_chat.id
     slot_list = get_slots_given_user(db, user_id)
 
@@ -467,11 +680,13 @@ async def my_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
         return
 
-    response = "You have the following bookings:\n\n"
+    response = MessageBuilder("You have the following bookings:\n\n")
     for slot_item in slot_list:
-        response += slot_item[4] + "\n"
-        response += "start: " + slot_item[2] + "\n"
-        response += "end:   " + slot_item[3] + "\n\n"
+        response.add(
+            slot_item.event_name + "\n" +
+            "start: " + format_time(slot_item.start_time) + "\n" +
+            "end:   " + format_time(slot_item.end_time) + "\n\n"
+        )
 
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+    await send_pages(context, update.effective_chat.id, response.pages())
     return
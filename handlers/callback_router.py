@@ -0,0 +1,169 @@
+"""!
+@file callback_router.py
+@brief Compact callback data codec and constant-time callback dispatching.
+
+This file contains the implementation of the encoding used for the
+<code>callback_data</code> of the inline keyboards, together with a handler
+that routes callback queries to the proper function through a dictionary
+keyed by the action prefix. The callback data is parsed once into typed fields,
+that the routed function finds in <code>context.callback_action</code>.
+
+A callback data string is made of an action code followed by its fields,
+all separated by colons, e.g. <code>e:42</code> or <code>d:42:2024-05-13</code>.
+"""
+
+from functools import lru_cache
+from typing import Any, NamedTuple
+
+from telegram import Update
+from telegram.ext import BaseHandler
+
+from services.log_pipeline import bind_handler
+
+
+
+
+
+# Action codes, each one followed by the types of its fields
+
+ACTION_FAIR = "f"   # (fair_id,)
+ACTION_EVENT = "e"  # (event_id,)
+ACTION_DAY = "d"    # (event_id, slot_day)
+ACTION_MONTH = "m"  # (event_id, month)
+ACTION_SLOT = "s"   # (slot_id,)
+ACTION_PAGE = "p"   # (page,)
+ACTION_NOOP = "n"   # (), placeholder buttons
+ACTION_WAIT = "w"   # (event_id,)
+ACTION_CANCEL = "x" # ()
+
+ACTION_FIELDS: dict[str, tuple[type, ...]] = {
+    ACTION_FAIR: (int,),
+    ACTION_EVENT: (int,),
+    ACTION_DAY: (int, str),
+    ACTION_MONTH: (int, str),
+    ACTION_SLOT: (int,),
+    ACTION_PAGE: (int,),
+    ACTION_NOOP: (),
+    ACTION_WAIT: (int,),
+    ACTION_CANCEL: (),
+}
+
+# Telegram refuses callback data longer than this, in bytes
+MAX_CALLBACK_DATA = 64
+
+
+
+class CallbackAction(NamedTuple):
+    """! @brief Parsed callback data.
+
+    The action code and its fields, already converted to the types declared
+    in <code>ACTION_FIELDS</code>.
+    """
+    action: str
+    args: tuple[Any, ...]
+
+
+
+
+
+# Codec
+
+def encode_callback(action:str, *args:Any) -> str:
+    """! @brief Builds the callback data for an inline keyboard button.
+    @param action: string, one of the ACTION_* codes
+    @param args: the fields of the action, in the order declared in ACTION_FIELDS
+    @return string, the callback data
+
+    This function joins the action code and its fields with colons. A ValueError
+    is raised if the number of fields doesn't match the action, or if the result
+    exceeds the 64 bytes allowed by Telegram.
+    """
+    if len(args) != len(ACTION_FIELDS[action]):
+        raise ValueError("Wrong number of fields for callback action " + action)
+
+    data = ":".join((action,) + tuple(str(arg) for arg in args))
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError("Callback data too long: " + data)
+    return data
+
+@lru_cache(maxsize=1024)
+def decode_callback(data:str) -> CallbackAction|None:
+    """! @brief Parses the callback data of an inline keyboard button.
+    @param data: string, the callback data
+    @return CallbackAction, the action code and its typed fields,
+    None if the data is not valid
+
+    This function is the inverse of <code>encode_callback</code>. Results are
+    cached, so the same data is parsed only once even if several routers
+    inspect the same update.
+    """
+    action, *fields = data.split(":", len(ACTION_FIELDS.get(data[:1], ())))
+    types = ACTION_FIELDS.get(action)
+    if types is None or len(fields) != len(types):
+        return None
+
+    try:
+        args = tuple(field_type(field) for field_type, field in zip(types, fields))
+    except ValueError:
+        return None
+    return CallbackAction(action, args)
+
+
+
+
+
+# Router
+
+class CallbackRouter(BaseHandler):
+    """! @brief Handler that dispatches callback queries by action code.
+
+    The router is initialized with a dictionary mapping action codes to
+    callback functions. Checking an update costs one dictionary lookup,
+    regardless of how many actions are registered. Updates with an unknown
+    or invalid action are handled by <code>default</code>, if given.
+    The parsed data is exposed to the callback as <code>context.callback_action</code>.
+    """
+
+    __slots__ = ("routes", "default")
+
+    def __init__(self, routes:dict, default=None, block:bool=True):
+        """! @brief Initializes the router.
+        @param routes: dictionary, maps each action code to its callback function
+        @param default: callback function for the unmatched callback queries,
+        if None they are not handled
+        @param block: boolean, same meaning as in the other PTB handlers
+        """
+        super().__init__(default, block=block)
+        self.routes = routes
+        self.default = default
+
+    def check_update(self, update:object) -> tuple|None:
+        """! @brief Selects the callback function for an update.
+        @param update: object, the update to check
+        @return tuple, the selected function and the parsed callback data,
+        None if the update is not handled by this router
+        """
+        if not isinstance(update, Update) or update.callback_query is None:
+            return None
+        data = update.callback_query.data
+        if not isinstance(data, str):
+            return None
+
+        callback_action = decode_callback(data)
+        callback = None
+        if callback_action is not None:
+            callback = self.routes.get(callback_action.action)
+        if callback is None:
+            callback = self.default
+        if callback is None:
+            return None
+        return callback, callback_action
+
+    async def handle_update(self, update, application, check_result, context):
+        """! @brief Runs the callback function selected by <code>check_update</code>.
+        @return the value returned by the callback, i.e. the next state
+        """
+        callback, callback_action = check_result
+        context.callback_action = callback_action
+        bind_handler(callback.__name__)
+        return await callback(update, context)
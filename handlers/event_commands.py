@@ -8,34 +8,26 @@ following commands: <code>/publish</code>, <code>/changedes</code>, <code>/newsl
 <code>/deleteslot</code>, <code>/deleteevent</code>, <code>/myevents</code>.
 """
 
-from dotenv import load_dotenv
 from datetime import datetime
-import os, re
-
-# Load environment variables
-load_dotenv()
-db = os.getenv("DB_PATH")
-# Check of db existence is done in bot_main.py
-
-# In case of db error not detected by bot_main.py, like "no such table: users",
-# uncomment the following to check the working directory:
-# print(os.getcwd())
-
-# In case it's not the root directory,
-# change it to the root folder with the following:
-# os.chdir("path_to_root")
-
-
+import re
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, ConversationHandler
 
+from handlers.callback_router import encode_callback, ACTION_FAIR, ACTION_EVENT, ACTION_SLOT, \
+    ACTION_CANCEL
+
 from utils.db_read import get_fairs, get_user_from_id, get_fair_from_id
 from utils.db_read import get_event_from_id, get_event_name, get_events_given_owner
 from utils.db_read import get_slot_from_id, get_slots_given_event
+from utils.db_connection import read_session
 
-from utils.db_write import insert_user, insert_event, create_slot_str
+from utils.db_write import insert_user, insert_event, create_slots_str
 from utils.db_write import update_event_description, delete_slot, delete_event
+from utils.render_cache import get_rendered, store_rendered
+from utils.slot_time import format_time
+from handlers.message_builder import MessageBuilder, edit_with_pages
+from services.notifications import notify_users, slot_deleted_message, event_deleted_messages
 
 
 
@@ -65,22 +57,31 @@ async def ask_event_fair(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     STATE 0 for the <code>/publish</code> command.
 
-    This function lists to the user the fairs as an inline keyboard,
-    then goes to STATE 1
+    This function stores the typed event name in the conversation data and
+    lists to the user the fairs as an inline keyboard, then goes to STATE 1.
+    The keyboard is the same cached by <code>select_fair</code>.
     """
-    fair_list = get_fairs(db)
+    db = context.bot_data["config"].db
+    reply_markup = get_rendered(db, ("fair_keyboard",))
 
-    if not fair_list: # If fair_list is an empty list
-        await update.message.reply_text("No fairs registered yet, operation cancelled.")
-        return ConversationHandler.END
+    if reply_markup is None:
+        fair_list = get_fairs(db)
 
-    keyboard = []
-    for fair_item in fair_list:
-        callback_data = "fair_id:" + str(fair_item[0]) + ":name:" + update.message.text
-        keyboard.append([InlineKeyboardButton(fair_item[1], callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+        if not fair_list: # If fair_list is an empty list
+            await update.message.reply_text("No fairs registered yet, operation cancelled.")
+            return ConversationHandler.END
+
+        keyboard = []
+        for fair_item in fair_list:
+            callback_data = encode_callback(ACTION_FAIR, fair_item.fair_id)
+            keyboard.append([InlineKeyboardButton(fair_item.name, callback_data=callback_data)])
+        keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
+
+        reply_markup = store_rendered(("fair_keyboard",), InlineKeyboardMarkup(keyboard), [("fairs",)])
+
+    # The name is kept server-side, the buttons carry only the fair ID
+    context.user_data["event_name"] = update.message.text
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Please select a fair:", reply_markup=reply_markup)
 
     return 1
@@ -94,23 +95,27 @@ async def log_event_creation(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     STATE 1 for the <code>/publish</code> command.
 
-    Expected callback pattern (as RegEx): <code>^fair_id:[0-9]*:name:</code>
+    Expected callback action: <code>ACTION_FAIR</code>, with fields (fair_id,)
 
-    This function creates an event and logs its information,
-    then terminates the conversation.
+    This function creates an event, named after the text stored in STATE 0,
+    and logs its information, then terminates the conversation.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    callback_data = query.data[8:]  # [8:] removes "fair_id:" prefix
-    column_position = callback_data.find(":")
-    fair_id = int(callback_data[:column_position])
-    event_name = callback_data[column_position + 6:]  # +6 removes ":name:" infix
+    fair_id = context.callback_action.args[0]
+    event_name = context.user_data.pop("event_name", None)
+    if event_name is None:
+        await query.edit_message_text("This request has expired, operation cancelled.")
+        return ConversationHandler.END
     fair_name, _ = get_fair_from_id(db, fair_id)
 
     user_id = update.effective_chat.id
-    user_name = update.effective_chat.first_name + " " + update.effective_chat.last_name
-    user_username = "@" + update.effective_chat.username
+    # The last name and the username are optional on Telegram
+    chat = update.effective_chat
+    user_name = " ".join(filter(None, (chat.first_name, chat.last_name)))
+    user_username = "@" + chat.username if chat.username else ""
 
     insert_user(db, user_id, user_name, user_username)
     insert_event(db,fair_id,user_id,event_name,"")
@@ -143,17 +148,34 @@ async def ask_event_description(update: Update, context: ContextTypes.DEFAULT_TY
     return 0
 
 # changedes - STATE 0
-async def select_user_event_after_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def select_user_event_after_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief STATE 0 for /changedes
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
+
+    STATE 0 for the <code>/changedes</code> command.
+
+    This function stores the typed description and lists to the user their
+    own events, see <code>select_user_event_after_text</code>.
+    """
+    return await select_user_event_after_text(update, context, "description_text")
+
+async def select_user_event_after_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text_key:str) -> int:
     """! @brief STATE 0 for /changedes and /newslot
     @param update: Update, Telegram parameters
     @param context: ContextTypes, library status
+    @param text_key: string, the key of the text in the user data, one per command
+    so that the two conversations don't overwrite each other's text
     @return integer, the next state
 
     STATE 0 for <code>/changedes</code> and <code>/newslot</code> commands.
 
-    This function lists to the user their own events as an inline keyboard,
-    then goes to STATE 1
+    This function stores the typed text (a description or the slot times)
+    in the conversation data and lists to the user their own events as an
+    inline keyboard, then goes to STATE 1
     """
+    db = context.bot_data["config"].db
     user_id = update.effective_chat.id
     event_list = get_events_given_owner(db, user_id)
 
@@ -161,11 +183,14 @@ async def select_user_event_after_text(update: Update, context: ContextTypes.DEF
         await update.message.reply_text("You have no events yet, operation cancelled.")
         return ConversationHandler.END
 
+    # The text is kept server-side, the buttons carry only the event ID
+    context.user_data[text_key] = update.message.text
+
     keyboard = []
     for event_item in event_list:
-        callback_data = "event_id:" + str(event_item[0]) + ":des:" + update.message.text
-        keyboard.append([InlineKeyboardButton(event_item[3], callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+        callback_data = encode_callback(ACTION_EVENT, event_item.event_id)
+        keyboard.append([InlineKeyboardButton(event_item.name, callback_data=callback_data)])
+    keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Please select an event of yours:", reply_markup=reply_markup)
@@ -181,29 +206,31 @@ async def log_description_update(update: Update, context: ContextTypes.DEFAULT_T
 
     STATE 1 for the <code>/changedes</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*:des:</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
-    This function changes an event description and logs its information,
-    then terminates the conversation.
+    This function changes an event description, using the text stored in
+    STATE 0, and logs its information, then terminates the conversation.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    callback_data = query.data[9:] # [9:] removes "event_id:" prefix
-    column_position = callback_data.find(":")
-    event_id = int(callback_data[:column_position])
-    event_description = callback_data[column_position + 5:]  # +6 removes ":des:" infix
+    event_id = context.callback_action.args[0]
+    event_description = context.user_data.pop("description_text", None)
+    if event_description is None:
+        await query.edit_message_text("This request has expired, operation cancelled.")
+        return ConversationHandler.END
     user_id = update.effective_chat.id
     event_name = get_event_name(db,event_id)
     user_name, _ = get_user_from_id(db,user_id)
 
     update_event_description(db,event_id,event_description)
 
-    response = "Description updated successfully!\n\nDetails\n"
-    response += "Event: " + event_name + "\n"
-    response += "Description: " + event_description + "\n"
-    response += "Owner: " + user_name
-    await query.edit_message_text(response)
+    response = MessageBuilder("Description updated successfully!\n\nDetails\n")
+    response.add("Event: " + event_name + "\n")
+    response.add("Description: " + event_description + "\n")
+    response.add("Owner: " + user_name)
+    await edit_with_pages(query, context, response.pages())
 
     return ConversationHandler.END
 
@@ -220,16 +247,28 @@ async def ask_event_date(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     Conversation initializer for the <code>/newslot</code> command.
 
-    This function asks the user an event time for the slot, then goes to STATE 0
+    This function asks the user the times of one or more slots, then goes to STATE 0
     """
     response = "Please, type the time of your event, in the following format:\n\n"
     response += "YYYY-MM-DD HH:MM:SS\nYYYY-MM-DD HH:MM:SS\n\n"
-    response += "Where first row is starting time and second row is end time."
+    response += "Where first row is starting time and second row is end time.\n"
+    response += "To create several slots at once, type more pairs of rows, one after the other."
     await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
     return 0
 
 # newslot - STATE 0
-# It's again select_user_event_after_text
+async def select_user_event_after_slots(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief STATE 0 for /newslot
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
+
+    STATE 0 for the <code>/newslot</code> command.
+
+    This function stores the typed slot times and lists to the user their
+    own events, see <code>select_user_event_after_text</code>.
+    """
+    return await select_user_event_after_text(update, context, "slot_text")
 
 # newslot - STATE 1
 async def log_slot_creation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -240,56 +279,77 @@ async def log_slot_creation(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     STATE 1 for the <code>/newslot</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*:des:</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
-    This function creates a slot and logs its information,
-    then terminates the conversation.
+    This function creates the slots, using the times stored in STATE 0,
+    and logs their information, then terminates the conversation.
+    The slots are created only if they all end after they start and none of
+    them overlaps another one of the event, otherwise no slot is created.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    callback_data = query.data[9:] # [9:] removes "event_id:" prefix
-    column_position = callback_data.find(":")
-    event_id = int(callback_data[:column_position])
-    slot_times = callback_data[column_position + 5:]  # +6 removes ":des:" infix
+    event_id = context.callback_action.args[0]
+    slot_times = context.user_data.pop("slot_text", None)
+    if slot_times is None:
+        await query.edit_message_text("This request has expired, operation cancelled.")
+        return ConversationHandler.END
 
     pattern = re.compile(
         "^" + "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]" + " "
-        "[0-9][0-9]:[0-9][0-9]:[0-9][0-9]" +
-        "\n" +
-        "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]" +
-        " " + "[0-9][0-9]:[0-9][0-9]:[0-9][0-9]" + "$"
+        "[0-9][0-9]:[0-9][0-9]:[0-9][0-9]" + "$"
     )
+    lines = [line.strip() for line in slot_times.splitlines() if line.strip()]
 
-    if pattern.match(slot_times): # checks for ISO-8601 format
-        try:
-            start_time = slot_times[:19]
-            end_time = slot_times[20:]
+    # checks for ISO-8601 format, one pair of rows per slot
+    if len(lines) % 2 != 0 or not all(pattern.match(line) for line in lines):
+        await query.edit_message_text("The provided date doesn't match the format, operation cancelled.")
+        return ConversationHandler.END
 
+    slots = list(zip(lines[0::2], lines[1::2]))
+    try:
+        for start_time, end_time in slots:
             # These two lines of code do not produce a value, they have the following
             # goal: if the date exist the operation will succeed. But if the date
             # is invalid, like 30 February, they will trigger a ValueError jumping
             # the proper response.
             datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
             datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        await query.edit_message_text("The provided date matches the format but it's an invalid day, operation cancelled.")
+        return ConversationHandler.END
 
-            user_id = update.effective_chat.id
-            event_name = get_event_name(db, event_id)
-            user_name, _ = get_user_from_id(db, user_id)
+    for start_time, end_time in slots:
+        if end_time <= start_time:
+            response = "The slot starting at " + start_time + " doesn't end after it starts, operation cancelled."
+            await query.edit_message_text(response)
+            return ConversationHandler.END
+
+    overlaps = create_slots_str(db, event_id, slots)
+    if overlaps:
+        response = MessageBuilder("The following slots overlap, no slot was created:\n\n")
+        for start_time, end_time, other_start, other_end in overlaps:
+            response.add(
+                "start: " + start_time + "\nend:   " + end_time +
+                "\noverlaps\nstart: " + other_start + "\nend:   " + other_end + "\n\n"
+            )
+        await edit_with_pages(query, context, response.pages())
+        return ConversationHandler.END
 
-            create_slot_str(db,event_id,start_time,end_time)
+    user_id = update.effective_chat.id
+    event_name = get_event_name(db, event_id)
+    user_name, _ = get_user_from_id(db, user_id)
 
-            response = "Slot created successfully!\n\nDetails\n"
-            response += "Event: " + event_name + "\n"
-            response += "Start time: " + start_time + "\n"
-            response += "End time: " + end_time + "\n"
-            response += "Owner: " + user_name
-        except ValueError:
-            response = "The provided date matches the format but it's an invalid day, operation cancelled."
+    if len(slots) == 1:
+        response = MessageBuilder("Slot created successfully!\n\nDetails\n")
     else:
-        response = "The provided date doesn't match the format, operation cancelled."
-
-    await query.edit_message_text(response)
+        response = MessageBuilder(str(len(slots)) + " slots created successfully!\n\nDetails\n")
+    response.add("Event: " + event_name + "\n")
+    response.add("Owner: " + user_name + "\n\n")
+    for start_time, end_time in sorted(slots):
+        response.add("Start time: " + start_time + "\nEnd time: " + end_time + "\n\n")
+    await edit_with_pages(query, context, response.pages())
 
     return ConversationHandler.END
 
@@ -310,6 +370,7 @@ async def select_user_event(update: Update, context: ContextTypes.DEFAULT_TYPE)
     This function lists to the user their own events as an inline keyboard,
     then goes to STATE 0
     """
+    db = context.bot_data["config"].db
     user_id = update.effective_chat.id
     event_list = get_events_given_owner(db, user_id)
 
@@ -319,9 +380,9 @@ async def select_user_event(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     keyboard = []
     for event_item in event_list:
-        callback_data = "event_id:" + str(event_item[0])
-        keyboard.append([InlineKeyboardButton(event_item[3], callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+        callback_data = encode_callback(ACTION_EVENT, event_item.event_id)
+        keyboard.append([InlineKeyboardButton(event_item.name, callback_data=callback_data)])
+    keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("Please select an event of yours:", reply_markup=reply_markup)
@@ -337,17 +398,19 @@ async def select_slot_for_event(update: Update, context: ContextTypes.DEFAULT_TY
 
     STATE 0 for the <code>/deleteslot</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
     This function lists to the user the slots of an event of their own as an inline keyboard,
     then goes to STATE 1
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    event_id = int(query.data[9:])  # [9:] removes "event_id:" prefix
-    event_name = get_event_name(db, event_id)
-    slot_list = get_slots_given_event(db, event_id)
+    event_id = context.callback_action.args[0]
+    with read_session(db):
+        event_name = get_event_name(db, event_id)
+        slot_list = get_slots_given_event(db, event_id)
 
     if not slot_list: # If slot_list is an empty list
         await query.edit_message_text("You have currently no slots in this event.")
@@ -355,10 +418,10 @@ async def select_slot_for_event(update: Update, context: ContextTypes.DEFAULT_TY
 
     keyboard = []
     for slot_item in slot_list:
-        callback_data = "slot_id:" + str(slot_item[0])
-        response = slot_item[2] + " - " + slot_item[3]
+        callback_data = encode_callback(ACTION_SLOT, slot_item.slot_id)
+        response = format_time(slot_item.start_time) + " - " + format_time(slot_item.end_time)
         keyboard.append([InlineKeyboardButton(response, callback_data=callback_data)])
-    keyboard.append([InlineKeyboardButton("/cancel", callback_data="cancel")])
+    keyboard.append([InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("Which slot do you want to delete for " + event_name + "?", reply_markup=reply_markup)
@@ -374,28 +437,30 @@ async def confirm_slot_deleting(update: Update, context: ContextTypes.DEFAULT_TY
 
     STATE 1 for the <code>/deleteslot</code> command.
 
-    Expected callback pattern (as RegEx): <code>^slot_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_SLOT</code>, with fields (slot_id,)
 
     This function asks the user to confirm they want to delete the selected slot,
     through an inline keyboard, then goes to STATE 2
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    slot_id = int(query.data[8:]) # [8:] removes "slot_id:" prefix
-    event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
-    event_name = get_event_name(db, event_id)
+    slot_id = context.callback_action.args[0]
+    with read_session(db):
+        event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
+        event_name = get_event_name(db, event_id)
 
-    callback_data = "slot_id:" + str(slot_id)
+    callback_data = encode_callback(ACTION_SLOT, slot_id)
     keyboard = [
         [InlineKeyboardButton("Delete slot", callback_data=callback_data)],
-        [InlineKeyboardButton("/cancel", callback_data="cancel")]
+        [InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)]
     ]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     response = "Are you sure you want to delete:\n"
     response += event_name + "\n"
-    response += start_time + " -\n" + end_time + "?"
+    response += format_time(start_time) + " -\n" + format_time(end_time) + "?"
     await query.edit_message_text(response, reply_markup=reply_markup)
 
     return 2
@@ -409,27 +474,35 @@ async def log_slot_deleting(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     STATE 2 for the <code>/deleteslot</code> command.
 
-    Expected callback pattern (as RegEx): <code>^slot_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_SLOT</code>, with fields (slot_id,)
 
     This function deletes a slot and logs the information it had,
-    then terminates the conversation.
+    then terminates the conversation. If the slot was booked, the student
+    is notified in the background.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    slot_id = int(query.data[8:]) # [8:] removes "slot_id:" prefix
-    event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
-    event_name = get_event_name(db, event_id)
+    slot_id = context.callback_action.args[0]
+    with read_session(db):
+        event_id, _, start_time, end_time = get_slot_from_id(db, slot_id)
+        event_name = get_event_name(db, event_id)
 
-    delete_slot(db, slot_id)
+    booked_by = delete_slot(db, slot_id)
 
     response = "Slot deleted successfully!\n\nDetails\n"
     response += "Event: " + event_name + "\n"
-    response += "Start time: " + start_time + "\n"
-    response += "End time: " + end_time + "\n"
+    response += "Start time: " + format_time(start_time) + "\n"
+    response += "End time: " + format_time(end_time) + "\n"
     response += "This slot is no more present in the database"
     await query.edit_message_text(response)
 
+    # Warn the student who had booked the slot
+    if booked_by is not None:
+        notification = slot_deleted_message(event_name, start_time, end_time)
+        notify_users(context, {booked_by: [notification]}, name="slot_deleted")
+
     return ConversationHandler.END
 
 
@@ -448,21 +521,22 @@ async def confirm_event_deleting(update: Update, context: ContextTypes.DEFAULT_T
 
     STATE 0 for the <code>/deleteevent</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
     This function asks the user to confirm they want to delete the selected event with
     the associated slots, through an inline keyboard, then goes to STATE 1
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    event_id = int(query.data[9:])  # [9:] removes "event_id:" prefix
+    event_id = context.callback_action.args[0]
     event_name = get_event_name(db, event_id)
 
-    callback_data = "event_id:" + str(event_id)
+    callback_data = encode_callback(ACTION_EVENT, event_id)
     keyboard = [
         [InlineKeyboardButton("Delete event", callback_data=callback_data)],
-        [InlineKeyboardButton("/cancel", callback_data="cancel")]
+        [InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)]
     ]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -482,24 +556,29 @@ async def log_event_deleting(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     STATE 1 for the <code>/deleteevent</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
     This function deletes an event and the associated slots, then logs the information
-    it had and terminates the conversation.
+    it had and terminates the conversation. The students who had booked a slot
+    are notified in the background.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    event_id = int(query.data[9:])  # [9:] removes "event_id:" prefix
+    event_id = context.callback_action.args[0]
     event_name = get_event_name(db, event_id)
 
-    delete_event(db, event_id, True)
+    bookings = delete_event(db, event_id)
 
     response = "Event deleted successfully!\n\nDetails\n"
     response += "Event: " + event_name + "\n"
     response += "This event is no more present in the database"
     await query.edit_message_text(response)
 
+    # Warn the students who had booked a slot, one message each with all their bookings
+    notify_users(context, event_deleted_messages(event_name, bookings), name="event_deleted")
+
     return ConversationHandler.END
 
 
@@ -518,38 +597,38 @@ async def show_event_details(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     STATE 0 for the <code>/myevents</code> command.
 
-    Expected callback pattern (as RegEx): <code>^event_id:[0-9]*$</code>
+    Expected callback action: <code>ACTION_EVENT</code>, with fields (event_id,)
 
     This function logs the information of an event and all the slots associated
     to it, including the users that booked such slots, then terminates the conversation.
+    Long responses are split into several messages.
     """
+    db = context.bot_data["config"].db
     query = update.callback_query
     await query.answer()
 
-    event_id = int(query.data[9:])  # [9:] removes "event_id:" prefix
-    _, owner_id, event_name, event_description = get_event_from_id(db, event_id)
-    owner_name, owner_username = get_user_from_id(db,owner_id)
-    slot_list = get_slots_given_event(db, event_id)
+    event_id = context.callback_action.args[0]
+    with read_session(db):
+        _, owner_id, event_name, event_description = get_event_from_id(db, event_id)
+        owner_name, owner_username = get_user_from_id(db,owner_id)
+        slot_list = get_slots_given_event(db, event_id)
 
-    response = "Event Details"
-    response += "\n\nName: " + event_name
-    response += "\n\nDescription: " + event_description
-    response += "\n\nOwner: " + owner_name
-    response += "\nOwner Contact: " + owner_username
+    response = MessageBuilder("Event Details")
+    response.add("\n\nName: " + event_name)
+    response.add("\n\nDescription: " + event_description)
+    response.add("\n\nOwner: " + owner_name + "\nOwner Contact: " + owner_username)
 
     if not slot_list:  # If slot_list is an empty list
-        response += "\n\nYou have currently no slots in this event."
+        response.add("\n\nYou have currently no slots in this event.")
     else:
-        response += "\n\nSlot List:"
+        response.add("\n\nSlot List:")
 
     for slot_item in slot_list:
-        response += "\n\n" + slot_item[2]
-        response += "\n" + slot_item[3]
-        if slot_item[1] is None:
-            response += "\nSlot Available"
+        if slot_item.user_id is None:
+            booking = "\nSlot Available"
         else:
-            response += "\nSlot booked by: " + slot_item[4]
-            response += "\nContact: " + slot_item[5]
+            booking = "\nSlot booked by: " + slot_item.user_name + "\nContact: " + slot_item.username
+        response.add("\n\n" + format_time(slot_item.start_time) + "\n" + format_time(slot_item.end_time) + booking)
 
-    await query.edit_message_text(response)
+    await edit_with_pages(query, context, response.pages())
     return ConversationHandler.END
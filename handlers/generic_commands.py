@@ -7,24 +7,6 @@ the generic commands <code>/start</code> and <code>/help</code>, together with t
 for invalid commands and command-less text.
 """
 
-from dotenv import load_dotenv
-import os
-
-# Load environment variables
-load_dotenv()
-db = os.getenv("DB_PATH")
-# Check of db existence is done in bot_main.py
-
-# In case of db error not detected by bot_main.py, like "no such table: users",
-# uncomment the following to check the working directory:
-# print(os.getcwd())
-
-# In case it's not the root directory,
-# change it to the root folder with the following:
-# os.chdir("path_to_root")
-
-
-
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 
@@ -69,6 +51,7 @@ async def unitn_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                "/fairs: show all the fairs and their descriptions\n" + \
                "/events: show all events of a fair and their descriptions\n" + \
                "/whoami: show the metadata associated with this chat\n" + \
+               "/search: find fairs and events by the words in their name or description\n" + \
                \
                "\nManage your bookings:\n\n" + \
                "/book: book a slot for an event\n" + \
@@ -153,11 +136,17 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     This handler is triggered inside a conversation handler anytime the /cancel
     button is pressed.
 
-    Expected callback pattern (as RegEx): <code>^cancel</code>
+    Expected callback action: <code>ACTION_CANCEL</code>, with no fields
 
     This function prints a message that informs the user the operation is
-    cancelled, and immediately terminates the conversation.
+    cancelled, discards any pending text stored by the conversation, and
+    immediately terminates the conversation.
     """
+    context.user_data.pop("event_name", None)
+    context.user_data.pop("description_text", None)
+    context.user_data.pop("slot_text", None)
+    context.user_data.pop("search_text", None)
+
     query = update.callback_query
     await query.answer()
     await query.edit_message_text(text="Operation cancelled.")
@@ -176,9 +165,31 @@ async def unknown_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     callback pattern is detected.
 
     This function prints an error message that informs the user the operation is
-    cancelled, and immediately terminates the conversation.
+    cancelled, discards any pending text stored by the conversation, and
+    immediately terminates the conversation.
     """
+    context.user_data.pop("event_name", None)
+    context.user_data.pop("description_text", None)
+    context.user_data.pop("slot_text", None)
+    context.user_data.pop("search_text", None)
+
     query = update.callback_query
     await query.answer()
     await query.edit_message_text(text="Unknown callback, operation cancelled.")
     return ConversationHandler.END
+
+# All conversations - placeholder buttons
+async def ignore_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """! @brief Callback handler for the placeholder buttons
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return None
+
+    This handler is triggered inside a conversation handler by the buttons that
+    only fill a keyboard, like the empty days of a calendar.
+
+    This function answers the callback query and leaves the conversation
+    in its current state.
+    """
+    await update.callback_query.answer()
+    return
@@ -0,0 +1,78 @@
+"""!
+@file inline_commands.py
+@brief Handler of the inline queries, to search the events from any chat.
+
+This file contains the implementation of the Telegram Bot Handler that answers
+the inline queries, i.e. the text typed after the bot's username in any chat:
+<code>@bot_username text</code>. The events whose name, or whose fair's name,
+has words starting with the typed ones are listed. Each result carries a deep
+link that opens the bot's chat directly at the day selection of <code>/book</code>.
+
+The answers are read from the in-memory index of <code>event_index.py</code>,
+without querying the database, and Telegram is allowed to cache them.
+"""
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, \
+    InputTextMessageContent, Update
+from telegram.ext import ContextTypes
+from telegram.helpers import create_deep_linked_url
+
+from handlers.book_commands import BOOK_LINK_PREFIX
+from utils.event_index import get_event_index
+
+# Number of results sent at once, Telegram allows at most 50
+RESULTS_PER_PAGE = 20
+
+# Seconds Telegram can serve an answer from its cache, for the same query of any user
+INLINE_CACHE_TIME = 30
+
+
+
+
+
+# Inline query handler
+async def search_events(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """! @brief Inline query handler
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return None
+
+    Inline query handler, triggered by <code>@bot_username text</code>.
+
+    This function answers with a page of the events matching the text, ordered by
+    name; the next pages are requested by Telegram while the user scrolls. An
+    empty text lists all the events.
+    """
+    db = context.bot_data["config"].db
+    query = update.inline_query
+    index = get_event_index(db)
+    event_ids = index.search(query.query)
+
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    end = offset + RESULTS_PER_PAGE
+    results = [event_article(context.bot.username, event_id, *index.event(event_id)) for event_id in event_ids[offset:end]]
+
+    await query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(end) if end < len(event_ids) else ""
+    )
+    return
+
+def event_article(bot_username:str, event_id:int, event_name:str, fair_name:str) -> InlineQueryResultArticle:
+    """! @brief Builds the inline query result of an event.
+    @param bot_username: string, the username of the bot, used in the deep link
+    @param event_id: integer, the ID of the event
+    @param event_name: string, the name of the event
+    @param fair_name: string, the name of the fair the event belongs to
+    @return InlineQueryResultArticle, the result, sending a message with a button to book the event
+    """
+    link = create_deep_linked_url(bot_username, BOOK_LINK_PREFIX + str(event_id))
+    return InlineQueryResultArticle(
+        id=str(event_id),
+        title=event_name,
+        description="Fair: " + fair_name,
+        input_message_content=InputTextMessageContent("Event: " + event_name + "\nFair: " + fair_name),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Book a slot", url=link)]])
+    )
@@ -0,0 +1,43 @@
+"""!
+@file lazy_loading.py
+@brief Handler callbacks whose module is imported at their first use.
+
+This file contains the implementation of a wrapper that registers a handler
+callback by the name of its module, which is imported only when the first
+update for it arrives. It is used for the subsystems most chats never use,
+like the inline mode and <code>/search</code>, so that their modules and the
+ones they depend on don't slow down the start of the bot.
+"""
+
+import importlib
+from typing import Any, Callable, Coroutine
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from services.log_pipeline import bind_handler
+
+
+
+
+
+def lazy_callback(module_name:str, function_name:str) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Coroutine[Any, Any, Any]]:
+    """! @brief Builds a callback that imports its module at the first call.
+    @param module_name: string, the module defining the callback, e.g. "handlers.search_commands"
+    @param function_name: string, the name of the callback in the module
+    @return function, the callback to register in the handler
+
+    The module is imported once, the following calls go straight to the
+    function. A missing module or function is only detected at the first call.
+    """
+    function = None
+
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        nonlocal function
+        if function is None:
+            function = getattr(importlib.import_module(module_name), function_name)
+        bind_handler(function_name)
+        return await function(update, context)
+
+    callback.__name__ = callback.__qualname__ = function_name
+    return callback
@@ -0,0 +1,121 @@
+"""!
+@file message_builder.py
+@brief Linear-time assembly of long responses, split into several messages.
+
+This file contains the implementation of the builder used by the handlers to
+compose responses made of many records, like the list of the slots of an event.
+The text is collected in a list and joined once, instead of being concatenated
+record by record, and it is split into pages that respect Telegram's limit on the
+message length. Pages are split between two records, so a record is never cut in
+half unless it is longer than a whole page by itself.
+"""
+
+from telegram import CallbackQuery, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+# Maximum length of a Telegram message, in characters
+MAX_MESSAGE_LENGTH = 4096
+
+
+
+
+
+class MessageBuilder:
+    """! @brief Builds a response record by record, split into pages.
+
+    Records are appended with <code>add</code>, and <code>pages</code> returns
+    the final messages. Each page is joined only once, so building a response
+    costs time linear in its length.
+    """
+
+    __slots__ = ("limit", "_pages", "_parts", "_length")
+
+    def __init__(self, header:str="", limit:int=MAX_MESSAGE_LENGTH):
+        """! @brief Initializes the builder.
+        @param header: string, text at the beginning of the first page
+        @param limit: integer, maximum length of a page
+        """
+        self.limit = limit
+        self._pages: list[str] = []
+        self._parts: list[str] = []
+        self._length = 0
+        if header:
+            self.add(header)
+
+    def add(self, record:str) -> None:
+        """! @brief Appends a record to the response.
+        @param record: string, the text of the record, including its separators
+        @return None
+
+        If the record doesn't fit in the current page, a new page is started.
+        A record longer than a page is split on its line breaks, or at the
+        page limit if a single line is too long.
+        """
+        if self._length + len(record) > self.limit:
+            self._close_page()
+            while len(record) > self.limit:
+                cut = record.rfind("\n", 0, self.limit)
+                if cut <= 0:
+                    cut = self.limit
+                self._pages.append(record[:cut])
+                record = record[cut:]
+
+        self._parts.append(record)
+        self._length += len(record)
+
+    def pages(self) -> list[str]:
+        """! @brief Returns the response split into pages.
+        @return list[str], the messages to send, in order, at least one
+        """
+        self._close_page()
+        return self._pages if self._pages else [""]
+
+    def _close_page(self) -> None:
+        """! @brief Joins the records of the current page, if any.
+        @return None
+        """
+        if self._parts:
+            self._pages.append("".join(self._parts))
+            self._parts = []
+            self._length = 0
+
+
+
+
+
+# Functions to send the pages
+
+async def edit_with_pages(
+        query:CallbackQuery,
+        context:ContextTypes.DEFAULT_TYPE,
+        pages:list[str],
+        reply_markup:InlineKeyboardMarkup|None=None
+) -> None:
+    """! @brief Answers a callback query with a paged response.
+    @param query: CallbackQuery, the query to answer
+    @param context: ContextTypes, library status
+    @param pages: list[str], the pages of the response
+    @param reply_markup: InlineKeyboardMarkup, keyboard attached to the last page
+    @return None
+
+    The first page replaces the text of the message with the inline keyboard,
+    the following ones are sent as new messages.
+    """
+    if len(pages) == 1:
+        await query.edit_message_text(pages[0], reply_markup=reply_markup)
+        return
+
+    await query.edit_message_text(pages[0])
+    for page in pages[1:-1]:
+        await context.bot.send_message(chat_id=query.message.chat.id, text=page)
+    await context.bot.send_message(chat_id=query.message.chat.id, text=pages[-1], reply_markup=reply_markup)
+
+async def send_pages(context:ContextTypes.DEFAULT_TYPE, chat_id:int, pages:list[str]) -> None:
+    """! @brief Sends a paged response as new messages.
+    @param context: ContextTypes, library status
+    @param chat_id: integer, the chat to send the response to
+    @param pages: list[str], the pages of the response
+    @return None
+    """
+    for page in pages:
+        await context.bot.send_message(chat_id=chat_id, text=page)
@@ -0,0 +1,164 @@
+"""!
+@file search_commands.py
+@brief Handlers of the full-text search over the fairs and events.
+
+This file contains the implementation of the Telegram Bot Handlers that let
+the user look for fairs and events by the words in their name or description,
+instead of opening them one by one. They are triggered by the <code>/search</code>
+command, and answer from the full-text indexes of the database with one query
+per page of results.
+"""
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import ContextTypes, ConversationHandler
+from telegram.helpers import create_deep_linked_url
+
+from handlers.callback_router import encode_callback, ACTION_PAGE, ACTION_CANCEL
+from handlers.book_commands import BOOK_LINK_PREFIX
+
+from utils.db_read import make_match_query, search_descriptions
+
+# Number of results in a page
+RESULTS_PER_PAGE = 5
+
+
+
+
+
+# search - INIT
+async def ask_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief INIT state for /search
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
+
+    Conversation initializer for the <code>/search</code> command.
+
+    If the words to look for follow the command, e.g. <code>/search robotics</code>,
+    this function shows the first page of results and goes to STATE 1.
+    Otherwise it asks the user to type them and goes to STATE 0.
+    """
+    if context.args:
+        return await show_first_page(update, context, " ".join(context.args))
+
+    await update.message.reply_text("Please type the words to search:")
+    return 0
+
+# search - STATE 0
+async def search_after_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief STATE 0 for /search
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
+
+    STATE 0 for the <code>/search</code> command.
+
+    This function shows the first page of results for the typed words,
+    then goes to STATE 1.
+    """
+    return await show_first_page(update, context, update.message.text)
+
+# search - STATE 1
+async def change_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """! @brief STATE 1 for /search
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @return integer, the next state
+
+    STATE 1 for the <code>/search</code> command.
+
+    Expected callback action: <code>ACTION_PAGE</code>, with fields (page,)
+
+    This function replaces the results with the selected page, then stays in STATE 1.
+    """
+    db = context.bot_data["config"].db
+    query = update.callback_query
+    await query.answer()
+
+    search_text = context.user_data.get("search_text")
+    if search_text is None:
+        await query.edit_message_text("This request has expired, operation cancelled.")
+        return ConversationHandler.END
+
+    page = context.callback_action.args[0]
+    response, reply_markup = search_page(db, context.bot.username, search_text, page)
+    await query.edit_message_text(response, reply_markup=reply_markup)
+
+    return 1
+
+
+
+
+
+# Functions to build the pages of results
+
+async def show_first_page(update: Update, context: ContextTypes.DEFAULT_TYPE, search_text:str) -> int:
+    """! @brief Sends the first page of results.
+    @param update: Update, Telegram parameters
+    @param context: ContextTypes, library status
+    @param search_text: string, the words to look for
+    @return integer, the next state: STATE 1 if there are more pages,
+    the end of the conversation otherwise
+    """
+    db = context.bot_data["config"].db
+    if make_match_query(search_text) is None:
+        await update.message.reply_text("Please type at least a word to search, operation cancelled.")
+        return ConversationHandler.END
+
+    response, reply_markup = search_page(db, context.bot.username, search_text, 0)
+    await update.message.reply_text(response, reply_markup=reply_markup)
+
+    if reply_markup is None:
+        return ConversationHandler.END
+    # The text is kept server-side, the buttons carry only the page number
+    context.user_data["search_text"] = search_text
+    return 1
+
+def search_page(db:str, bot_username:str, search_text:str, page:int) -> tuple[str, InlineKeyboardMarkup|None]:
+    """! @brief Builds a page of results.
+    @param db: string, the path to the database file
+    @param bot_username: string, the username of the bot, used in the booking links
+    @param search_text: string, the words to look for
+    @param page: integer, the number of the page, starting from 0
+    @return response: string, the text of the page
+    @return reply_markup: InlineKeyboardMarkup, the buttons to move between
+    the pages, None if all the results fit in the first page
+
+    One more result than a page is read, to know if a next page exists
+    without counting all the results.
+    """
+    results = search_descriptions(
+        db,
+        make_match_query(search_text),
+        RESULTS_PER_PAGE + 1,
+        page * RESULTS_PER_PAGE
+    )
+    has_next = len(results) > RESULTS_PER_PAGE
+    results = results[:RESULTS_PER_PAGE]
+
+    if not results and page == 0:
+        return "No fair or event matches your search.", None
+    if not results:
+        response = "No more results."
+    else:
+        response = "Results for: " + search_text
+        for kind, record_id, name, snippet in results:
+            if kind == "fair":
+                response += "\n\nFair: " + name
+            else:
+                response += "\n\nEvent: " + name
+            if snippet:
+                response += "\n" + snippet
+            if kind == "event":
+                response += "\nBook: " + create_deep_linked_url(bot_username, BOOK_LINK_PREFIX + str(record_id))
+
+    if page == 0 and not has_next:
+        return response, None
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("< Previous", callback_data=encode_callback(ACTION_PAGE, page - 1)))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Next >", callback_data=encode_callback(ACTION_PAGE, page + 1)))
+    keyboard = [navigation, [InlineKeyboardButton("/cancel", callback_data=ACTION_CANCEL)]]
+    return response, InlineKeyboardMarkup(keyboard)
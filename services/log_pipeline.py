@@ -0,0 +1,196 @@
+"""!
+@file log_pipeline.py
+@brief Logging through a queue, written by a background thread.
+
+This file contains the implementation of the logging setup of the bot. The
+records are not written by the thread that emits them, i.e. the event loop:
+they are put in a queue, and a background thread formats and writes them. So
+a slow terminal or disk never delays the processing of the updates, even with
+<code>DEBUG=True</code>.
+
+Each record emitted while an update is processed carries the ID of the update,
+of its chat and user, and the name of the handler, set by the update processor
+and the callback router. They are written either as plain text or as one JSON
+object per line. Records below WARNING can be sampled: all the records of a
+sampled update are kept, so its trace stays complete.
+"""
+
+import atexit, json, logging, queue, random, sys
+from contextvars import ContextVar, Token
+from logging.handlers import QueueHandler, QueueListener
+
+# Fields describing the update being processed, added to each record
+CONTEXT_FIELDS = ("update_id", "chat_id", "user_id", "handler")
+
+# Context of the update processed by the current task, None outside updates
+_update_context: ContextVar = ContextVar("log_update_context", default=None)
+
+
+
+
+
+# Context of the records
+
+def bind_update(update:object) -> Token|None:
+    """! @brief Sets the update the following records of the current task refer to.
+    @param update: object, the update about to be processed
+    @return Token, to pass to <code>unbind_update</code> once the update is
+    processed, None if the object is not an update
+
+    The handler is first set to a label describing the update, like the command
+    or the callback action, until <code>bind_handler</code> names the function.
+    """
+    update_id = getattr(update, "update_id", None)
+    if update_id is None:
+        return None
+    chat = getattr(update, "effective_chat", None)
+    user = getattr(update, "effective_user", None)
+
+    message = getattr(update, "effective_message", None)
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query is not None and isinstance(callback_query.data, str):
+        handler = "callback " + callback_query.data.split(":", 1)[0]
+    elif getattr(update, "inline_query", None) is not None:
+        handler = "inline query"
+    elif message is not None and message.text and message.text.startswith("/"):
+        handler = message.text.split(maxsplit=1)[0]
+    else:
+        handler = "message"
+
+    return _update_context.set({
+        "update_id": update_id,
+        "chat_id": chat.id if chat is not None else None,
+        "user_id": user.id if user is not None else None,
+        "handler": handler
+    })
+
+def unbind_update(token:Token|None) -> None:
+    """! @brief Restores the context preceding <code>bind_update</code>.
+    @param token: Token, the value returned by <code>bind_update</code>
+    @return None
+    """
+    if token is not None:
+        _update_context.reset(token)
+
+def bind_handler(name:str) -> None:
+    """! @brief Sets the handler function processing the current update.
+    @param name: string, the name of the function
+    @return None
+    """
+    context = _update_context.get()
+    if context is not None:
+        context["handler"] = name
+
+
+
+class _ContextQueueHandler(QueueHandler):
+    """! @brief Queue handler adding the update context, and sampling the minor records."""
+
+    def __init__(self, log_queue:queue.SimpleQueue, sample_rate:float):
+        """! @brief Creates the handler.
+        @param log_queue: SimpleQueue, the queue read by the writer thread
+        @param sample_rate: float, fraction of the records below WARNING to keep
+        """
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+
+    def emit(self, record:logging.LogRecord) -> None:
+        """! @brief Adds the context to a record and puts it in the queue, unless sampled out.
+        @param record: LogRecord, the record
+        @return None
+        """
+        context = _update_context.get()
+        if record.levelno < logging.WARNING and self.sample_rate < 1 and not self._keep(context):
+            return
+        if context is not None:
+            record.__dict__.update(context)
+        super().emit(record)
+
+    def _keep(self, context:dict|None) -> bool:
+        """! @brief Decides if a minor record is kept.
+        @param context: dictionary, the context of the update, None outside updates
+        @return boolean, True to keep the record
+
+        Inside an update the choice depends only on its ID, so all the records of
+        an update are either kept or dropped.
+        """
+        if context is None:
+            return random.random() < self.sample_rate
+        # Multiplicative hash, spreads consecutive IDs over [0, 1)
+        return (context["update_id"] * 2654435761 % 2**32) / 2**32 < self.sample_rate
+
+
+
+
+
+# Formatting
+
+class _TextFormatter(logging.Formatter):
+    """! @brief Plain text lines, followed by the update context if any."""
+
+    def format(self, record:logging.LogRecord) -> str:
+        """! @brief Formats a record.
+        @param record: LogRecord, the record
+        @return string, the line to write
+        """
+        text = super().format(record)
+        if getattr(record, "update_id", None) is None:
+            return text
+        return text + " [" + ", ".join(
+            field + "=" + str(getattr(record, field)) for field in CONTEXT_FIELDS
+        ) + "]"
+
+class _JsonFormatter(logging.Formatter):
+    """! @brief One JSON object per line, with the update context as separate fields."""
+
+    def format(self, record:logging.LogRecord) -> str:
+        """! @brief Formats a record.
+        @param record: LogRecord, the record
+        @return string, the line to write
+        """
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+
+
+
+def setup_logging(level:int, json_format:bool=False, sample_rate:float=1.0) -> QueueListener:
+    """! @brief Sends the records of every logger through the queue.
+    @param level: integer, the minimum level written, e.g. logging.INFO
+    @param json_format: boolean, if True each record is written as a JSON object
+    @param sample_rate: float, fraction of the records below WARNING to keep,
+    1 to keep them all
+    @return QueueListener, the background writer, already started
+
+    Replaces <code>logging.basicConfig</code>. The writer thread is stopped
+    at exit, after writing the records still in the queue.
+    """
+    if json_format:
+        formatter = _JsonFormatter()
+    else:
+        formatter = _TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, stream_handler)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_ContextQueueHandler(log_queue, max(0.0, min(sample_rate, 1.0))))
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,123 @@
+"""!
+@file notifications.py
+@brief Background delivery of notifications to many users.
+
+This file contains the implementation of the fan-out used to warn the users
+affected by a change made by someone else, like the students whose bookings
+were cancelled because the owner deleted the event. The messages are sent in a
+background task, so the handler can answer its own user right away, and at most
+<code>MAX_CONCURRENT_NOTIFICATIONS</code> of them are in flight at the same time,
+however many users are involved. They are sent as bulk requests, so the replies
+to the interactive commands keep priority over them.
+
+The messages sent to a user given a slot from a waitlist, or whose bookings
+were cancelled by the deletion of a slot or an event, are built here, since
+both the handlers and <code>edit_db.py</code> send them.
+"""
+
+import asyncio, logging
+
+from telegram.error import Forbidden, TelegramError
+from telegram.ext import ContextTypes
+
+from handlers.message_builder import MessageBuilder
+from services.send_queue import PRIORITY_BULK
+from utils.slot_time import format_time
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of notifications being sent at the same time
+MAX_CONCURRENT_NOTIFICATIONS = 8
+
+
+
+
+
+def notify_users(context:ContextTypes.DEFAULT_TYPE, messages:dict[int, list[str]], name:str="notify") -> None:
+    """! @brief Sends notifications in the background.
+    @param context: ContextTypes, library status
+    @param messages: dictionary, maps each user ID to the pages of the message to send
+    @param name: string, name of the background task, used in the logs
+    @return None
+
+    This function returns immediately. The task is created through the
+    Application, so the notifications still pending at shutdown are
+    completed before the bot stops.
+    """
+    if not messages:
+        return
+    context.application.create_task(deliver_notifications(context.bot, messages, name), name=name)
+
+async def deliver_notifications(bot, messages:dict[int, list[str]], name:str) -> None:
+    """! @brief Sends the notifications with bounded concurrency, waiting for all of them.
+    @param bot: Bot, the bot sending the messages
+    @param messages: dictionary, maps each user ID to the pages of the message to send
+    @param name: string, name of the fan-out, used in the logs
+    @return None
+
+    A fixed number of workers take the users from a shared iterator, so no
+    task is created per user. A user that can't be
+    reached, e.g. because they blocked the bot, is skipped.
+    """
+    pending = iter(messages.items())
+    failed = 0
+    # rate_limit_args can be passed only if the bot has a rate limiter
+    priority = PRIORITY_BULK if bot.rate_limiter is not None else None
+
+    async def worker() -> None:
+        nonlocal failed
+        for user_id, pages in pending:
+            try:
+                for page in pages:
+                    await bot.send_message(chat_id=user_id, text=page, rate_limit_args=priority)
+            except Forbidden:
+                failed += 1
+            except TelegramError as exc:
+                failed += 1
+                logger.warning("Notification to %d failed: %s", user_id, exc)
+
+    workers = min(MAX_CONCURRENT_NOTIFICATIONS, len(messages))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    logger.info("Fan-out %s: %d users notified, %d unreachable", name, len(messages) - failed, failed)
+
+def waitlist_message(event_name:str, start_time:int, end_time:int) -> str:
+    """! @brief Builds the notification for a user given a slot from a waitlist.
+    @param event_name: string, the name of the event of the slot
+    @param start_time: integer, the start of the slot, as stored
+    @param end_time: integer, the end of the slot, as stored
+    @return string, the message
+    """
+    message = "A slot of the event " + event_name + " became free, and it has been booked for you from the waitlist.\n\n"
+    message += "start: " + format_time(start_time) + "\nend:   " + format_time(end_time) + "\n\n"
+    message += "Use /unbook if you can't attend."
+    return message
+
+def slot_deleted_message(event_name:str, start_time:int, end_time:int) -> str:
+    """! @brief Builds the notification for a user whose booked slot was deleted.
+    @param event_name: string, the name of the event of the slot
+    @param start_time: integer, the start of the slot, as stored
+    @param end_time: integer, the end of the slot, as stored
+    @return string, the message
+    """
+    message = "Your booking has been cancelled, the slot was deleted by the owner.\n\n"
+    message += "Event: " + event_name + "\n"
+    message += "Start time: " + format_time(start_time) + "\n"
+    message += "End time: " + format_time(end_time)
+    return message
+
+def event_deleted_messages(event_name:str, bookings:list[tuple[int,int,int]]) -> dict[int, list[str]]:
+    """! @brief Builds the notifications for the users whose bookings were cancelled by deleting an event.
+    @param event_name: string, the name of the deleted event
+    @param bookings: list[tuple[int,int,int]], the cancelled bookings, each as
+    (user_id,start_time,end_time), as returned by <code>delete_event</code>
+    @return dictionary, maps each user ID to the pages of their message, listing all their bookings
+    """
+    header = "The event " + event_name + " has been deleted by the owner, "
+    header += "the following bookings have been cancelled:\n\n"
+    builders = {}
+    for user_id, start_time, end_time in bookings:
+        builder = builders.get(user_id)
+        if builder is None:
+            builder = builders[user_id] = MessageBuilder(header)
+        builder.add("start: " + format_time(start_time) + "\nend:   " + format_time(end_time) + "\n\n")
+    return {user_id: builder.pages() for user_id, builder in builders.items()}
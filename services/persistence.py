@@ -0,0 +1,302 @@
+"""!
+@file persistence.py
+@brief Conversation persistence stored in the bot's SQLite database.
+
+This file contains the implementation of a PTB persistence backend that keeps
+the state of the conversation handlers, the user data and the chat data in the
+tables <code>conversations</code>, <code>user_data</code> and <code>chat_data</code>
+of the bot's database. In this way a restart doesn't drop the conversations in
+progress.
+
+Only the records changed since the last write are stored: the Application reports
+the modified entries every <code>update_interval</code> seconds, and this class
+writes all of them in a single transaction. The data is serialized as JSON, one
+row per user, chat or conversation.
+
+When the bot runs in several worker processes, each one has its own instance.
+The updates of a chat always go to the same worker, so the chat data and the
+conversations have a single writer. A user, instead, can be served by different
+workers in different chats, so before each update the data of the user is
+reloaded if another worker changed it, see <code>refresh_user_data</code>.
+
+The tables written here have no change counters, see <code>create_db.py</code>,
+so these writes don't invalidate the caches of the bot, see <code>db_connection.py</code>.
+"""
+
+import asyncio, json, logging, sqlite3
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+
+
+
+class SQLitePersistence(BasePersistence):
+    """! @brief Persistence backend writing to the bot's SQLite database.
+
+    The bot data and the callback data are not stored, since the bot keeps
+    in them objects that are rebuilt at every start.
+    """
+
+    def __init__(self, db:str, update_interval:float=60, shared:bool=False):
+        """! @brief Initializes the persistence.
+        @param db: string, the path to the database file
+        @param update_interval: float, seconds between two writes of the modified data
+        @param shared: boolean, True if other processes write to the same tables
+        """
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db = db
+        self.shared = shared
+        # The JSON of the user data last read or written by this process, for each user
+        self._stored_user_data: dict[int, str] = {}
+        self._dirty_conversations: dict[tuple[str,str], int|None] = {}
+        self._dirty_user_data: dict[int, dict|None] = {}
+        self._dirty_chat_data: dict[int, dict|None] = {}
+        self._write_task: asyncio.Task|None = None
+
+
+
+    # Loading at startup
+
+    async def get_conversations(self, name:str) -> dict:
+        """! @brief Loads the states of a conversation handler.
+        @param name: string, the name of the conversation handler
+        @return dictionary, maps each conversation key to its state
+        """
+        con = sqlite3.connect(self.db)
+        rows = con.execute(
+            """
+            SELECT conversation_key, state
+            FROM conversations
+            WHERE name=?
+            """,
+            (name,)
+        ).fetchall()
+        con.close()
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def get_user_data(self) -> dict[int, dict]:
+        """! @brief Loads the user data of all the users.
+        @return dictionary, maps each user ID to their data
+        """
+        user_data = self._load_data("user_data", "user_id")
+        self._stored_user_data = {user_id: json.dumps(data) for user_id, data in user_data.items()}
+        return user_data
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        """! @brief Loads the chat data of all the chats.
+        @return dictionary, maps each chat ID to its data
+        """
+        return self._load_data("chat_data", "chat_id")
+
+    async def get_bot_data(self) -> dict:
+        """! @brief The bot data is not stored, required by BasePersistence.
+        @return dictionary, always empty
+        """
+        return {}
+
+    async def get_callback_data(self) -> None:
+        """! @brief The callback data is not stored, required by BasePersistence.
+        @return None
+        """
+        return None
+
+    def _load_data(self, table:str, id_column:str) -> dict[int, dict]:
+        """! @brief Loads all the rows of <code>user_data</code> or <code>chat_data</code>.
+        @param table: string, the table to read
+        @param id_column: string, the name of the ID column of the table
+        @return dictionary, maps each ID to its data
+        """
+        con = sqlite3.connect(self.db)
+        rows = con.execute("SELECT " + id_column + ", data FROM " + table).fetchall()
+        con.close()
+        return {row_id: json.loads(data) for row_id, data in rows}
+
+
+
+    # Incremental updates
+
+    async def update_conversation(self, name:str, key:tuple, new_state:object|None) -> None:
+        """! @brief Marks the state of a conversation as modified.
+        @param name: string, the name of the conversation handler
+        @param key: tuple, the key of the conversation
+        @param new_state: the new state, None if the conversation ended
+        @return None
+        """
+        self._dirty_conversations[(name, json.dumps(key))] = new_state
+        await self._write_soon()
+
+    async def update_user_data(self, user_id:int, data:dict) -> None:
+        """! @brief Marks the data of a user as modified.
+        @param user_id: integer, the ID of the user
+        @param data: dictionary, the new user data
+        @return None
+        """
+        self._dirty_user_data[user_id] = dict(data)
+        await self._write_soon()
+
+    async def update_chat_data(self, chat_id:int, data:dict) -> None:
+        """! @brief Marks the data of a chat as modified.
+        @param chat_id: integer, the ID of the chat
+        @param data: dictionary, the new chat data
+        @return None
+        """
+        self._dirty_chat_data[chat_id] = dict(data)
+        await self._write_soon()
+
+    async def update_bot_data(self, data:dict) -> None:
+        """! @brief The bot data is not stored, required by BasePersistence.
+        @return None
+        """
+        return
+
+    async def update_callback_data(self, data:object) -> None:
+        """! @brief The callback data is not stored, required by BasePersistence.
+        @return None
+        """
+        return
+
+    async def drop_user_data(self, user_id:int) -> None:
+        """! @brief Deletes the data of a user.
+        @param user_id: integer, the ID of the user
+        @return None
+        """
+        self._dirty_user_data[user_id] = None
+        await self._write_soon()
+
+    async def drop_chat_data(self, chat_id:int) -> None:
+        """! @brief Deletes the data of a chat.
+        @param chat_id: integer, the ID of the chat
+        @return None
+        """
+        self._dirty_chat_data[chat_id] = None
+        await self._write_soon()
+
+    async def refresh_user_data(self, user_id:int, user_data:dict) -> None:
+        """! @brief Reloads the data of a user, if another process changed it.
+        @param user_id: integer, the ID of the user
+        @param user_data: dictionary, the data of the user, updated in place
+        @return None
+
+        Nothing is read if this process is the only writer. The data is not
+        reloaded if this process modified it since the last read or write,
+        because its own modifications are the ones to store.
+        """
+        if not self.shared or user_id in self._dirty_user_data:
+            return
+        stored = self._stored_user_data.get(user_id, "{}")
+        if json.dumps(user_data) != stored:
+            return
+
+        con = sqlite3.connect(self.db)
+        row = con.execute("SELECT data FROM user_data WHERE user_id=?;", (user_id,)).fetchone()
+        con.close()
+        data = "{}" if row is None else row[0]
+        if data != stored:
+            self._stored_user_data[user_id] = data
+            user_data.clear()
+            user_data.update(json.loads(data))
+
+    async def refresh_chat_data(self, chat_id:int, chat_data:dict) -> None:
+        """! @brief Nothing to refresh, the chat is served only by this process.
+        @return None
+        """
+        return
+
+    async def refresh_bot_data(self, bot_data:dict) -> None:
+        """! @brief The bot data is not stored, required by BasePersistence.
+        @return None
+        """
+        return
+
+    async def flush(self) -> None:
+        """! @brief Writes the pending modifications, called at shutdown.
+        @return None
+        """
+        self._write_dirty()
+
+
+
+    # Writing
+
+    async def _write_soon(self) -> None:
+        """! @brief Writes the modified records, grouping concurrent calls.
+        @return None
+
+        The Application reports all the modified entries concurrently. The first
+        call schedules a write and yields once, so that the other calls can
+        register their entries, then all of them are written in one transaction.
+        """
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_after_yield())
+        await asyncio.shield(self._write_task)
+
+    async def _write_after_yield(self) -> None:
+        """! @brief Lets the pending update calls run, then writes.
+        @return None
+        """
+        await asyncio.sleep(0)
+        self._write_task = None
+        self._write_dirty()
+
+    def _write_dirty(self) -> None:
+        """! @brief Writes all the modified records in a single transaction.
+        @return None
+        """
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        user_data, self._dirty_user_data = self._dirty_user_data, {}
+        chat_data, self._dirty_chat_data = self._dirty_chat_data, {}
+        if not (conversations or user_data or chat_data):
+            return
+
+        con = sqlite3.connect(self.db)
+        for (name, key), state in conversations.items():
+            if state is None:
+                con.execute(
+                    """
+                    DELETE FROM conversations
+                    WHERE name=? AND conversation_key=?;
+                    """,
+                    (name, key)
+                )
+            else:
+                con.execute(
+                    """
+                    INSERT OR REPLACE INTO conversations (name,conversation_key,state)
+                    VALUES (?,?,?);
+                    """,
+                    (name, key, state)
+                )
+        self._write_data(con, "user_data", "user_id", user_data)
+        for user_id, data in user_data.items():
+            self._stored_user_data[user_id] = json.dumps(data or {})
+        self._write_data(con, "chat_data", "chat_id", chat_data)
+        con.commit()
+        con.close()
+        logger.debug(
+            "Persisted %d conversations, %d user data, %d chat data",
+            len(conversations), len(user_data), len(chat_data)
+        )
+
+    @staticmethod
+    def _write_data(con:sqlite3.Connection, table:str, id_column:str, rows:dict) -> None:
+        """! @brief Writes the modified rows of <code>user_data</code> or <code>chat_data</code>.
+        @param con: sqlite3.Connection, the connection of the running transaction
+        @param table: string, the table to modify
+        @param id_column: string, the name of the ID column of the table
+        @param rows: dictionary, maps each ID to its data, None to delete the row
+        @return None
+        """
+        for row_id, data in rows.items():
+            if data is None or not data:
+                con.execute("DELETE FROM " + table + " WHERE " + id_column + "=?;", (row_id,))
+            else:
+                con.execute(
+                    "INSERT OR REPLACE INTO " + table + " (" + id_column + ",data) VALUES (?,?);",
+                    (row_id, json.dumps(data))
+                )
@@ -0,0 +1,160 @@
+"""!
+@file reminders.py
+@brief Reminders of the booked slots, sent by a periodic sweep.
+
+This file contains the implementation of the job that reminds the students of
+their bookings some time before the start of the slot, e.g. 24 hours and 1 hour
+before. No job is scheduled per slot: a single repeating job sweeps the slots
+starting soon, read through the index on <code>slots(start_time)</code>, and
+sends the reminders in batches of <code>BATCH_SIZE</code>. Memory use doesn't
+depend on the number of bookings.
+
+The reminders sent are recorded in the table <code>reminders_sent</code>, so a
+restart neither repeats nor skips them: after a downtime, the first sweep sends
+the reminders that became due in the meantime. When several leads have passed,
+only the closest to the start of the slot is sent.
+"""
+
+import logging, sqlite3
+from datetime import datetime
+
+from telegram.ext import ContextTypes
+
+from handlers.message_builder import MessageBuilder
+from services.notifications import deliver_notifications
+from utils.slot_time import to_epoch, format_time
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of reminders read and sent at once
+BATCH_SIZE = 500
+
+
+
+
+
+async def send_reminders(context:ContextTypes.DEFAULT_TYPE) -> None:
+    """! @brief Job callback that sends the reminders due.
+    @param context: ContextTypes, library status
+    @return None
+
+    Meant to be scheduled as a repeating job, with <code>data</code> set to a
+    dictionary with the path to the database under <code>"db"</code> and the
+    leads, in minutes, under <code>"leads"</code>.
+
+    Each lead owns the slots starting between the previous lead and itself, so
+    a slot is reminded only for the smallest lead not yet passed. A batch is
+    recorded as sent after its messages have been delivered: if the bot stops
+    in between, at most that batch is sent again.
+    """
+    db = context.job.data["db"]
+    leads = sorted(context.job.data["leads"])
+    now = to_epoch(datetime.now())
+
+    total = 0
+    lower = now
+    for lead in leads:
+        upper = now + lead * 60
+        while True:
+            rows = _get_due_slots(db, lower, upper, lead)
+            if not rows:
+                break
+
+            # One message per student, with all their slots in the batch
+            builders = {}
+            for _, user_id, start_time, end_time, event_name in rows:
+                builder = builders.get(user_id)
+                if builder is None:
+                    builder = builders[user_id] = MessageBuilder("Reminder of your bookings:\n\n")
+                builder.add(
+                    "Event: " + event_name + "\nstart: " + format_time(start_time) +
+                    "\nend:   " + format_time(end_time) + "\n\n"
+                )
+            messages = {user_id: builder.pages() for user_id, builder in builders.items()}
+            await deliver_notifications(context.bot, messages, "reminders")
+
+            _mark_sent(db, lead, rows)
+            total += len(rows)
+            if len(rows) < BATCH_SIZE:
+                break
+        lower = upper
+
+    _delete_past(db, now)
+    if total:
+        logger.info("Sent %d reminders", total)
+
+
+
+
+
+# Bookkeeping of the reminders, in the table "reminders_sent"
+
+def _get_due_slots(db:str, lower:int, upper:int, lead:int) -> list[tuple[int,int,int,int,str]]:
+    """! @brief Retrieves a batch of booked slots still to be reminded for a lead.
+    @param db: string, the path to the database file
+    @param lower: integer, the slots must start after this time, see <code>slot_time.py</code>
+    @param upper: integer, the slots must start at or before this time
+    @param lead: integer, the lead in minutes
+    @return list[tuple[int,int,int,int,str]], at most <code>BATCH_SIZE</code> records,
+    each one structured as (slot_id,user_id,start_time,end_time,event_name)
+
+    The reminder is considered sent only if it was for the same user and the
+    same start time, so a slot booked again or moved is reminded again.
+    """
+    con = sqlite3.connect(db)
+    res = con.execute(
+        """
+        SELECT slots.slot_id, slots.user_id, slots.start_time, slots.end_time, events.name
+        FROM slots JOIN events
+        ON slots.event_id = events.event_id
+        WHERE slots.start_time > ? AND slots.start_time <= ?
+        AND slots.user_id IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM reminders_sent
+            WHERE reminders_sent.slot_id = slots.slot_id
+            AND reminders_sent.lead = ?
+            AND reminders_sent.user_id = slots.user_id
+            AND reminders_sent.start_time = slots.start_time
+        )
+        ORDER BY slots.start_time ASC
+        LIMIT ?
+        """,
+        (lower, upper, lead, BATCH_SIZE)
+    ).fetchall()
+    con.close()
+    return res
+
+def _mark_sent(db:str, lead:int, rows:list[tuple[int,int,int,int,str]]) -> None:
+    """! @brief Records a batch of reminders as sent.
+    @param db: string, the path to the database file
+    @param lead: integer, the lead in minutes
+    @param rows: list[tuple[int,int,int,int,str]], the records returned by <code>_get_due_slots</code>
+    @return None
+    """
+    con = sqlite3.connect(db)
+    con.executemany(
+        """
+        INSERT OR IGNORE INTO reminders_sent (slot_id,lead,user_id,start_time)
+        VALUES (?,?,?,?);
+        """,
+        [(slot_id, lead, user_id, start_time) for slot_id, user_id, start_time, _, _ in rows]
+    )
+    con.commit()
+    con.close()
+
+def _delete_past(db:str, now:int) -> None:
+    """! @brief Forgets the reminders of the slots already started.
+    @param db: string, the path to the database file
+    @param now: integer, the current time, see <code>slot_time.py</code>
+    @return None
+    """
+    con = sqlite3.connect(db)
+    con.execute(
+        """
+        DELETE FROM reminders_sent
+        WHERE start_time <= ?;
+        """,
+        (now,)
+    )
+    con.commit()
+    con.close()
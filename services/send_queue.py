@@ -0,0 +1,410 @@
+"""!
+@file send_queue.py
+@brief Rate-limited queue for the outgoing Bot API requests.
+
+This file contains the implementation of the rate limiter installed on the bot,
+through which every request to the Bot API passes. Requests addressed to a chat
+wait for a token from two buckets: one for the chat and a global one, sized after
+Telegram's flood limits. In addition:
+
+1) Interactive replies have priority over bulk messages: bulk requests leave part
+of the global bucket untouched, so replies to users are never delayed by them.
+Within a chat, interactive requests take their turn ahead of the bulk ones
+waiting, and a bulk request waiting for its tokens steps aside when an
+interactive one arrives.
+
+2) Repeated edits of the same message are coalesced: if an edit is still waiting
+when a new one for the same message arrives, only the latest text is sent.
+
+3) When Telegram answers with a RetryAfter error, all requests are paused for the
+given time, then the request is retried.
+
+To send a bulk message pass <code>rate_limit_args=PRIORITY_BULK</code> to the
+bot method, e.g. <code>bot.send_message(chat_id, text, rate_limit_args=PRIORITY_BULK)</code>.
+"""
+
+import asyncio, logging
+from collections import deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Priorities, passed as rate_limit_args
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Endpoints whose waiting requests are replaced by newer ones for the same message
+COALESCED_ENDPOINTS = {"editMessageText", "editMessageReplyMarkup"}
+
+
+
+
+
+class TokenBucket:
+    """! @brief Token bucket refilled at a constant rate.
+
+    The bucket holds up to <code>capacity</code> tokens, and each request
+    consumes one of them.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "last")
+
+    def __init__(self, rate:float, capacity:float, now:float):
+        """! @brief Initializes a full bucket.
+        @param rate: float, tokens added per second
+        @param capacity: float, maximum number of tokens
+        @param now: float, the current loop time
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = now
+
+    def delay(self, now:float, reserve:float=0) -> float:
+        """! @brief Time to wait before a token can be taken.
+        @param now: float, the current loop time
+        @param reserve: float, tokens that must remain in the bucket after taking one
+        @return float, seconds to wait, zero or negative if a token is available
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return (1 + reserve - self.tokens) / self.rate
+
+    def take(self) -> None:
+        """! @brief Consumes a token, call it only after a non-positive delay.
+        @return None
+        """
+        self.tokens -= 1
+
+    def is_full(self, now:float) -> bool:
+        """! @brief Checks if the bucket is unused.
+        @param now: float, the current loop time
+        @return boolean, True if the bucket would be full at this time
+        """
+        return self.tokens + (now - self.last) * self.rate >= self.capacity
+
+
+
+class _ChatBucket(TokenBucket):
+    """! @brief Token bucket of a chat, with a priority lock keeping its requests in order.
+
+    The requests to a chat take their tokens one at a time. The waiting ones
+    get their turn by priority, interactive first, and in the order they were
+    made within a priority, so the pages of a long response can't be swapped.
+    The holder of a bulk turn can be asked to step aside through
+    <code>preempt</code>, which is set when an interactive request starts waiting.
+    """
+
+    __slots__ = ("busy", "waiters", "preempt")
+
+    def __init__(self, rate:float, capacity:float, now:float):
+        super().__init__(rate, capacity, now)
+        self.busy = False
+        self.waiters = (deque(), deque())
+        self.preempt: asyncio.Future|None = None
+
+    def locked(self) -> bool:
+        """! @brief Checks if a request holds the turn of the chat.
+        @return boolean, True if a new request would have to wait
+        """
+        return self.busy
+
+    async def acquire(self, priority:int, first:bool=False) -> None:
+        """! @brief Waits for the turn of the chat.
+        @param priority: integer, the priority of the request
+        @param first: boolean, if True the request goes ahead of the others of its priority
+        @return None
+        """
+        if not self.busy:
+            self.busy = True
+            return
+        future = asyncio.get_running_loop().create_future()
+        queue = self.waiters[priority]
+        if first:
+            queue.appendleft(future)
+        else:
+            queue.append(future)
+        if priority == PRIORITY_INTERACTIVE and self.preempt is not None and not self.preempt.done():
+            self.preempt.set_result(None)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                if future in queue:
+                    queue.remove(future)
+            else:
+                # The turn was handed over right before the cancellation
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """! @brief Hands the turn of the chat to the next waiting request, if any.
+        @return None
+        """
+        for queue in self.waiters:
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self.busy = False
+
+
+
+class _PendingEdit:
+    """! @brief Edit waiting for its tokens, possibly replaced by newer ones."""
+
+    __slots__ = ("args", "kwargs", "future", "followers")
+
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.followers = 0
+
+
+
+class SendQueue(BaseRateLimiter):
+    """! @brief Rate limiter with per-chat and global token buckets.
+
+    The default rates follow Telegram's limits: about 30 messages per second
+    overall, one message per second in a private chat (with a small burst for
+    multi-page replies) and 20 messages per minute in a group.
+    """
+
+    def __init__(
+            self,
+            global_rate:float=30,
+            private_rate:float=1,
+            private_burst:float=4,
+            group_rate:float=20/60,
+            bulk_reserve:float=0.2,
+            max_retries:int=3
+    ):
+        """! @brief Initializes the queue.
+        @param global_rate: float, requests per second over all the chats
+        @param private_rate: float, requests per second in a single private chat
+        @param private_burst: float, requests a private chat can send at once
+        @param group_rate: float, requests per second in a single group
+        @param bulk_reserve: float, fraction of the global bucket bulk requests can't use
+        @param max_retries: integer, retries after a RetryAfter error before giving up
+        """
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.bulk_reserve = bulk_reserve * global_rate
+        self.max_retries = max_retries
+
+        self._global: TokenBucket|None = None
+        self._chats: dict[int|str, _ChatBucket] = {}
+        self._pending_edits: dict[tuple, _PendingEdit] = {}
+        self._paused_until = 0.0
+        self._waiting = [0, 0]
+        self._counters = {"sent": 0, "throttled": 0, "coalesced": 0, "retry_after": 0}
+
+    async def initialize(self) -> None:
+        """! @brief Creates the global bucket on the running loop.
+        @return None
+        """
+        self._global = TokenBucket(self.global_rate, self.global_rate, asyncio.get_running_loop().time())
+
+    async def shutdown(self) -> None:
+        """! @brief Nothing to release, required by BaseRateLimiter.
+        @return None
+        """
+        return
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """! @brief Sends a request once the rate limits allow it.
+        @param callback: coroutine function, performs the request
+        @param args: tuple, positional arguments of the callback
+        @param kwargs: dictionary, keyword arguments of the callback
+        @param endpoint: string, the Bot API method, e.g. "sendMessage"
+        @param data: dictionary, the parameters of the request
+        @param rate_limit_args: integer, PRIORITY_INTERACTIVE (default) or PRIORITY_BULK
+        @return the result of the request
+
+        Requests not addressed to a chat, like answering a callback query,
+        are sent immediately.
+        """
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        priority = PRIORITY_BULK if rate_limit_args == PRIORITY_BULK else PRIORITY_INTERACTIVE
+
+        message_id = data.get("message_id")
+        if endpoint not in COALESCED_ENDPOINTS or message_id is None:
+            return await self._send(chat_id, priority, callback, args, kwargs)
+
+        # Edits of the same message: a waiting edit is updated instead of queueing a new one
+        key = (endpoint, chat_id, message_id)
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            pending.args, pending.kwargs = args, kwargs
+            pending.followers += 1
+            self._counters["coalesced"] += 1
+            return await pending.future
+
+        pending = self._pending_edits[key] = _PendingEdit(args, kwargs)
+        try:
+            result = await self._send(chat_id, priority, callback, None, None, pending=(key, pending))
+        except BaseException as exc:
+            # The replaced edits share the outcome of the one actually sent
+            if pending.followers and isinstance(exc, Exception):
+                pending.future.set_exception(exc)
+            else:
+                pending.future.cancel()
+            raise
+        finally:
+            self._pending_edits.pop(key, None)
+        pending.future.set_result(result)
+        return result
+
+    async def _send(self, chat_id, priority, callback, args, kwargs, pending=None):
+        """! @brief Waits for the tokens and performs the request, retrying on RetryAfter.
+        @param chat_id: integer or string, the chat the request is addressed to
+        @param priority: integer, the priority of the request
+        @param callback: coroutine function, performs the request
+        @param args: tuple, positional arguments of the callback
+        @param kwargs: dictionary, keyword arguments of the callback
+        @param pending: tuple, key and record of a coalesced edit, whose arguments
+        are read right before sending
+        @return the result of the request
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            if pending is not None:
+                key, record = pending
+                # From now on, newer edits of the same message are new requests
+                self._pending_edits.pop(key, None)
+                args, kwargs = record.args, record.kwargs
+            try:
+                result = await callback(*args, **kwargs)
+                self._counters["sent"] += 1
+                return result
+            except RetryAfter as exc:
+                self._counters["retry_after"] += 1
+                if attempt == self.max_retries:
+                    logger.error("Rate limit hit after %d retries, request dropped", self.max_retries)
+                    raise
+                delay = exc.retry_after if isinstance(exc.retry_after, (int, float)) \
+                    else exc.retry_after.total_seconds()
+                logger.warning("Rate limit hit, pausing all requests for %.1f seconds", delay)
+                loop_time = asyncio.get_running_loop().time()
+                self._paused_until = max(self._paused_until, loop_time + delay + 0.1)
+                pending = None # A retried edit keeps the arguments it was sent with
+
+    async def _acquire(self, chat_id, priority:int) -> None:
+        """! @brief Waits until a token is available in both the chat and global buckets.
+        @param chat_id: integer or string, the chat the request is addressed to
+        @param priority: integer, the priority of the request
+        @return None
+        """
+        loop = asyncio.get_running_loop()
+        bucket = self._chat_bucket(chat_id, loop.time())
+        reserve = self.bulk_reserve if priority == PRIORITY_BULK else 0
+
+        self._waiting[priority] += 1
+        throttled = bucket.locked()
+        if throttled:
+            self._counters["throttled"] += 1
+        try:
+            await bucket.acquire(priority)
+            holding = True
+            try:
+                while True:
+                    now = loop.time()
+                    delay = max(
+                        self._paused_until - now,
+                        bucket.delay(now),
+                        self._global.delay(now, reserve)
+                    )
+                    if delay <= 0:
+                        bucket.take()
+                        self._global.take()
+                        return
+                    if not throttled:
+                        throttled = True
+                        self._counters["throttled"] += 1
+                    if priority == PRIORITY_INTERACTIVE:
+                        await asyncio.sleep(delay)
+                        continue
+
+                    # A bulk request waits ready to give its turn to an interactive one
+                    bucket.preempt = loop.create_future()
+                    try:
+                        await asyncio.wait((bucket.preempt,), timeout=delay)
+                        preempted = bucket.preempt.done()
+                    finally:
+                        bucket.preempt = None
+                    if preempted:
+                        holding = False
+                        bucket.release()
+                        await bucket.acquire(priority, first=True)
+                        holding = True
+            finally:
+                if holding:
+                    bucket.release()
+        finally:
+            self._waiting[priority] -= 1
+
+    def _chat_bucket(self, chat_id, now:float) -> _ChatBucket:
+        """! @brief Returns the bucket of a chat, creating it if needed.
+        @param chat_id: integer or string, the chat
+        @param now: float, the current loop time
+        @return _ChatBucket, the bucket of the chat
+        """
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            return bucket
+
+        # Forget the chats that have been idle long enough to refill their bucket
+        if len(self._chats) >= 1024:
+            idle = [key for key, value in self._chats.items() if value.is_full(now) and not value.locked()]
+            for key in idle:
+                del self._chats[key]
+
+        is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+        if is_group:
+            bucket = _ChatBucket(self.group_rate, 1, now)
+        else:
+            bucket = _ChatBucket(self.private_rate, self.private_burst, now)
+        self._chats[chat_id] = bucket
+        return bucket
+
+    def metrics(self) -> dict[str, int]:
+        """! @brief Returns a snapshot of the queue metrics.
+        @return dictionary, with the following integer entries:
+
+        <code>interactive_queued</code>, <code>bulk_queued</code>: requests waiting for tokens
+
+        <code>sent</code>: requests completed since the start
+
+        <code>throttled</code>: requests that had to wait for a token
+
+        <code>coalesced</code>: edits replaced by a newer one before being sent
+
+        <code>retry_after</code>: RetryAfter errors received from Telegram
+        """
+        return {
+            "interactive_queued": self._waiting[PRIORITY_INTERACTIVE],
+            "bulk_queued": self._waiting[PRIORITY_BULK],
+            **self._counters
+        }
+
+
+
+async def log_send_metrics(context) -> None:
+    """! @brief Job callback that logs the send queue metrics.
+    @param context: ContextTypes, library status
+    @return None
+
+    Meant to be scheduled as a repeating job, it logs at INFO level the metrics
+    of the bot's rate limiter, if it's a SendQueue.
+    """
+    rate_limiter = context.bot.rate_limiter
+    if isinstance(rate_limiter, SendQueue):
+        logger.info("Send queue metrics: %s", rate_limiter.metrics())
@@ -0,0 +1,285 @@
+"""!
+@file sharding.py
+@brief Supervisor running the bot in several worker processes, sharded by chat.
+
+This file contains the implementation of the multi-process mode of the bot,
+enabled with <code>WORKERS</code> greater than 1. The supervisor process
+receives the updates from Telegram, by polling or through the webhook as in the
+single-process mode, and sends each one to the worker owning its chat: the
+chat ID modulo the number of workers. Each worker runs the full application,
+built by <code>build_application</code> in <code>bot_main.py</code>, so the
+conversation states and the per-chat ordering of a chat stay in one process.
+Updates without a chat, like inline queries, are routed by their user.
+
+All the workers use the same SQLite database. It is switched to WAL mode, so
+the reads of a worker don't wait for the writes of the others, and the writes
+keep their correctness from the database transactions: the checks and claims
+of <code>db_write.py</code> run under <code>BEGIN IMMEDIATE</code>, which
+serializes them across processes too. The render caches and the indexes of the
+free slots are kept consistent by forwarding the invalidations of each worker to
+the others through the supervisor.
+
+The reminders are sent only by the first worker, to avoid duplicates. A worker
+that dies is restarted, the updates queued for it in the meantime are kept.
+"""
+
+import asyncio, json, logging, multiprocessing, signal, sqlite3, threading
+from typing import Callable
+
+from telegram import Bot, Update
+from telegram.ext import Application, Updater
+
+from utils.config import Config
+from utils.render_cache import set_publisher, apply_remote
+from utils.availability import forget_availability
+from utils.event_index import forget_event_index
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks of the worker processes
+WATCH_INTERVAL = 5
+
+
+
+
+
+# Routing
+
+def shard_of(update:Update, workers:int) -> int:
+    """! @brief Chooses the worker processing an update.
+    @param update: Update, the update to route
+    @param workers: integer, the number of workers
+    @return integer, the index of the worker, from 0 to workers-1
+
+    The updates of a chat always go to the same worker. In private chats the
+    chat ID is the user ID, so a user is always served by the same worker too.
+    """
+    if update.effective_chat is not None:
+        return update.effective_chat.id % workers
+    if update.effective_user is not None:
+        return update.effective_user.id % workers
+    return 0
+
+
+
+
+
+# Worker processes
+
+def run_worker(
+        build_application:Callable[[Config, int], Application],
+        config:Config,
+        index:int,
+        inbox:multiprocessing.Queue,
+        invalidations:multiprocessing.Queue
+) -> None:
+    """! @brief Entry point of a worker process.
+    @param build_application: function, builds the application of the worker
+    @param config: Config, the configuration of the bot
+    @param index: integer, the index of the worker
+    @param inbox: Queue, the messages sent by the supervisor to this worker
+    @param invalidations: Queue, the cache invalidations sent to the supervisor
+    @return None
+
+    Interrupts are ignored, the worker stops when the supervisor asks it to,
+    after processing the updates already received.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_publisher(lambda entities: invalidations.put((index, entities)))
+    application = build_application(config, index)
+    asyncio.run(_serve(application, inbox))
+
+async def _serve(application:Application, inbox:multiprocessing.Queue) -> None:
+    """! @brief Feeds the application with the messages of the supervisor.
+    @param application: Application, the application of the worker
+    @param inbox: Queue, the messages sent by the supervisor to this worker
+    @return None
+
+    The messages are tuples (kind, payload): ("update", update in JSON),
+    ("invalidate", entities) or ("stop", None).
+    """
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    try:
+        await application.start()
+        while True:
+            kind, payload = await loop.run_in_executor(None, inbox.get)
+            if kind == "stop":
+                break
+            if kind == "invalidate":
+                _apply_invalidation(payload)
+            else:
+                await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+    finally:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+
+
+
+def _apply_invalidation(entities:tuple|None) -> None:
+    """! @brief Applies the cache invalidation of another worker.
+    @param entities: tuple, the invalidated entities, None for all of them
+    @return None
+
+    The writes to the slots of an event invalidate the event, so its index of
+    the free slots is dropped as well, to be loaded again from the database.
+    The changes to the events or the fairs drop the index of the inline search.
+    """
+    apply_remote(entities)
+    if entities is None:
+        forget_availability()
+        forget_event_index()
+        return
+    if ("events",) in entities or ("fairs",) in entities:
+        forget_event_index()
+    for entity in entities:
+        if entity[0] == "event":
+            forget_availability(entity[1])
+
+
+
+class _Workers:
+    """! @brief The worker processes, with their queues."""
+
+    def __init__(self, config:Config, build_application:Callable[[Config, int], Application]):
+        """! @brief Creates the queues, the processes are started by <code>start</code>.
+        @param config: Config, the configuration of the bot
+        @param build_application: function, builds the application of a worker
+        """
+        self.config = config
+        self.build_application = build_application
+        self.context = multiprocessing.get_context("spawn")
+        self.inboxes = [self.context.Queue() for _ in range(config.workers)]
+        self.invalidations = self.context.Queue()
+        self.processes: list[multiprocessing.Process|None] = [None] * config.workers
+
+    def start(self, index:int) -> None:
+        """! @brief Starts a worker process.
+        @param index: integer, the index of the worker
+        @return None
+        """
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.build_application, self.config, index, self.inboxes[index], self.invalidations),
+            name="worker-" + str(index)
+        )
+        process.start()
+        self.processes[index] = process
+
+    def restart_dead(self) -> None:
+        """! @brief Restarts the workers that terminated unexpectedly.
+        @return None
+        """
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error("Worker %d terminated with exit code %s, restarting it", index, process.exitcode)
+                self.start(index)
+
+    def forward_invalidations(self) -> None:
+        """! @brief Sends the cache invalidations of each worker to the others, until None is received.
+        @return None
+        """
+        while True:
+            message = self.invalidations.get()
+            if message is None:
+                return
+            sender, entities = message
+            for index, inbox in enumerate(self.inboxes):
+                if index != sender:
+                    inbox.put(("invalidate", entities))
+
+    def stop(self) -> None:
+        """! @brief Asks every worker to stop and waits for them.
+        @return None
+        """
+        for inbox in self.inboxes:
+            inbox.put(("stop", None))
+        for process in self.processes:
+            if process is not None:
+                process.join()
+        self.invalidations.put(None)
+
+
+
+
+
+# Supervisor
+
+def run_supervisor(config:Config, build_application:Callable[[Config, int], Application]) -> None:
+    """! @brief Runs the bot with <code>config.workers</code> worker processes, until interrupted.
+    @param config: Config, the configuration of the bot
+    @param build_application: function, builds the application of a worker
+    given the configuration and the index of the worker
+    @return None
+    """
+    # WAL mode is stored in the database file, it is enabled once for all the processes
+    con = sqlite3.connect(config.db)
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.close()
+
+    workers = _Workers(config, build_application)
+    for index in range(config.workers):
+        workers.start(index)
+    forwarder = threading.Thread(target=workers.forward_invalidations, name="invalidations", daemon=True)
+    forwarder.start()
+
+    try:
+        asyncio.run(_front(config, workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        workers.stop()
+        forwarder.join()
+
+async def _front(config:Config, workers:_Workers) -> None:
+    """! @brief Receives the updates from Telegram and routes them to the workers.
+    @param config: Config, the configuration of the bot
+    @param workers: _Workers, the worker processes
+    @return None
+    """
+    update_queue: asyncio.Queue = asyncio.Queue()
+    updater = Updater(Bot(config.bot_token), update_queue)
+    watcher = asyncio.create_task(_watch(workers))
+    await updater.initialize()
+    try:
+        if config.bot_mode == "webhook":
+            # Serve the updates posted by Telegram, setWebhook is called at startup
+            await updater.start_webhook(
+                listen=config.webhook_listen,
+                port=config.webhook_port,
+                url_path=config.webhook_path,
+                webhook_url=config.webhook_url,
+                secret_token=config.webhook_secret,
+                max_connections=config.webhook_max_connections
+            )
+        else:
+            await updater.start_polling()
+        while True:
+            _route(await update_queue.get(), workers)
+    finally:
+        watcher.cancel()
+        if updater.running:
+            await updater.stop()
+        await updater.shutdown()
+        # Updates already fetched, they are not fetched again
+        while not update_queue.empty():
+            _route(update_queue.get_nowait(), workers)
+
+def _route(update:object, workers:_Workers) -> None:
+    """! @brief Sends an update to the worker owning its chat.
+    @param update: object, the update received by the updater
+    @param workers: _Workers, the worker processes
+    @return None
+    """
+    if isinstance(update, Update):
+        workers.inboxes[shard_of(update, len(workers.inboxes))].put(("update", update.to_json()))
+
+async def _watch(workers:_Workers) -> None:
+    """! @brief Restarts the workers that died, every WATCH_INTERVAL seconds.
+    @param workers: _Workers, the worker processes
+    @return None
+    """
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        workers.restart_dead()
@@ -0,0 +1,166 @@
+"""!
+@file update_processor.py
+@brief Concurrent update processing with per-chat ordering.
+
+This file contains the implementation of the update processor used by the
+Application to handle updates concurrently. Updates coming from different chats
+run in parallel, up to a configurable limit, while updates coming from the same
+chat are processed one at a time, in arrival order. This keeps the state of the
+conversation handlers consistent, since two steps of the same conversation can
+never interleave.
+"""
+
+import asyncio, logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from services.log_pipeline import bind_update, unbind_update
+
+logger = logging.getLogger(__name__)
+
+
+
+
+class _ChatQueue:
+    """! @brief Serialization state of a single chat.
+
+    The lock is held by the update of the chat currently being processed,
+    while <code>depth</code> counts the updates of the chat that are either
+    waiting or being processed.
+    """
+
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """! @brief Update processor serializing the updates of each chat.
+
+    At most <code>max_concurrent_updates</code> updates are processed at the
+    same time. An update waits for the previous updates of its chat to be
+    completed before taking one of these slots, so a chat sending many updates
+    can't starve the others. Since asyncio locks are fair and the Application
+    schedules the updates in arrival order, the updates of a chat are processed
+    in the order they were received. Updates not related to a chat are not
+    serialized.
+    """
+
+    __slots__ = ("_chats", "_pending", "_peak_pending", "_processed")
+
+    def __init__(self, max_concurrent_updates:int):
+        """! @brief Initializes the processor.
+        @param max_concurrent_updates: integer, maximum number of updates
+        processed at the same time
+        """
+        super().__init__(max_concurrent_updates)
+        self._chats: dict[int, _ChatQueue] = {}
+        self._pending = 0
+        self._peak_pending = 0
+        self._processed = 0
+
+    async def process_update(self, update:object, coroutine) -> None:
+        """! @brief Processes an update once the previous ones of its chat are done.
+        @param update: object, the update to process
+        @param coroutine: awaitable, the coroutine processing the update
+        @return None
+
+        This method extends the one of <code>BaseUpdateProcessor</code> acquiring
+        the chat lock <b>before</b> the concurrency slot, so that waiting updates
+        don't hold any slot.
+        """
+        chat_id = None
+        if isinstance(update, Update) and update.effective_chat is not None:
+            chat_id = update.effective_chat.id
+
+        self._pending += 1
+        self._peak_pending = max(self._peak_pending, self._pending)
+        try:
+            if chat_id is None:
+                await super().process_update(update, coroutine)
+                return
+
+            chat_queue = self._chats.get(chat_id)
+            if chat_queue is None:
+                chat_queue = self._chats[chat_id] = _ChatQueue()
+            chat_queue.depth += 1
+            try:
+                async with chat_queue.lock:
+                    await super().process_update(update, coroutine)
+            finally:
+                chat_queue.depth -= 1
+                if chat_queue.depth == 0:
+                    del self._chats[chat_id]
+        finally:
+            self._pending -= 1
+            self._processed += 1
+
+    async def do_process_update(self, update:object, coroutine) -> None:
+        """! @brief Runs the coroutine processing the update.
+        @param update: object, the update to process
+        @param coroutine: awaitable, the coroutine processing the update
+        @return None
+
+        The records logged while processing it carry the update context.
+        """
+        token = bind_update(update)
+        try:
+            await coroutine
+        finally:
+            unbind_update(token)
+
+    async def initialize(self) -> None:
+        """! @brief Nothing to initialize, required by BaseUpdateProcessor.
+        @return None
+        """
+        return
+
+    async def shutdown(self) -> None:
+        """! @brief Nothing to release, required by BaseUpdateProcessor.
+        @return None
+        """
+        return
+
+    def metrics(self) -> dict[str, int]:
+        """! @brief Returns a snapshot of the queue metrics.
+        @return dictionary, with the following integer entries:
+
+        <code>active</code>: updates being processed right now
+
+        <code>queued</code>: updates waiting for their chat or for a free slot
+
+        <code>peak_pending</code>: highest number of active plus queued updates seen
+
+        <code>busy_chats</code>: chats with at least one update active or queued
+
+        <code>max_chat_depth</code>: highest number of updates pending for a single chat
+
+        <code>processed</code>: updates completed since the start
+        """
+        active = self.current_concurrent_updates
+        return {
+            "active": active,
+            "queued": self._pending - active,
+            "peak_pending": self._peak_pending,
+            "busy_chats": len(self._chats),
+            "max_chat_depth": max((chat.depth for chat in self._chats.values()), default=0),
+            "processed": self._processed
+        }
+
+
+
+async def log_update_metrics(context) -> None:
+    """! @brief Job callback that logs the update processor metrics.
+    @param context: ContextTypes, library status
+    @return None
+
+    Meant to be scheduled as a repeating job, it logs at INFO level the metrics
+    of the Application's update processor, if it's a ChatOrderedUpdateProcessor.
+    """
+    processor = context.application.update_processor
+    if isinstance(processor, ChatOrderedUpdateProcessor):
+        logger.info("Update processor metrics: %s", processor.metrics())
@@ -0,0 +1,294 @@
+"""!
+@file availability.py
+@brief In-memory index of the free slots of each event.
+
+This file contains the implementation of the structure the <code>/book</code>
+handlers use to know which slots of an event are free, without querying the
+database at every step. For each event it keeps the slots sorted by start time
+in arrays, together with a bitmap whose bit <code>i</code> is set if the
+<code>i</code>-th slot is free. Dates, times and counts of the free slots are
+answered with binary searches on the start times and bit operations on the
+bitmap.
+
+An event is loaded at its first lookup. Afterwards, the functions in
+<code>db_write.py</code> update it in place when a slot is created, booked,
+unbooked or deleted, and drop it when the change is too wide to apply. At most
+<code>MAX_EVENTS</code> events are kept, the least recently used one is dropped
+first.
+
+Those updates only see the writes of this process, while the database can also
+be changed by <code>edit_db.py</code>, <code>create_db.py</code> or the other
+workers. So every lookup first calls <code>sync_changes</code>, see
+<code>db_connection.py</code>, which drops the events changed by the other
+processes since the previous lookup. The events changed only by this process
+are kept, as already updated in place.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from utils.db_connection import add_change_listener, sync_changes
+from utils.db_read import get_slot_availability
+from utils.records import SlotTime
+from utils.slot_time import DAY, day_range, month_range, format_day, format_clock, format_month
+
+# Maximum number of events kept in memory
+MAX_EVENTS = 256
+
+# Maps each loaded event ID to its EventAvailability
+_events: OrderedDict = OrderedDict()
+
+
+
+
+
+class EventAvailability:
+    """! @brief Slots of an event sorted by start time, with a bitmap of the free ones.
+
+    The start and end times are kept as stored in the database, integers, see
+    <code>slot_time.py</code>. Slots starting at the same time are ordered by ID.
+    """
+
+    __slots__ = ("start_times", "end_times", "slot_ids", "free")
+
+    def __init__(self, slots:list[tuple[int,int,int,bool]]):
+        """! @brief Builds the index of an event.
+        @param slots: list[tuple[int,int,int,bool]], the rows of the records returned
+        by <code>get_slot_availability</code>, as plain tuples
+        """
+        self.start_times = array("q", (slot[1] for slot in slots))
+        self.end_times = array("q", (slot[2] for slot in slots))
+        self.slot_ids = array("q", (slot[0] for slot in slots))
+        self.free = 0
+        for position, slot in enumerate(slots):
+            if slot[3]:
+                self.free |= 1 << position
+
+
+
+    # Lookups
+
+    def count(self) -> tuple[int, int]:
+        """! @brief Counts the free slots and all the slots of the event.
+        @return tuple[int,int], the number of free slots and the total number of slots
+        """
+        return self.free.bit_count(), len(self.start_times)
+
+    def free_months(self) -> tuple[str|None, str|None]:
+        """! @brief Finds the first and last month with free slots.
+        @return tuple[str,str], the two months as "YYYY-MM", None if no slot is free
+        """
+        if not self.free:
+            return None, None
+        first = (self.free & -self.free).bit_length() - 1
+        last = self.free.bit_length() - 1
+        return format_month(self.start_times[first]), format_month(self.start_times[last])
+
+    def free_per_day(self, month:str="") -> list[tuple[str, int]]:
+        """! @brief Counts the free slots of each day.
+        @param month: string, restricts the days to the ones of a month "YYYY-MM",
+        all the days if empty
+        @return list[tuple[str,int]], the days with at least one free slot,
+        ordered, each one as (date,free_slots)
+
+        The days are found jumping from a free slot to the end of its day,
+        so the cost depends on the number of days, not of slots.
+        """
+        if month:
+            month_start, month_end = month_range(month)
+            start = bisect_left(self.start_times, month_start)
+            end = bisect_left(self.start_times, month_end)
+        else:
+            start, end = 0, len(self.start_times)
+        result = []
+        while start < end:
+            # First free slot in [start, end)
+            remaining = (self.free >> start) & ((1 << (end - start)) - 1)
+            if not remaining:
+                break
+            start += (remaining & -remaining).bit_length() - 1
+            day_start = self.start_times[start] // DAY * DAY
+            day_end = bisect_left(self.start_times, day_start + DAY, start, end)
+            result.append((format_day(day_start), self._count_free(start, day_end)))
+            start = day_end
+        return result
+
+    def free_times(self, day:str) -> list[SlotTime]:
+        """! @brief Lists the free slots of a day.
+        @param day: string, the day as "YYYY-MM-DD"
+        @return list[SlotTime], the free slots ordered by start time,
+        each one as (slot_id,start_time,end_time), with the times as "HH:MM:SS"
+        """
+        day_start, day_end = day_range(day)
+        start = bisect_left(self.start_times, day_start)
+        end = bisect_left(self.start_times, day_end, start)
+        return [
+            SlotTime(self.slot_ids[position], format_clock(self.start_times[position]), format_clock(self.end_times[position]))
+            for position in range(start, end)
+            if self.free >> position & 1
+        ]
+
+    def _count_free(self, start:int, end:int) -> int:
+        """! @brief Counts the free slots in a range of positions.
+        @param start: integer, the first position
+        @param end: integer, the position after the last one
+        @return integer, the number of free slots
+        """
+        return ((self.free >> start) & ((1 << (end - start)) - 1)).bit_count()
+
+
+
+    # Updates
+
+    def insert(self, slot_id:int, start_time:int, end_time:int, is_free:bool) -> None:
+        """! @brief Adds a slot, keeping the arrays sorted.
+        @param slot_id: integer, the ID of the slot
+        @param start_time: integer, the start of the slot, as stored
+        @param end_time: integer, the end of the slot, as stored
+        @param is_free: boolean, True if the slot is not booked
+        @return None
+        """
+        position = bisect_right(self.start_times, start_time)
+        while position > 0 and self.start_times[position - 1] == start_time \
+                and self.slot_ids[position - 1] > slot_id:
+            position -= 1
+        self.start_times.insert(position, start_time)
+        self.end_times.insert(position, end_time)
+        self.slot_ids.insert(position, slot_id)
+        low = self.free & ((1 << position) - 1)
+        self.free = low | (int(is_free) << position) | ((self.free >> position) << (position + 1))
+
+    def remove(self, slot_id:int, start_time:int) -> None:
+        """! @brief Removes a slot, if present.
+        @param slot_id: integer, the ID of the slot
+        @param start_time: integer, the start of the slot, as stored
+        @return None
+        """
+        position = self._position(slot_id, start_time)
+        if position is None:
+            return
+        del self.start_times[position]
+        del self.end_times[position]
+        del self.slot_ids[position]
+        low = self.free & ((1 << position) - 1)
+        self.free = low | ((self.free >> (position + 1)) << position)
+
+    def set_free(self, slot_id:int, start_time:int, is_free:bool) -> None:
+        """! @brief Marks a slot as free or booked.
+        @param slot_id: integer, the ID of the slot
+        @param start_time: integer, the start of the slot, as stored
+        @param is_free: boolean, True if the slot is not booked anymore
+        @return None
+        """
+        position = self._position(slot_id, start_time)
+        if position is None:
+            return
+        if is_free:
+            self.free |= 1 << position
+        else:
+            self.free &= ~(1 << position)
+
+    def _position(self, slot_id:int, start_time:int) -> int|None:
+        """! @brief Finds the position of a slot.
+        @param slot_id: integer, the ID of the slot
+        @param start_time: integer, the start of the slot, as stored
+        @return integer, the position of the slot, None if it's not indexed
+        """
+        position = bisect_left(self.start_times, start_time)
+        while position < len(self.start_times) and self.start_times[position] == start_time:
+            if self.slot_ids[position] == slot_id:
+                return position
+            position += 1
+        return None
+
+
+
+
+
+# Lookup, used by the handlers
+
+def get_availability(db:str, event_id:int) -> EventAvailability:
+    """! @brief Returns the index of an event, loading it if needed.
+    @param db: string, the path to the database file
+    @param event_id: integer, the ID of the event
+    @return EventAvailability, the index of the event, empty if it has no slot
+    """
+    sync_changes(db)
+    availability = _events.get(event_id)
+    if availability is None:
+        availability = _events[event_id] = EventAvailability(get_slot_availability(db, event_id).rows)
+        if len(_events) > MAX_EVENTS:
+            _events.popitem(last=False)
+    else:
+        _events.move_to_end(event_id)
+    return availability
+
+
+
+
+
+# Updates, used by the write functions
+
+def slot_created(event_id:int, slot_id:int, start_time:int, end_time:int) -> None:
+    """! @brief Adds a new free slot to the index of its event, if loaded.
+    @param event_id: integer, the event the slot refers to
+    @param slot_id: integer, the ID of the new slot
+    @param start_time: integer, the start of the slot, as stored
+    @param end_time: integer, the end of the slot, as stored
+    @return None
+    """
+    availability = _events.get(event_id)
+    if availability is not None:
+        availability.insert(slot_id, start_time, end_time, True)
+
+def slot_assigned(event_id:int, slot_id:int, start_time:int, user_id:int|None) -> None:
+    """! @brief Updates the index after a slot is booked or unbooked.
+    @param event_id: integer, the event the slot refers to
+    @param slot_id: integer, the ID of the slot
+    @param start_time: integer, the start of the slot, as stored
+    @param user_id: integer, the user the slot is assigned to, None if free
+    @return None
+    """
+    availability = _events.get(event_id)
+    if availability is not None:
+        availability.set_free(slot_id, start_time, user_id is None)
+
+def slot_deleted(event_id:int, slot_id:int, start_time:int) -> None:
+    """! @brief Removes a slot from the index of its event, if loaded.
+    @param event_id: integer, the event the slot referred to
+    @param slot_id: integer, the ID of the deleted slot
+    @param start_time: integer, the start of the slot, as stored
+    @return None
+    """
+    availability = _events.get(event_id)
+    if availability is not None:
+        availability.remove(slot_id, start_time)
+
+def forget_availability(event_id:int|None=None) -> None:
+    """! @brief Drops the index of an event, or of all of them.
+    @param event_id: integer, the event to drop, None to drop every event
+    @return None
+
+    Used by the write functions whose changes are too wide to apply in place,
+    like deleting an event or moving a slot. The index is loaded again at the
+    next lookup.
+    """
+    if event_id is None:
+        _events.clear()
+    else:
+        _events.pop(event_id, None)
+
+def _forget_changed(entities:tuple|None) -> None:
+    """! @brief Drops the events changed by other processes, see <code>add_change_listener</code>.
+    @param entities: tuple, the changed entities, None if they are unknown
+    @return None
+    """
+    if entities is None:
+        forget_availability()
+        return
+    for entity in entities:
+        if entity[0] == "event":
+            forget_availability(entity[1])
+
+add_change_listener(_forget_changed)
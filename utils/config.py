@@ -0,0 +1,76 @@
+"""!
+@file config.py
+@brief Configuration of the project, read once from the environment.
+
+This file contains the implementation of the object holding every setting of
+the project, read from the environment variables and the .env file the first
+time it is requested. The scripts get it from <code>load_config</code>, the
+handlers from <code>context.bot_data["config"]</code>, where
+<code>bot_main.py</code> stores it. See the README for the meaning of each
+variable.
+"""
+
+import os
+from functools import lru_cache
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+
+
+
+
+
+class Config(NamedTuple):
+    """! @brief Settings of the project, already converted to their types."""
+    db: str|None
+    bot_token: str|None
+    debug: bool
+    log_format: str
+    log_sample_rate: float
+    bot_mode: str
+    webhook_url: str|None
+    webhook_listen: str
+    webhook_port: int
+    webhook_path: str
+    webhook_secret: str|None
+    webhook_max_connections: int
+    max_concurrent_updates: int
+    workers: int
+    persistence_interval: float
+    reminder_leads: tuple[int, ...]
+    reminder_interval: float
+
+
+
+@lru_cache(maxsize=None)
+def load_config() -> Config:
+    """! @brief Reads the configuration, loading the .env file the first time.
+    @return Config, the configuration, the same object at every call
+
+    The variables already set in the environment take precedence over the
+    ones in the .env file. The presence of the required ones is checked by
+    the scripts using them.
+    """
+    load_dotenv()
+    return Config(
+        db=os.getenv("DB_PATH"),
+        bot_token=os.getenv("BOT_TOKEN"),
+        debug=os.getenv("DEBUG", "False").strip().lower() == "true",
+        log_format=os.getenv("LOG_FORMAT", "text").strip().lower(),
+        log_sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "1")),
+        bot_mode=os.getenv("BOT_MODE", "polling").strip().lower(),
+        webhook_url=os.getenv("WEBHOOK_URL"),
+        webhook_listen=os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", "8443")),
+        webhook_path=os.getenv("WEBHOOK_PATH", "webhook"),
+        webhook_secret=os.getenv("WEBHOOK_SECRET") or None,
+        webhook_max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+        max_concurrent_updates=int(os.getenv("MAX_CONCURRENT_UPDATES", "32")),
+        workers=max(1, int(os.getenv("WORKERS", "1"))),
+        persistence_interval=float(os.getenv("PERSISTENCE_INTERVAL", "10")),
+        # Leads are given in hours, kept in minutes
+        reminder_leads=tuple(
+            round(float(hours) * 60) for hours in os.getenv("REMINDER_LEADS", "24,1").split(",") if hours.strip()
+        ),
+        reminder_interval=float(os.getenv("REMINDER_INTERVAL", "60"))
+    )
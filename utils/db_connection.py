@@ -0,0 +1,419 @@
+"""!
+@file db_connection.py
+@brief Connections to the database, optionally shared by several functions.
+
+This file contains the function the other modules in <code>utils/</code> use to
+open a connection to the database. Normally each call opens a new connection,
+that the caller commits and closes. Inside a <code>batch</code> block, instead,
+every call for the same database returns the same connection, so all the
+functions called in the block run in a single transaction: it is committed at
+the end of the block, or rolled back if an exception is raised or a dry run is
+requested.
+
+A <code>read_session</code> block works the same way for the read functions of
+a handler step: they share one connection and one read transaction, so they
+see a single snapshot of the database, even if another process writes between
+two of them, and the lock is acquired once. The connection of a session is
+read-only.
+
+Every connection enforces the foreign keys of the schema, so deleting a record
+also deletes or detaches the records referring to it, see <code>create_db.py</code>.
+
+The functions don't need to know if they run in a batch. On the shared
+connection <code>commit</code> and <code>close</code> do nothing, and the
+transactions a function opens itself with <code>BEGIN</code> become savepoints,
+so their <code>rollback</code> undoes only the changes of that function.
+
+Finally, the in-memory caches of each process, like the free-slot index of
+<code>availability.py</code>, learn here which entities the other processes
+changed, e.g. <code>edit_db.py</code> or the other workers of the bot. The
+triggers created by <code>create_db.py</code> count the changes of each user,
+fair and event in the table <code>entity_versions</code>. The caches call
+<code>sync_changes</code> before each lookup: if <code>data_version</code> says
+that the database was modified, the entities whose version changed since the
+previous call are passed to the functions registered with
+<code>add_change_listener</code>. The changes made by this process are not
+passed: its write functions update the caches themselves, so every connection
+opened here records the versions its own transactions produce.
+"""
+
+import sqlite3, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Hashable, Iterator
+
+# The database path and the connection shared by the current batch or session, if any
+_shared: ContextVar = ContextVar("shared_connection", default=None)
+
+# Maps each database path to the connection kept open to watch its changes
+_watchers: dict[str, sqlite3.Connection] = {}
+
+# Maps each database path to the _ChangeTracker of its entities
+_trackers: dict = {}
+
+# Serializes the updates of the trackers, which the write functions can run in any thread
+_trackers_lock = threading.Lock()
+
+# Called with the entities changed by other processes, None if they are unknown
+_listeners: list[Callable[[tuple|None], None]] = []
+
+# Kinds of the entities standing for a whole collection, e.g. ("fairs",)
+COLLECTION_KINDS = ("fairs", "events")
+
+
+
+
+
+class _SharedConnection:
+    """! @brief Connection of a batch or session, as seen by the functions called in it.
+
+    Every attribute not redefined here is the one of the underlying connection.
+    """
+
+    __slots__ = ("_con", "_in_step")
+
+    def __init__(self, con:sqlite3.Connection):
+        """! @brief Wraps the connection of a batch.
+        @param con: Connection, the connection, already inside a transaction
+        """
+        self._con = con
+        self._in_step = False
+
+    def __getattr__(self, name:str):
+        """! @brief Forwards the other attributes, like <code>cursor</code>, to the connection.
+        @param name: string, the name of the attribute
+        @return the attribute of the underlying connection
+        """
+        return getattr(self._con, name)
+
+    def execute(self, sql:str, parameters=()) -> sqlite3.Cursor:
+        """! @brief Runs a statement, turning BEGIN into a savepoint.
+        @param sql: string, the statement
+        @param parameters: the values of its placeholders
+        @return Cursor, the cursor of the statement
+        """
+        if sql.lstrip().upper().startswith("BEGIN"):
+            self._in_step = True
+            return self._con.execute("SAVEPOINT step;")
+        return self._con.execute(sql, parameters)
+
+    def commit(self) -> None:
+        """! @brief Ends the savepoint of the calling function, if any.
+        @return None
+
+        The batch itself is committed only at the end of the block.
+        """
+        if self._in_step:
+            self._in_step = False
+            self._con.execute("RELEASE step;")
+
+    def rollback(self) -> None:
+        """! @brief Undoes the changes since the savepoint of the calling function, if any.
+        @return None
+        """
+        if self._in_step:
+            self._in_step = False
+            self._con.execute("ROLLBACK TO step;")
+            self._con.execute("RELEASE step;")
+
+    def close(self) -> None:
+        """! @brief Does nothing, the connection is closed at the end of the batch.
+        @return None
+        """
+        return
+
+
+
+
+
+class _TrackedConnection(sqlite3.Connection):
+    """! @brief Connection recording the entity versions produced by its own transactions.
+
+    Every write transaction is started with <code>BEGIN IMMEDIATE</code>, the
+    implicit ones too, and marks its start in <code>change_counter</code>. As
+    no other connection can write until the commit, the entities changed after
+    the mark are the ones changed by this transaction, and the triggers save
+    the version each one had before it. At the commit the versions are passed
+    to the tracker of the database, see <code>_ChangeTracker.record_own</code>.
+    """
+
+    def __init__(self, db:str, *args, **kwargs):
+        """! @brief Opens the connection.
+        @param db: string, the path to the database file
+        """
+        super().__init__(db, *args, **kwargs)
+        self.db = db
+        self.transaction_start = None
+
+    def execute(self, sql:str, parameters=()) -> sqlite3.Cursor:
+        """! @brief Runs a statement, marking the start and the commit of the write transactions.
+        @param sql: string, the statement
+        @param parameters: the values of its placeholders
+        @return Cursor, the cursor of the statement
+        """
+        command = sql.lstrip()[:16].upper()
+        if command.startswith(("INSERT", "UPDATE", "DELETE", "REPLACE")):
+            if not self.in_transaction and self.isolation_level is not None:
+                self.execute("BEGIN IMMEDIATE;")
+        elif command.startswith(("BEGIN IMMEDIATE", "BEGIN EXCLUSIVE")):
+            cursor = super().execute(sql, parameters)
+            self._mark_start()
+            return cursor
+        elif command.startswith(("COMMIT", "END")):
+            changes = self._own_changes()
+            cursor = super().execute(sql, parameters)
+            self._record(changes)
+            return cursor
+        elif command.startswith("ROLLBACK") and not command.startswith("ROLLBACK TO"):
+            self.transaction_start = None
+        return super().execute(sql, parameters)
+
+    def commit(self) -> None:
+        """! @brief Commits the transaction, then records the versions it produced.
+        @return None
+        """
+        changes = self._own_changes()
+        super().commit()
+        self._record(changes)
+
+    def rollback(self) -> None:
+        """! @brief Rolls back the transaction, which produced no version.
+        @return None
+        """
+        self.transaction_start = None
+        super().rollback()
+
+    def _mark_start(self) -> None:
+        """! @brief Marks the start of a write transaction in <code>change_counter</code>.
+        @return None
+
+        Databases created before the change counters are left untouched.
+        """
+        try:
+            self.transaction_start = super().execute(
+                "UPDATE change_counter SET transaction_start=last_change_id RETURNING transaction_start;"
+            ).fetchone()[0]
+        except sqlite3.OperationalError:
+            self.transaction_start = None
+
+    def _own_changes(self) -> list[tuple[str,int,int,int]]:
+        """! @brief Reads the entities changed by the current transaction.
+        @return list[tuple[str,int,int,int]], each as (kind,entity_key,base_version,version)
+        """
+        if self.transaction_start is None or not self.in_transaction:
+            return []
+        return super().execute(
+            """
+            SELECT kind, entity_key, base_version, version
+            FROM entity_versions
+            WHERE change_id > ?;
+            """,
+            (self.transaction_start,)
+        ).fetchall()
+
+    def _record(self, changes:list[tuple[str,int,int,int]]) -> None:
+        """! @brief Passes the versions produced by the committed transaction to the tracker.
+        @param changes: list[tuple[str,int,int,int]], the result of <code>_own_changes</code>
+        @return None
+        """
+        self.transaction_start = None
+        tracker = _trackers.get(self.db)
+        if changes and tracker is not None:
+            tracker.record_own(changes)
+
+
+
+class _ChangeTracker:
+    """! @brief Versions of the entities of a database, as known by the caches of this process."""
+
+    __slots__ = ("versions", "last_change_id", "data_version")
+
+    def __init__(self, rows:list[tuple[str,int,int,int]], data_version:int):
+        """! @brief Builds the tracker from all the rows of <code>entity_versions</code>.
+        @param rows: list[tuple[str,int,int,int]], each as (kind,entity_key,version,change_id)
+        @param data_version: integer, the data version read before the rows
+        """
+        self.versions = {_entity(kind, key): version for kind, key, version, _ in rows}
+        self.last_change_id = max((row[3] for row in rows), default=0)
+        self.data_version = data_version
+
+    def apply(self, rows:list[tuple[str,int,int,int]]) -> list[Hashable]:
+        """! @brief Applies the rows changed since the previous call.
+        @param rows: list[tuple[str,int,int,int]], each as (kind,entity_key,version,change_id)
+        @return list, the entities whose version is not the one known, i.e. changed by others
+        """
+        changed = []
+        for kind, key, version, change_id in rows:
+            entity = _entity(kind, key)
+            if self.versions.get(entity, 0) != version:
+                self.versions[entity] = version
+                changed.append(entity)
+            self.last_change_id = max(self.last_change_id, change_id)
+        return changed
+
+    def record_own(self, changes:list[tuple[str,int,int,int]]) -> None:
+        """! @brief Records the versions produced by a transaction of this process.
+        @param changes: list[tuple[str,int,int,int]], each as (kind,entity_key,base_version,version)
+        @return None
+
+        A version is recorded only if the entity was at the version known before
+        the transaction. Otherwise another process changed it in the meantime,
+        and the next <code>sync_changes</code> reports it.
+        """
+        with _trackers_lock:
+            for kind, key, base_version, version in changes:
+                entity = _entity(kind, key)
+                if self.versions.get(entity, 0) == base_version:
+                    self.versions[entity] = version
+
+def _entity(kind:str, key:int) -> Hashable:
+    """! @brief Converts a row of <code>entity_versions</code> into the key of an entity.
+    @param kind: string, the kind of the entity
+    @param key: integer, the key of the entity, 0 for a collection
+    @return tuple, e.g. ("event", 42) or ("fairs",)
+    """
+    return (kind,) if kind in COLLECTION_KINDS else (kind, key)
+
+
+
+
+
+def connect(db:str) -> sqlite3.Connection:
+    """! @brief Opens a connection to the database, or returns the one of the current batch or session.
+    @param db: string, the path to the database file
+    @return Connection, the connection, to commit and close as usual
+    """
+    shared = _shared.get()
+    if shared is not None and shared[0] == db:
+        return shared[1]
+    con = sqlite3.connect(db, factory=_TrackedConnection)
+    con.execute("PRAGMA foreign_keys=ON;")
+    return con
+
+@contextmanager
+def batch(db:str, dry_run:bool=False) -> Iterator[None]:
+    """! @brief Runs all the database functions called in the block in one transaction.
+    @param db: string, the path to the database file
+    @param dry_run: boolean, if True the changes are rolled back at the end of the block
+    @return Iterator, the context manager
+
+    The write lock is taken at the start of the block, so the records read in it
+    can't be changed by others until its end. If an exception is raised inside
+    the block, every change is rolled back.
+    """
+    con = sqlite3.connect(db, isolation_level=None, factory=_TrackedConnection)
+    con.execute("PRAGMA foreign_keys=ON;")
+    con.execute("BEGIN IMMEDIATE;")
+    token = _shared.set((db, _SharedConnection(con)))
+    try:
+        yield
+    except BaseException:
+        con.execute("ROLLBACK;")
+        raise
+    else:
+        con.execute("ROLLBACK;" if dry_run else "COMMIT;")
+    finally:
+        _shared.reset(token)
+        con.close()
+
+@contextmanager
+def read_session(db:str) -> Iterator[None]:
+    """! @brief Runs all the read functions called in the block on one snapshot of the database.
+    @param db: string, the path to the database file
+    @return Iterator, the context manager
+
+    The snapshot is taken at the first read and kept until the end of the
+    block, so the block should contain only reads, and no await: until then the
+    writes of other connections can't commit, or in WAL mode are not seen.
+    Calling a write function in the block raises an error. Inside a batch, or
+    another session, the block just uses their transaction.
+    """
+    shared = _shared.get()
+    if shared is not None and shared[0] == db:
+        yield
+        return
+    con = sqlite3.connect(db, isolation_level=None)
+    con.execute("PRAGMA query_only=ON;")
+    con.execute("BEGIN DEFERRED;")
+    token = _shared.set((db, _SharedConnection(con)))
+    try:
+        yield
+    finally:
+        _shared.reset(token)
+        # Nothing to commit, this just releases the snapshot
+        con.execute("ROLLBACK;")
+        con.close()
+
+def data_version(db:str) -> int:
+    """! @brief Returns a number that changes every time a change is committed to the database.
+    @param db: string, the path to the database file
+    @return integer, the current data version
+
+    The number is read with <code>PRAGMA data_version</code> on a connection
+    kept open for the whole process, which never writes: so it changes after
+    the commits of every other connection, of this process or of others. It is
+    meant to be compared with an older value, to know if the database changed
+    meanwhile. Reading it takes a few microseconds and no lock.
+    """
+    watcher = _watchers.get(db)
+    if watcher is None:
+        watcher = _watchers[db] = sqlite3.connect(db, check_same_thread=False)
+    return watcher.execute("PRAGMA data_version;").fetchone()[0]
+
+def add_change_listener(listener:Callable[[tuple|None], None]) -> None:
+    """! @brief Registers a function to call with the entities changed by other processes.
+    @param listener: function, called with the tuple of the changed entities, e.g.
+    (("event", 42), ("fairs",)), or None if the changes are unknown
+    @return None
+
+    The changes are unknown if the database has no change counters, i.e. it was
+    created by an older version of <code>create_db.py</code>: then every commit
+    of any connection counts as a change of everything.
+    """
+    _listeners.append(listener)
+
+def sync_changes(db:str) -> None:
+    """! @brief Passes to the listeners the entities changed by other processes since the previous call.
+    @param db: string, the path to the database file
+    @return None
+
+    If the data version didn't change, this only costs reading it. Otherwise
+    only the rows of <code>entity_versions</code> changed since the previous
+    call are read, through the index on <code>change_id</code>. The first call
+    only loads the versions, since nothing can be cached from the database yet.
+    """
+    tracker = _trackers.get(db)
+    version = data_version(db)
+    if tracker is not None and tracker.data_version == version:
+        return
+
+    watcher = _watchers[db]
+    with _trackers_lock:
+        tracker = _trackers.get(db)
+        try:
+            if tracker is None:
+                rows = watcher.execute("SELECT kind, entity_key, version, change_id FROM entity_versions;").fetchall()
+                _trackers[db] = _ChangeTracker(rows, version)
+                return
+            rows = watcher.execute(
+                """
+                SELECT kind, entity_key, version, change_id
+                FROM entity_versions
+                WHERE change_id > ?;
+                """,
+                (tracker.last_change_id,)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # No change counters: any change may concern any entity
+            if tracker is None:
+                _trackers[db] = tracker = _ChangeTracker([], version)
+            tracker.data_version = version
+            changed = None
+        else:
+            changed = tuple(tracker.apply(rows))
+            tracker.data_version = version
+            if not changed:
+                return
+
+    for listener in _listeners:
+        listener(changed)
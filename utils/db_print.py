@@ -8,7 +8,8 @@ them to the user. They are useful when the database is being inspected directly
 the code instead of using the Telegram API.
 """
 
-import sqlite3
+from utils.db_connection import connect
+from utils.slot_time import format_time
 
 
 
@@ -22,7 +23,7 @@ def print_users_by_id(db:str) -> None:
     This function prints all the records in the <code>user</code> table
     of the specified database, ordering them by <code>user_id</code> field.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -58,7 +59,7 @@ def print_users_by_name(db:str) -> None:
     This function prints all the records in the <code>user</code> table
     of the specified database, ordering them by <code>name</code> field.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -98,7 +99,7 @@ def print_fairs(db:str, description:bool=False) -> None:
     it as well setting the <code>description</code> parameter of this function
     to True.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -146,7 +147,7 @@ def print_events(db:str, description:bool=False) -> None:
     it as well setting the <code>description</code> parameter of this function
     to True.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -205,7 +206,7 @@ def print_events_with_fair(db:str) -> None:
     <code>events</code> table of the specified database, together with the name
     and ID of the fair associated to them. Values are ordered by event's name.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -245,7 +246,7 @@ def print_events_with_owner(db:str) -> None:
     <code>events</code> table of the specified database, together with the name
     and ID of the user that published them. Values are ordered by event's name.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -288,7 +289,7 @@ def print_event_slots(db:str, event_id:int) -> None:
     and username are printed as well, otherwise "SLOT AVAILABLE" will be shown.
     Values are ordered by <code>start_time</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -316,8 +317,8 @@ def print_event_slots(db:str, event_id:int) -> None:
     for row in cur.fetchall():
         if row[1] is None:  # If no user is associated to the slot
             print(
-                "| " + row[2].rjust(19) + " | " +
-                row[3].rjust(19) + " | " +
+                "| " + format_time(row[2]).rjust(19) + " | " +
+                format_time(row[3]).rjust(19) + " | " +
                 str(row[0]).rjust(16) + " | " +
                 "SLOT AVAILABLE".rjust(16) + " | " +
                 "".rjust(32) + " | " +
@@ -326,8 +327,8 @@ def print_event_slots(db:str, event_id:int) -> None:
 
         else:
             print(
-                "| " + row[2].rjust(19) + " | " +
-                row[3].rjust(19) + " | " +
+                "| " + format_time(row[2]).rjust(19) + " | " +
+                format_time(row[3]).rjust(19) + " | " +
                 str(row[0]).rjust(16) + " | " +
                 str(row[1]).rjust(16) + " | " +
                 str(row[4]).rjust(32) + " | " +
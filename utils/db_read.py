@@ -4,7 +4,7 @@
 
 This file contains the implementation of the functions with reading access
 to the database, i.e. that can't modify the records contained in it but can only
-retrieve values. They are grouped into four categories:
+retrieve values. They are grouped into five categories:
 
 1) Functions to read from "users" table
 
@@ -13,9 +13,21 @@ retrieve values. They are grouped into four categories:
 3) Functions to read from "events" table
 
 4) Functions to read from "slots" table
+
+5) Functions to search the full-text indexes "fairs_fts" and "events_fts"
+
+The lists of records are returned as a <code>RecordList</code>, see
+<code>records.py</code>, whose items can be read by field name or by position.
+The times of the slots are returned as stored, i.e. as integers, see
+<code>slot_time.py</code> to convert and format them. The free slots of an
+event, by day or month, are read from the in-memory index of
+<code>availability.py</code>, loaded with <code>get_slot_availability</code>.
 """
 
-import sqlite3
+import re
+
+from utils.db_connection import connect
+from utils.records import User, Fair, Event, Slot, UserSlot, EventSlot, EventWithFair, SlotSchedule, SearchResult, RecordList
 
 
 
@@ -23,17 +35,17 @@ import sqlite3
 
 # Functions to read from "users" table
 
-def get_users(db:str) -> list[tuple[int,str,str]]:
+def get_users(db:str) -> RecordList:
     """! @brief Retrieves a list of all the users in the database.
     @param db: string, the path to the database file
-    @return list[tuple[int,str,str]], a list of all the user records,
-    each one being a tuple (user_id,name,username)
+    @return RecordList[User], a list of all the user records,
+    each one being a User record (user_id,name,username)
 
     This function retrieves all the users in the database and returns them
-    as a list of tuples ordered by name, each one structured as
+    as a list of User records ordered by name, each one structured as
     <code>(user_id,name,username)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -43,7 +55,7 @@ def get_users(db:str) -> list[tuple[int,str,str]]:
         ORDER BY name ASC
         """
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), User)
 
     con.close()
     return res
@@ -59,7 +71,7 @@ def get_user_from_id(db:str, user_id:int) -> [str, str]:
     and username associated with it. In case no record is associated to the ID,
     a couple <code>(None,None)</code> is returned.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -83,17 +95,17 @@ def get_user_from_id(db:str, user_id:int) -> [str, str]:
 
 # Functions to read from "fairs" table
 
-def get_fairs(db:str) -> list[tuple[int,str,str]]:
+def get_fairs(db:str) -> RecordList:
     """! @brief Retrieves a list of all the fairs in the database.
     @param db: string, the path to the database file
-    @return list[tuple[int,str,str]], a list of all the fair records,
-    each one being a tuple (user_id,name,description)
+    @return RecordList[Fair], a list of all the fair records,
+    each one being a Fair record (fair_id,name,description)
 
     This function retrieves all the fairs in the database and returns them
-    as a list of tuples ordered by name, each one structured as
-    <code>(user_id,name,description)</code>.
+    as a list of Fair records ordered by name, each one structured as
+    <code>(fair_id,name,description)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -103,7 +115,7 @@ def get_fairs(db:str) -> list[tuple[int,str,str]]:
         ORDER BY name ASC
         """
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), Fair)
 
     con.close()
     return res
@@ -119,7 +131,7 @@ def get_fair_from_id(db:str, fair_id:int) -> [str, str]:
     and description associated with it. In case no record is associated to the ID,
     a couple <code>(None,None)</code> is returned.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -143,17 +155,17 @@ def get_fair_from_id(db:str, fair_id:int) -> [str, str]:
 
 # Functions to read from "events" table
 
-def get_events(db:str) -> list[tuple[int,int,int,str,str]]:
+def get_events(db:str) -> RecordList:
     """! @brief Retrieves a list of all the events in the database.
     @param db: string, the path to the database file
-    @return list[tuple[int,int,int,str,str]], a list of all the event records,
-    each one being a tuple (event_id,fair_id,owner_id,name,description)
+    @return RecordList[Event], a list of all the event records,
+    each one being an Event record (event_id,fair_id,owner_id,name,description)
 
     This function retrieves all the events in the database and returns them
-    as a list of tuples ordered by name, each one structured as
+    as a list of Event records ordered by name, each one structured as
     <code>(event_id,fair_id,owner_id,name,description)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -163,7 +175,7 @@ def get_events(db:str) -> list[tuple[int,int,int,str,str]]:
         ORDER BY name ASC
         """
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), Event)
 
     con.close()
     return res
@@ -181,7 +193,7 @@ def get_event_from_id(db:str, event_id:int) -> [int,int,str, str]:
     associated with it: fair's ID, owner's ID, name and description. In case no
     record is associated to the ID, a tuple of four None is returned.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -209,7 +221,7 @@ def get_event_name(db:str, event_id:int) -> str|None:
     most requested field of an event record: the name. In case no
     record is associated to the ID, None is returned.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -227,19 +239,19 @@ def get_event_name(db:str, event_id:int) -> str|None:
         return None
     return res[0]
 
-def get_events_given_fair(db:str, fair_id:int) -> list[tuple[int,int,int,str,str]]:
+def get_events_given_fair(db:str, fair_id:int) -> RecordList:
     """! @brief Retrieves a list of all the events belonging to a fair.
     @param db: string, the path to the database file
     @param fair_id: integer, only the events belonging to this fair are considered
-    @return list[tuple[int,int,int,str,str]], a list of the event records
-    belonging to the fair, each one being a tuple
+    @return RecordList[Event], a list of the event records
+    belonging to the fair, each one being an Event record
     (event_id, fair_id, owner_id, name, description)
 
     This function retrieves all the events in the database belonging to a certain
-    fair. The result is a list of tuples ordered by name, each one structured as
+    fair. The result is a list of Event records ordered by name, each one structured as
     <code>(event_id,fair_id,owner_id,name,description)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -251,25 +263,25 @@ def get_events_given_fair(db:str, fair_id:int) -> list[tuple[int,int,int,str,str
         """,
         [fair_id,]
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), Event)
 
     con.close()
     return res
 
-def get_events_given_owner(db:str, owner_id:int) -> list[tuple[int,int,int,str,str]]:
+def get_events_given_owner(db:str, owner_id:int) -> RecordList:
     """! @brief Retrieves a list of all the events published by a user.
     @param db: string, the path to the database file
     @param owner_id: integer, the ID of the user to look for
-    @return list[tuple[int,int,int,str,str]], a list of the event records
-    published by that user, each one being a tuple
+    @return RecordList[Event], a list of the event records
+    published by that user, each one being an Event record
     (event_id, fair_id, owner_id, name, description)
 
     This function retrieves all the events in the database with a certain
     <code>owner_id</code>, i.e. published by a certain user. The result is
-    a list of tuples ordered by name, each one structured as
+    a list of Event records ordered by name, each one structured as
     <code>(event_id,fair_id,owner_id,name,description)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -281,7 +293,35 @@ def get_events_given_owner(db:str, owner_id:int) -> list[tuple[int,int,int,str,s
         """,
         [owner_id,]
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), Event)
+
+    con.close()
+    return res
+
+def get_events_with_fair(db:str) -> RecordList:
+    """! @brief Retrieves a list of all the events, with the name of their fair.
+    @param db: string, the path to the database file
+    @return RecordList[EventWithFair], a list of the event records,
+    each one being an EventWithFair record (event_id,name,description,fair_id,fair_name)
+
+    This function retrieves all the events in the database joined with the
+    fair they belong to. The result is a list of EventWithFair records ordered
+    by name, each one structured as <code>(event_id,name,description,fair_id,fair_name)</code>.
+    Events whose fair doesn't exist are left out.
+    """
+    con = connect(db)
+    cur = con.cursor()
+
+    cur.execute(
+        """
+        SELECT events.event_id, events.name, events.description,
+        fairs.fair_id, fairs.name
+        FROM events JOIN fairs
+        ON events.fair_id = fairs.fair_id
+        ORDER BY events.name ASC
+        """
+    )
+    res = RecordList(cur.fetchall(), EventWithFair)
 
     con.close()
     return res
@@ -292,17 +332,17 @@ def get_events_given_owner(db:str, owner_id:int) -> list[tuple[int,int,int,str,s
 
 # Functions to read from "slots" table
 
-def get_slots(db:str) -> list[tuple[int,int,int,str,str]]:
+def get_slots(db:str) -> RecordList:
     """! @brief Retrieves a list of all the slots in the database.
     @param db: string, the path to the database file
-    @return list[tuple[int,int,int,str,str]], a list of all the slot records,
-    each one being a tuple (slot_id,event_id,user_id,start_time,end_time)
+    @return RecordList[Slot], a list of all the slot records,
+    each one being a Slot record (slot_id,event_id,user_id,start_time,end_time)
 
     This function retrieves all the slots in the database and returns them
-    as a list of tuples ordered by start time, each one structured as
+    as a list of Slot records ordered by start time, each one structured as
     <code>(slot_id,event_id,user_id,start_time,end_time)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -312,26 +352,26 @@ def get_slots(db:str) -> list[tuple[int,int,int,str,str]]:
         ORDER BY start_time ASC
         """
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), Slot)
 
     con.close()
     return res
 
-def get_slot_from_id(db:str, slot_id:int) -> [int, int, str, str]:
+def get_slot_from_id(db:str, slot_id:int) -> [int, int, int, int]:
     """! @brief Retrieves the data of a specific slot record.
     @param db: string, the path to the database file
     @param slot_id: integer, ID of the slot to retrieve
     @return event_id: integer, ID of the event the slot refers to
     @return user_id: integer, ID of the user that booked this slot
-    @return start_time: time string ISO-8601, date and time the slot will start
-    @return end_time: time string ISO-8601, date and time the slot will end
+    @return start_time: integer, date and time the slot will start, as stored
+    @return end_time: integer, date and time the slot will end, as stored
 
     Given the identifier of a slot record, this function returns the data
     associated with it: event's ID, user that booked it (None if it's a free slot),
-    start time and end time. The two times are time strings in ISO-8601 format.
+    start time and end time.
     If no record is associated to the ID, a tuple of four None is returned.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -349,94 +389,21 @@ def get_slot_from_id(db:str, slot_id:int) -> [int, int, str, str]:
         return None, None, None, None
     return res[0], res[1], res[2], res[3]
 
-def get_slot_dates(db:str, event_id:int) -> list[tuple[str]]:
-    """! @brief Retrieves a list of all the dates with at least one free slot
-    associated with them, restricted to a given event.
-    @param db: string, the path to the database file
-    @param event_id: integer, only slots associated with this event are considered
-    @return list[tuple[str]], a list of all the days with at least one free slots
-    associated with them, each one being a singleton (date,)
-
-    This function retrieves the dates of all the slots that meets the
-    following criteria:
-
-    1) The slot is free, i.e. with NULL user
-
-    2) The slot's event_id is the one passed as parameter
-
-    The result is a list of tuples, each one structured as a singleton
-    <code>(date,)</code>.
-    """
-    con = sqlite3.connect(db)
-    cur = con.cursor()
-
-    cur.execute(
-        """
-        SELECT DATE(start_time) AS slot_day
-        FROM slots
-        WHERE event_id=? AND user_id IS NULL
-        GROUP BY slot_day
-        ORDER BY slot_day
-        """,
-        [event_id,]
-    )
-    res = cur.fetchall()
-
-    con.close()
-    return res
-
-def get_slot_times(db:str, event_id:int, slot_day:str) -> list[tuple[int,str,str]]:
-    """! @brief Retrieves a list of all the slots in the database for a given
-    date and event.
-    @param db: string, the path to the database file
-    @param event_id: integer, only slots associated with this event are considered
-    @param slot_day: time string ISO-8601, only slots scheduled to start
-    on this day are considered
-    @return list[tuple[int,str,str]], a list of all the slot records,
-    each one being a tuple (slot_id, start_time, end_time)
-
-    This function retrieves all the events in the database associated with a given
-    event ID <b>and</b> scheduled to start on a given day. The result is
-    a list of tuples ordered by <code>start_time</code>, each one structured as
-    <code>(slot_id,start_time,end_time)</code>.
-    Please ensure the <code>slot_day</code> string is formatted according to an
-    ISO-8601 day, i.e. "YYYY-MM-DD", as no format check is made.
-    Also note that since the day is passed as a parameter, <code>start_time</code>
-    and <code>end_time</code> will contain just the ISO-8601 time component
-    as ""HH:MM:SS, without including the day.
-    """
-    con = sqlite3.connect(db)
-    cur = con.cursor()
-
-    cur.execute(
-        """
-        SELECT slot_id, TIME(start_time) AS start_time, TIME(end_time) AS end_time
-        FROM slots
-        WHERE event_id=? AND user_id IS NULL AND DATE(start_time)=?
-        ORDER BY start_time ASC
-        """,
-        [event_id,slot_day]
-    )
-    res = cur.fetchall()
-
-    con.close()
-    return res
-
-def get_slots_given_user(db:str, user_id:int) -> list[tuple[int,int,str,str,str,str]]:
+def get_slots_given_user(db:str, user_id:int) -> RecordList:
     """! @brief Retrieves a list of all the slots booked by a user.
     @param db: string, the path to the database file
     @param user_id: integer, the ID of the user to look for
-    @return list[tuple[int,int,str,str,str,str]], a list of the slot records
-    booked by that user, each one being a tuple
+    @return RecordList[UserSlot], a list of the slot records
+    booked by that user, each one being a UserSlot record
     (slot_id,event_id,start_time,end_time,event_name,event_description)
 
     This function retrieves all the slots in the database with a certain
     <code>user_id</code>, i.e. booked by a certain user. The result is
-    a list of tuples ordered first by event_name and then by start_time,
+    a list of UserSlot records ordered first by event_name and then by start_time,
     each one structured as
     <code>(slot_id,event_id,start_time,end_time,event_name,event_description)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -450,26 +417,26 @@ def get_slots_given_user(db:str, user_id:int) -> list[tuple[int,int,str,str,str,
         """,
         [user_id,]
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), UserSlot)
 
     con.close()
     return res
 
-def get_slots_given_event(db:str, event_id:int) -> list[tuple[int,int,str,str,str,str]]:
+def get_slots_given_event(db:str, event_id:int) -> RecordList:
     """! @brief Retrieves a list of all the slots associated to an event.
     @param db: string, the path to the database file
     @param event_id: integer, the ID of the event to look for
-    @return list[tuple[int,int,str,str,str,str]], a list of the slot records
-    associated to the event, each one being a tuple
+    @return RecordList[EventSlot], a list of the slot records
+    associated to the event, each one being an EventSlot record
     (slot_id,user_id,start_time,end_time,user_name,user_username)
 
     This function retrieves all the slots in the database with a certain
     <code>event_id</code>, i.e. associated to a certain event. The result is
-    a list of tuples ordered first by start_time and then by user_name,
+    a list of EventSlot records ordered first by start_time and then by user_name,
     each one structured as
     <code>(slot_id,user_id,start_time,end_time,user_name,user_username)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
@@ -483,45 +450,99 @@ def get_slots_given_event(db:str, event_id:int) -> list[tuple[int,int,str,str,st
         """,
         [event_id,]
     )
-    res = cur.fetchall()
+    res = RecordList(cur.fetchall(), EventSlot)
 
     con.close()
     return res
 
-def count_slots(db:str, event_id:int) -> [int, int]:
-    """! @brief Counts the free and total number of slots associate with an event.
+def get_slot_availability(db:str, event_id:int) -> RecordList:
+    """! @brief Retrieves the schedule of all the slots associated to an event.
     @param db: string, the path to the database file
-    @param event_id: integer, only slots associated with this event are considered
-    @return free_slots: integer, number of free slots associated to the event
-    @return all_slots: integer, total number of slots associated to the event
+    @param event_id: integer, the ID of the event to look for
+    @return RecordList[SlotSchedule], a list of the slot records
+    associated to the event, each one being a SlotSchedule record
+    (slot_id,start_time,end_time,is_free)
 
-    This function counts how many slots associated to a given event are free, i.e.
-    with NULL <code>user_id</code>, as well as the total number of slots associated
-    to the event, regardless of their <code>user_id</code>.
+    This function retrieves all the slots in the database with a certain
+    <code>event_id</code>, with just the fields needed to know when they are
+    free. The result is a list of SlotSchedule records ordered by start_time
+    and then by slot_id, each one structured as <code>(slot_id,start_time,end_time,is_free)</code>.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     cur = con.cursor()
 
     cur.execute(
         """
-        SELECT COUNT(*)
+        SELECT slot_id, start_time, end_time, user_id IS NULL
         FROM slots
-        WHERE event_id=? AND user_id IS NULL
+        WHERE event_id = ?
+        ORDER BY start_time ASC, slot_id ASC
         """,
         [event_id,]
     )
-    free_slots = cur.fetchone()
-    free_slots = free_slots[0]
+    res = RecordList(cur.fetchall(), SlotSchedule)
+
+    con.close()
+    return res
+
+
+
+
+
+# Functions to search the full-text indexes "fairs_fts" and "events_fts"
+
+def make_match_query(text:str) -> str|None:
+    """! @brief Turns the text typed by a user into an FTS5 query.
+    @param text: string, the words to look for
+    @return string, the query for the MATCH operator, None if the text has no words
+
+    Each word is quoted, so that the FTS5 operators and punctuation typed by the
+    user have no effect, and matches any word starting with it. A record must
+    match all the words to be returned.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join('"' + word + '"*' for word in words)
+
+def search_descriptions(db:str, match_query:str, limit:int, offset:int=0) -> RecordList:
+    """! @brief Searches the fairs and events by name and description.
+    @param db: string, the path to the database file
+    @param match_query: string, an FTS5 query, see <code>make_match_query</code>
+    @param limit: integer, maximum number of records to return
+    @param offset: integer, number of records to skip, for pagination
+    @return RecordList[SearchResult], a list of the matching records, each
+    one being a SearchResult record (kind,record_id,name,snippet)
+
+    This function looks for the fairs and events matching the query in the
+    full-text indexes, with a single query. The result is a list of SearchResult
+    records ordered by relevance, each one structured as
+    <code>(kind,record_id,name,snippet)</code>, where kind is "fair" or
+    "event" and snippet is the part of the description around the matches.
+    """
+    con = connect(db)
+    cur = con.cursor()
+
     cur.execute(
         """
-        SELECT COUNT(*)
-        FROM slots
-        WHERE event_id=?
+        SELECT kind, record_id, name, snippet
+        FROM (
+            SELECT 'fair' AS kind, rowid AS record_id, name,
+            snippet(fairs_fts, 1, '', '', '...', 12) AS snippet, bm25(fairs_fts) AS rank
+            FROM fairs_fts
+            WHERE fairs_fts MATCH ?
+            UNION ALL
+            SELECT 'event' AS kind, rowid AS record_id, name,
+            snippet(events_fts, 1, '', '', '...', 12) AS snippet, bm25(events_fts) AS rank
+            FROM events_fts
+            WHERE events_fts MATCH ?
+        )
+        ORDER BY rank ASC
+        LIMIT ? OFFSET ?
         """,
-        [event_id, ]
+        [match_query, match_query, limit, offset]
     )
-    all_slots = cur.fetchone()
-    all_slots = all_slots[0]
+    res = RecordList(cur.fetchall(), SearchResult)
 
     con.close()
-    return free_slots, all_slots
+    return res
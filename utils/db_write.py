@@ -11,11 +11,27 @@ grouped into three categories:
 2) Functions to update records already existing in the database
 
 3) Functions to delete records from the database
+
+The times of the slots are received as datetimes or ISO-8601 strings and stored
+as integers, see <code>slot_time.py</code>; the times returned are the stored
+integers, except for <code>create_slots_str</code>.
+
+Each function invalidates the cached outputs rendered from the records it
+modifies, see <code>render_cache.py</code>, and the functions modifying the
+slots keep the in-memory index of the free slots up to date, see
+<code>availability.py</code>. The ones changing the names of the events or of
+the fairs drop the index of the inline search, see <code>event_index.py</code>.
 """
 
 import sqlite3
 from datetime import datetime
 
+from utils.db_connection import connect
+from utils.slot_time import to_epoch, format_time
+from utils.render_cache import invalidate, invalidate_all
+from utils.availability import slot_created, slot_assigned, slot_deleted, forget_availability
+from utils.event_index import forget_event_index
+
 
 
 
@@ -33,16 +49,18 @@ def insert_user(db:str, user_id:int, name:str, username:str) -> None:
     This function inserts a new user into the database, and in case their user_id
     already exists it updates the other fields to the new values.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
-        INSERT OR REPLACE INTO users (user_id,name,username)
-        VALUES (?,?,?);
+        INSERT INTO users (user_id,name,username)
+        VALUES (?,?,?)
+        ON CONFLICT(user_id) DO UPDATE SET name=excluded.name, username=excluded.username;
         """,
         (user_id,name,username)
     )
     con.commit()
     con.close()
+    invalidate(("user", user_id))
     return
 
 def insert_fair(db:str, name:str, description:str) -> None:
@@ -55,7 +73,7 @@ def insert_fair(db:str, name:str, description:str) -> None:
     This function inserts a new fair into the database. The fair's ID is not
     required, as it is automatically generated by the database.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
         INSERT INTO fairs (name,description)
@@ -65,6 +83,7 @@ def insert_fair(db:str, name:str, description:str) -> None:
     )
     con.commit()
     con.close()
+    invalidate(("fairs",))
     return
 
 def insert_event(db:str, fair_id:int, owner_id:int, name:str, description:str) -> None:
@@ -79,7 +98,7 @@ def insert_event(db:str, fair_id:int, owner_id:int, name:str, description:str) -
     This function inserts a new event into the database. The event's ID is not
     required, as it is automatically generated by the database.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
         INSERT INTO events (fair_id,owner_id,name,description)
@@ -89,52 +108,81 @@ def insert_event(db:str, fair_id:int, owner_id:int, name:str, description:str) -
     )
     con.commit()
     con.close()
+    invalidate(("fair", fair_id), ("events",))
+    forget_event_index()
     return
 
-def create_slot(db:str, event_id:int, start_time:datetime, end_time:datetime) -> None:
-    """! @brief Creates a new slot in the database, with no user associated.
+def create_slot(db:str, event_id:int, start_time:datetime, end_time:datetime) -> list[tuple[str,str,str,str]]:
+    """! @brief Creates a new slot in the database, with no user associated, unless it overlaps.
     @param db: string, the path to the database file
     @param event_id: integer, ID of the event the slot refers to
     @param start_time: datetime, date and time the slot will start
     @param end_time: datetime, date and time the slot will end
-    @return None
+    @return list[tuple[str,str,str,str]], the overlap found, structured as
+    (start_time,end_time,other_start_time,other_end_time), empty if the slot was created
 
     This function creates a new free slot in the database, i.e. a slot associated
     with the NULL user. The slot's ID is not required, as it is automatically
-    generated by the database. Datetime objects are converted to ISO-8601 time strings.
+    generated by the database.
+    As in <code>create_slots_str</code>, the slot is not created if it overlaps
+    another slot of the event, and a ValueError is raised if it doesn't end
+    after it starts.
     """
-    con = sqlite3.connect(db)
-    con.execute(
+    start_time = to_epoch(start_time)
+    end_time = to_epoch(end_time)
+    _check_slot_times(start_time, end_time)
+    con = connect(db)
+    # The write lock is taken before checking, so no slot can be created meanwhile
+    con.execute("BEGIN IMMEDIATE;")
+    other = _find_slot_overlap(con, event_id, start_time, end_time)
+    if other is not None:
+        con.rollback()
+        con.close()
+        return [tuple(format_time(time) for time in (start_time, end_time) + other)]
+
+    cur = con.execute(
         """
         INSERT INTO slots (event_id,user_id,start_time,end_time)
         VALUES (?,?,?,?);
         """,
-        (
-            event_id,
-            None,
-            start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            end_time.strftime("%Y-%m-%d %H:%M:%S")
-        )
+        (event_id,None,start_time,end_time)
     )
     con.commit()
     con.close()
-    return
+    invalidate(("event", event_id))
+    slot_created(event_id, cur.lastrowid, start_time, end_time)
+    return []
 
-def create_slot_str(db:str, event_id:int, start_time:str, end_time:str) -> None:
-    """! @brief Creates a new slot in the database, with no user associated.
+def create_slot_str(db:str, event_id:int, start_time:str, end_time:str) -> list[tuple[str,str,str,str]]:
+    """! @brief Creates a new slot in the database, with no user associated, unless it overlaps.
     @param db: string, the path to the database file
     @param event_id: integer, ID of the event the slot refers to
     @param start_time: time string ISO-8601, date and time the slot will start
     @param end_time: time string ISO-8601, date and time the slot will end
-    @return None
+    @return list[tuple[str,str,str,str]], the overlap found, structured as
+    (start_time,end_time,other_start_time,other_end_time), empty if the slot was created
 
     This function creates a new free slot in the database, i.e. a slot associated
     with the NULL user. The slot's ID is not required, as it is automatically
     generated by the database. Please ensure the two time strings are formatted
-    according to ISO-8601, i.e. "YYYY-MM-DD HH:MM:SS", as no format check is made.
+    according to ISO-8601, i.e. "YYYY-MM-DD HH:MM:SS".
+    As in <code>create_slots_str</code>, the slot is not created if it overlaps
+    another slot of the event, and a ValueError is raised if it doesn't end
+    after it starts.
     """
-    con = sqlite3.connect(db)
-    con.execute(
+    start_time = to_epoch(start_time)
+    end_time = to_epoch(end_time)
+    _check_slot_times(start_time, end_time)
+    con = connect(db)
+    # The write lock is taken before checking, so no slot can be created meanwhile
+    con.execute("BEGIN IMMEDIATE;")
+    other = _find_slot_overlap(con, event_id, start_time, end_time)
+    if other is not None:
+        con.rollback()
+        con.close()
+        return [tuple(format_time(time) for time in (start_time, end_time) + other)]
+
+    cur = con.execute(
         """
         INSERT INTO slots (event_id,user_id,start_time,end_time)
         VALUES (?,?,?,?);
@@ -143,22 +191,309 @@ def create_slot_str(db:str, event_id:int, start_time:str, end_time:str) -> None:
     )
     con.commit()
     con.close()
-    return
+    invalidate(("event", event_id))
+    slot_created(event_id, cur.lastrowid, start_time, end_time)
+    return []
 
-def assign_slot(db:str, slot_id:int, user_id:int|None) -> None:
-    """! @brief Assigns an existing slot in the database to a user.
+def create_slots_str(db:str, event_id:int, slots:list[tuple[str,str]]) -> list[tuple[str,str,str,str]]:
+    """! @brief Creates several free slots for an event, unless they overlap.
+    @param db: string, the path to the database file
+    @param event_id: integer, ID of the event the slots refer to
+    @param slots: list[tuple[str,str]], the new slots, each one as (start_time,end_time)
+    @return list[tuple[str,str,str,str]], the overlaps found, each one as
+    (start_time,end_time,other_start_time,other_end_time), empty if the slots were created
+
+    This function creates all the given slots in a single transaction, only if
+    none of them overlaps another one of the batch or a slot already associated
+    to the event. Two slots overlap if each one starts before the other ends, so
+    a slot can start exactly when the previous one ends. In case of overlaps no
+    slot is created, and the pairs of overlapping slots are returned, with the
+    times as "YYYY-MM-DD HH:MM:SS". Please ensure the time strings are formatted
+    according to ISO-8601. A ValueError is raised if a slot doesn't end after
+    it starts, before any slot is created.
+
+    The slots of the batch are compared with each other after sorting them,
+    and each one with the slots of the event through <code>_find_slot_overlap</code>.
+    """
+    slots = sorted((to_epoch(start_time), to_epoch(end_time)) for start_time, end_time in slots)
+    for start_time, end_time in slots:
+        _check_slot_times(start_time, end_time)
+    overlaps = [
+        (start_time, end_time, previous_start, previous_end)
+        for (previous_start, previous_end), (start_time, end_time) in zip(slots, slots[1:])
+        if start_time < previous_end
+    ]
+
+    con = connect(db)
+    # The write lock is taken before checking, so no slot can be created meanwhile
+    con.execute("BEGIN IMMEDIATE;")
+    for start_time, end_time in slots:
+        other = _find_slot_overlap(con, event_id, start_time, end_time)
+        if other is not None:
+            overlaps.append((start_time, end_time) + other)
+
+    if overlaps:
+        con.rollback()
+        con.close()
+        return [tuple(format_time(time) for time in overlap) for overlap in overlaps]
+
+    slot_ids = []
+    for start_time, end_time in slots:
+        cur = con.execute(
+            """
+            INSERT INTO slots (event_id,user_id,start_time,end_time)
+            VALUES (?,?,?,?);
+            """,
+            (event_id,None,start_time,end_time)
+        )
+        slot_ids.append(cur.lastrowid)
+    con.commit()
+    con.close()
+    invalidate(("event", event_id))
+    for slot_id, (start_time, end_time) in zip(slot_ids, slots):
+        slot_created(event_id, slot_id, start_time, end_time)
+    return []
+
+def _find_slot_overlap(
+        con:sqlite3.Connection,
+        event_id:int,
+        start_time:int,
+        end_time:int,
+        slot_id:int|None=None
+) -> tuple[int,int]|None:
+    """! @brief Finds a slot of an event overlapping a time interval.
+    @param con: Connection, an open connection to the database
+    @param event_id: integer, ID of the event
+    @param start_time: integer, the start of the interval, as stored
+    @param end_time: integer, the end of the interval, as stored
+    @param slot_id: integer, ID of a slot to ignore, e.g. the one being moved, None to check all of them
+    @return tuple[int,int], the overlapping slot, structured as (start_time,end_time),
+    None if there is none
+
+    A slot overlaps the interval if it starts before the interval ends and ends
+    after it starts. Since every write function keeps the slots of an event
+    disjoint, only two slots can overlap the interval: the last one starting
+    before it and the first one starting with or after it. Each of them is
+    read with a single lookup in the index on <code>(event_id, start_time)</code>.
+    """
+    previous = con.execute(
+        """
+        SELECT start_time, end_time
+        FROM slots
+        WHERE event_id=? AND start_time < ? AND slot_id IS NOT ?
+        ORDER BY start_time DESC
+        LIMIT 1;
+        """,
+        (event_id, start_time, slot_id)
+    ).fetchone()
+    if previous is not None and previous[1] > start_time:
+        return previous
+    following = con.execute(
+        """
+        SELECT start_time, end_time
+        FROM slots
+        WHERE event_id=? AND start_time >= ? AND slot_id IS NOT ?
+        ORDER BY start_time ASC
+        LIMIT 1;
+        """,
+        (event_id, start_time, slot_id)
+    ).fetchone()
+    if following is not None and following[0] < end_time:
+        return following
+    return None
+
+def _check_slot_times(start_time:int, end_time:int) -> None:
+    """! @brief Checks that a slot ends after it starts.
+    @param start_time: integer, the start of the slot, as stored
+    @param end_time: integer, the end of the slot, as stored
+    @return None
+
+    A ValueError is raised otherwise, since such a slot would break the
+    ordering the overlap checks rely on.
+    """
+    if end_time <= start_time:
+        raise ValueError(
+            "The slot must end after it starts: " + format_time(start_time) + " - " + format_time(end_time)
+        )
+
+def assign_slot(db:str, slot_id:int, user_id:int|None) -> tuple[int,int,int]|None:
+    """! @brief Assigns an existing slot in the database to a user, unless it overlaps their bookings.
     @param db: string, the path to the database file
     @param slot_id: integer, ID of the slot to assign
     @param user_id: integer, user to assign the slot to, if None the
     slot is free
-    @return None
+    @return tuple[int,int,int], the booking of the user overlapping the slot,
+    structured as (event_id,start_time,end_time), None if the slot was assigned
 
     This function sets the user_id field of a slot to the desired value. It can
     be used to assign a free slot to somebody, or to modify the user of and
     already assigned slot. To turn free an occupied slot, simply pass the None
-    value as <code>user_id</code>.
+    value as <code>user_id</code>. As in <code>book_slot</code>, the slot is not
+    assigned if it overlaps another booking of the user.
+    """
+    con = connect(db)
+    # The write lock is taken before checking, so no booking can be made meanwhile
+    con.execute("BEGIN IMMEDIATE;")
+    if user_id is not None:
+        slot = con.execute(
+            """
+            SELECT start_time, end_time
+            FROM slots
+            WHERE slot_id=?;
+            """,
+            (slot_id,)
+        ).fetchone()
+        conflict = None if slot is None else _find_booking_conflict(con, user_id, slot[0], slot[1], slot_id)
+        if conflict is not None:
+            con.rollback()
+            con.close()
+            return conflict
+
+    cur = con.execute(
+        """
+        UPDATE slots SET user_id=?
+        WHERE slot_id=?
+        RETURNING event_id, start_time;
+        """,
+        (user_id, slot_id)
+    )
+    res = cur.fetchone()
+    con.commit()
+    con.close()
+    if res is not None:
+        invalidate(("event", res[0]))
+        slot_assigned(res[0], slot_id, res[1], user_id)
+    return None
+
+def book_slot(db:str, slot_id:int, user_id:int) -> tuple[bool, tuple[int,int,int]|None]:
+    """! @brief Assigns a free slot to a user, unless it overlaps their bookings.
+    @param db: string, the path to the database file
+    @param slot_id: integer, ID of the slot to book
+    @param user_id: integer, user to assign the slot to
+    @return booked: boolean, True if the slot has been assigned to the user
+    @return conflict: tuple[int,int,int], the booking of the user overlapping the
+    slot, structured as (event_id,start_time,end_time), None if there is none
+
+    Unlike <code>assign_slot</code>, this function never takes a slot from
+    another user: the slot is assigned only if it is still free, and only if the
+    user has no other booking overlapping it, in any event. The check and the
+    assignment run in the same transaction, under the write lock, so two
+    concurrent bookings can't both succeed. If the slot has been deleted or
+    booked meanwhile, False is returned with no conflict. Once booked, the user
+    leaves the waitlist of the event, if they were in it.
+    """
+    con = connect(db)
+    con.execute("BEGIN IMMEDIATE;")
+    slot = con.execute(
+        """
+        SELECT start_time, end_time
+        FROM slots
+        WHERE slot_id=? AND user_id IS NULL;
+        """,
+        (slot_id,)
+    ).fetchone()
+    if slot is None:
+        con.rollback()
+        con.close()
+        return False, None
+
+    conflict = _find_booking_conflict(con, user_id, slot[0], slot[1])
+    if conflict is not None:
+        con.rollback()
+        con.close()
+        return False, conflict
+
+    res = con.execute(
+        """
+        UPDATE slots SET user_id=?
+        WHERE slot_id=? AND user_id IS NULL
+        RETURNING event_id, start_time;
+        """,
+        (user_id, slot_id)
+    ).fetchone()
+    # The user doesn't need to wait for this event anymore
+    con.execute(
+        """
+        DELETE FROM waitlist
+        WHERE event_id=? AND user_id=?;
+        """,
+        (res[0], user_id)
+    )
+    con.commit()
+    con.close()
+    invalidate(("event", res[0]))
+    slot_assigned(res[0], slot_id, res[1], user_id)
+    return True, None
+
+def release_slot(db:str, slot_id:int) -> int|None:
+    """! @brief Frees a booked slot, or gives it to the next user in the waitlist.
+    @param db: string, the path to the database file
+    @param slot_id: integer, ID of the slot to free
+    @return integer, the ID of the user the slot has been given to, None if the slot is now free
+
+    This function removes the user of a slot. If other users are waiting for a
+    slot of the same event, the slot is assigned to the first of them, in order
+    of arrival, whose bookings don't overlap it, and they leave the waitlist.
+    Users with an overlapping booking keep their place. Everything happens in
+    the same transaction, so the slot can't be booked by someone else meanwhile.
+    """
+    con = connect(db)
+    con.execute("BEGIN IMMEDIATE;")
+    res = con.execute(
+        """
+        UPDATE slots SET user_id=NULL
+        WHERE slot_id=?
+        RETURNING event_id, start_time, end_time;
+        """,
+        (slot_id,)
+    ).fetchone()
+    if res is None:
+        con.rollback()
+        con.close()
+        return None
+    event_id, start_time, end_time = res
+
+    promoted = _promote_waiting_user(con, event_id, slot_id, start_time, end_time)
+    con.commit()
+    con.close()
+    invalidate(("event", event_id))
+    slot_assigned(event_id, slot_id, start_time, promoted)
+    return promoted
+
+def _promote_waiting_user(
+        con:sqlite3.Connection,
+        event_id:int,
+        slot_id:int,
+        start_time:int,
+        end_time:int
+) -> int|None:
+    """! @brief Gives a slot just freed to the first user in the waitlist of its event.
+    @param con: Connection, an open connection to the database, inside the transaction freeing the slot
+    @param event_id: integer, ID of the event of the slot
+    @param slot_id: integer, ID of the free slot
+    @param start_time: integer, the start of the slot, as stored
+    @param end_time: integer, the end of the slot, as stored
+    @return integer, the ID of the user the slot has been given to, None if nobody can take it
+
+    The slot goes to the first user, in order of arrival, whose bookings don't
+    overlap it, and they leave the waitlist. Users with an overlapping booking
+    keep their place.
     """
-    con = sqlite3.connect(db)
+    waiting = con.execute(
+        """
+        SELECT waitlist_id, user_id
+        FROM waitlist
+        WHERE event_id=?
+        ORDER BY waitlist_id ASC;
+        """,
+        (event_id,)
+    )
+    for waitlist_id, user_id in waiting:
+        if _find_booking_conflict(con, user_id, start_time, end_time) is None:
+            break
+    else:
+        return None
+
     con.execute(
         """
         UPDATE slots SET user_id=?
@@ -166,9 +501,110 @@ def assign_slot(db:str, slot_id:int, user_id:int|None) -> None:
         """,
         (user_id, slot_id)
     )
+    con.execute(
+        """
+        DELETE FROM waitlist
+        WHERE waitlist_id=?;
+        """,
+        (waitlist_id,)
+    )
+    return user_id
+
+def join_waitlist(db:str, event_id:int, user_id:int) -> int|None:
+    """! @brief Adds a user to the waitlist of an event.
+    @param db: string, the path to the database file
+    @param event_id: integer, ID of the event to wait for
+    @param user_id: integer, ID of the user waiting
+    @return integer, the position of the user in the waitlist, starting from 1,
+    None if the event has free slots and the user can book directly
+
+    The user is added at the end of the waitlist, or keeps their place if already
+    in it. The free slots are checked in the same transaction, so a slot freed
+    meanwhile is either booked by the user or given to them by <code>release_slot</code>.
+    """
+    con = connect(db)
+    con.execute("BEGIN IMMEDIATE;")
+    free = con.execute(
+        """
+        SELECT 1 FROM slots
+        WHERE event_id=? AND user_id IS NULL
+        LIMIT 1;
+        """,
+        (event_id,)
+    ).fetchone()
+    if free is not None:
+        con.rollback()
+        con.close()
+        return None
+
+    con.execute(
+        """
+        INSERT OR IGNORE INTO waitlist (event_id,user_id)
+        VALUES (?,?);
+        """,
+        (event_id, user_id)
+    )
+    position = con.execute(
+        """
+        SELECT COUNT(*) FROM waitlist
+        WHERE event_id=? AND waitlist_id <= (
+            SELECT waitlist_id FROM waitlist
+            WHERE event_id=? AND user_id=?
+        );
+        """,
+        (event_id, event_id, user_id)
+    ).fetchone()[0]
     con.commit()
     con.close()
-    return
+    return position
+
+def _find_booking_conflict(
+        con:sqlite3.Connection,
+        user_id:int,
+        start_time:int,
+        end_time:int,
+        slot_id:int|None=None
+) -> tuple[int,int,int]|None:
+    """! @brief Finds a booking of a user overlapping a time interval.
+    @param con: Connection, an open connection to the database
+    @param user_id: integer, ID of the user
+    @param start_time: integer, the start of the interval, as stored
+    @param end_time: integer, the end of the interval, as stored
+    @param slot_id: integer, ID of a slot to ignore, e.g. the one being assigned, None to check all of them
+    @return tuple[int,int,int], the overlapping booking, structured as
+    (event_id,start_time,end_time), None if there is none
+
+    As in <code>_find_slot_overlap</code>, a booking overlaps the interval if it
+    starts before the interval ends and ends after it starts. Every write
+    function keeps the bookings of a user disjoint, so only the last booking
+    starting before the interval and the first one starting with or after it
+    are read, each with a single lookup in the index on <code>(user_id, start_time)</code>.
+    """
+    previous = con.execute(
+        """
+        SELECT event_id, start_time, end_time
+        FROM slots
+        WHERE user_id=? AND start_time < ? AND slot_id IS NOT ?
+        ORDER BY start_time DESC
+        LIMIT 1;
+        """,
+        (user_id, start_time, slot_id)
+    ).fetchone()
+    if previous is not None and previous[2] > start_time:
+        return previous
+    following = con.execute(
+        """
+        SELECT event_id, start_time, end_time
+        FROM slots
+        WHERE user_id=? AND start_time >= ? AND slot_id IS NOT ?
+        ORDER BY start_time ASC
+        LIMIT 1;
+        """,
+        (user_id, start_time, slot_id)
+    ).fetchone()
+    if following is not None and following[1] < end_time:
+        return following
+    return None
 
 
 
@@ -189,7 +625,7 @@ def update_user(db:str, user_id:int, name:str, username:str) -> None:
     <code>insert_user</code> is to be preferred when you are sure the
     user already exists.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
         UPDATE users SET name=?, username=?
@@ -199,6 +635,7 @@ def update_user(db:str, user_id:int, name:str, username:str) -> None:
     )
     con.commit()
     con.close()
+    invalidate(("user", user_id))
     return
 
 def update_fair(db:str, fair_id:int, name:str, description:str) -> None:
@@ -211,7 +648,7 @@ def update_fair(db:str, fair_id:int, name:str, description:str) -> None:
 
     This function modifies a fair already existing in the database.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
         UPDATE fairs SET name=?, description=?
@@ -221,6 +658,8 @@ def update_fair(db:str, fair_id:int, name:str, description:str) -> None:
     )
     con.commit()
     con.close()
+    invalidate(("fairs",), ("fair", fair_id))
+    forget_event_index()
     return
 
 def update_event(
@@ -242,7 +681,7 @@ def update_event(
 
     This function modifies an event already existing in the database.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
         UPDATE events SET fair_id=?, owner_id=?, name=?, description=?
@@ -252,6 +691,8 @@ def update_event(
     )
     con.commit()
     con.close()
+    invalidate_all() # The event may have moved to another fair
+    forget_event_index()
     return
 
 def update_event_description(db:str, event_id:int, description:str) -> None:
@@ -265,7 +706,7 @@ def update_event_description(db:str, event_id:int, description:str) -> None:
     only the <code>description</code> field of the event, since this is the element
     that is most likely to change for this table.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
         UPDATE events SET description=?
@@ -275,6 +716,7 @@ def update_event_description(db:str, event_id:int, description:str) -> None:
     )
     con.commit()
     con.close()
+    invalidate(("event", event_id))
     return
 
 def update_slot(
@@ -284,8 +726,8 @@ def update_slot(
         user_id:int|None,
         start_time:datetime,
         end_time:datetime
-) -> None:
-    """! @brief Updates a slot in the database.
+) -> tuple[list[tuple[str,str,str,str]], tuple[int,int,int]|None]:
+    """! @brief Updates a slot in the database, unless it overlaps another slot or booking.
     @param db: string, the path to the database file
     @param slot_id: integer, ID of the slot to modify
     @param event_id: integer, ID of the new event the slot refers to
@@ -293,30 +735,50 @@ def update_slot(
     slot becomes free
     @param start_time: datetime, new date and time the slot will start
     @param end_time: datetime, new date and time the slot will end
-    @return None
+    @return overlaps: list[tuple[str,str,str,str]], the overlap found with the
+    slots of the event, structured as (start_time,end_time,other_start_time,other_end_time)
+    @return conflict: tuple[int,int,int], the booking of the user overlapping the
+    slot, structured as (event_id,start_time,end_time), None if there is none
 
     This function modifies a slot already existing in the database. If you want the
     slot to become free, simply pass the None value as <code>user_id</code>.
     In case the slot change involves only the field <code>user_id</code>, then
-    <code>assign_slot</code> function is to be preferred.
+    <code>assign_slot</code> function is to be preferred. The slot is modified
+    only if the overlaps are empty and there is no conflict: as in
+    <code>create_slots_str</code>, its new times must not overlap another slot
+    of the new event and, as in <code>book_slot</code>, another booking of the
+    new user. A ValueError is raised if the slot doesn't end after it starts.
     """
-    con = sqlite3.connect(db)
+    start_time = to_epoch(start_time)
+    end_time = to_epoch(end_time)
+    _check_slot_times(start_time, end_time)
+    con = connect(db)
+    # The write lock is taken before checking, so no slot can be created meanwhile
+    con.execute("BEGIN IMMEDIATE;")
+    other = _find_slot_overlap(con, event_id, start_time, end_time, slot_id)
+    if other is not None:
+        con.rollback()
+        con.close()
+        return [tuple(format_time(time) for time in (start_time, end_time) + other)], None
+    if user_id is not None:
+        conflict = _find_booking_conflict(con, user_id, start_time, end_time, slot_id)
+        if conflict is not None:
+            con.rollback()
+            con.close()
+            return [], conflict
+
     con.execute(
         """
         UPDATE slots SET event_id=?,user_id=?,start_time=?,end_time=?
         WHERE slot_id=?;
         """,
-        (
-            event_id,
-            user_id,
-            start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            end_time.strftime("%Y-%m-%d %H:%M:%S"),
-            slot_id
-        )
+        (event_id, user_id, start_time, end_time, slot_id)
     )
     con.commit()
     con.close()
-    return
+    invalidate_all() # The slot may have moved to another event
+    forget_availability()
+    return [], None
 
 
 
@@ -324,15 +786,32 @@ def update_slot(
 
 # Functions to delete records of the database
 
-def delete_user(db:str, user_id:int) -> None:
+def delete_user(db:str, user_id:int) -> list[tuple[int,int,int,int]]:
     """! @brief Deletes a user in the database.
     @param db: string, the path to the database file
     @param user_id: integer, ID of the user to delete
-    @return None
-
-    This function deletes a user already existing in the database.
+    @return list[tuple[int,int,int,int]], the slots given to users of the
+    waitlists, each as (user_id, event_id, start_time, end_time), so that they
+    can be notified
+
+    This function deletes a user already existing in the database. The database
+    frees the slots they booked, removes them from the waitlists and leaves the
+    events they organize without an owner. Then, as in <code>release_slot</code>,
+    each freed slot is given to the first user waiting for its event, if any.
+    Everything happens in the same transaction, and the user is removed from the
+    waitlists before, so they can't get back one of their own slots.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
+    con.execute("BEGIN IMMEDIATE;")
+    booked = con.execute(
+        """
+        SELECT event_id, slot_id, start_time, end_time
+        FROM slots
+        WHERE user_id=?
+        ORDER BY start_time ASC;
+        """,
+        (user_id,)
+    ).fetchall()
     con.execute(
         """
         DELETE FROM users
@@ -340,9 +819,19 @@ def delete_user(db:str, user_id:int) -> None:
         """,
         (user_id,)
     )
+    assigned = [
+        _promote_waiting_user(con, event_id, slot_id, start_time, end_time)
+        for event_id, slot_id, start_time, end_time in booked
+    ]
     con.commit()
     con.close()
-    return
+    invalidate(("user", user_id), *{("event", event_id) for event_id, _, _, _ in booked})
+    promotions = []
+    for (event_id, slot_id, start_time, end_time), promoted in zip(booked, assigned):
+        slot_assigned(event_id, slot_id, start_time, promoted)
+        if promoted is not None:
+            promotions.append((promoted, event_id, start_time, end_time))
+    return promotions
 
 def delete_fair(db:str, fair_id:int) -> None:
     """! @brief Deletes a fair in the database.
@@ -350,9 +839,10 @@ def delete_fair(db:str, fair_id:int) -> None:
     @param fair_id: integer, ID of the fair to delete
     @return None
 
-    This function deletes a fair already existing in the database.
+    This function deletes a fair already existing in the database. The database
+    deletes its events as well, together with their slots and waitlists.
     """
-    con = sqlite3.connect(db)
+    con = connect(db)
     con.execute(
         """
         DELETE FROM fairs
@@ -362,59 +852,110 @@ def delete_fair(db:str, fair_id:int) -> None:
     )
     con.commit()
     con.close()
+    invalidate_all() # Every event of the fair has been deleted
+    forget_availability()
+    forget_event_index()
     return
 
-def delete_event(db:str, event_id:int, delete_slots:bool=True) -> None:
+def delete_event(db:str, event_id:int) -> list[tuple[int,int,int]]:
     """! @brief Deletes an event in the database.
     @param db: string, the path to the database file
     @param event_id: integer, ID of the event to delete
-    @param delete_slots: boolean, if true all the slots liked to this
-    event are deleted as well
-    @return None
-
-    This function deletes an event already existing in the database. In case
-    <code>delete_slots</code> is set to True, then all the slots linked to
-    this event are deleted as well.
+    @return list[tuple[int,int,int]], the deleted bookings, each as
+    (user_id, start_time, end_time), ordered by user and start time
+
+    This function deletes an event already existing in the database. The
+    database deletes its slots and its waitlist as well. The bookings the slots
+    held are returned, so that the users can be notified. They are collected in
+    the same transaction as the delete, so no booking made in the meantime can
+    be missed.
     """
-    con = sqlite3.connect(db)
-
-    con.execute(
+    con = connect(db)
+    con.execute("BEGIN IMMEDIATE;")
+    bookings = con.execute(
+        """
+        SELECT user_id, start_time, end_time
+        FROM slots
+        WHERE event_id=? AND user_id IS NOT NULL
+        ORDER BY user_id, start_time;
+        """,
+        (event_id,)
+    ).fetchall()
+    res = con.execute(
         """
         DELETE FROM events
-        WHERE event_id=?;
+        WHERE event_id=?
+        RETURNING fair_id;
         """,
         (event_id,)
-    )
-    if delete_slots:
-        con.execute(
-            """
-            DELETE FROM slots
-            WHERE event_id=?;
-            """,
-            (event_id,)
-        )
-
+    ).fetchone()
     con.commit()
     con.close()
-    return
-
-def delete_slot(db:str, slot_id:int) -> None:
+    if res is not None:
+        invalidate(("fair", res[0]))
+    invalidate(("event", event_id), ("events",))
+    forget_availability(event_id)
+    forget_event_index()
+    return bookings
+
+def delete_slot(db:str, slot_id:int) -> int|None:
     """! @brief Deletes a slot in the database.
     @param db: string, the path to the database file
     @param slot_id: integer, ID of the slot to delete
-    @return None
+    @return integer, the ID of the user who had booked the slot, None if it was free
 
     This function deletes a slot already existing in the database. Nothing happens
     to the event this slot refers to.
     """
-    con = sqlite3.connect(db)
-    con.execute(
+    con = connect(db)
+    cur = con.execute(
         """
         DELETE FROM slots
-        WHERE slot_id=?;
+        WHERE slot_id=?
+        RETURNING event_id, user_id, start_time;
         """,
         (slot_id,)
     )
+    res = cur.fetchone()
     con.commit()
     con.close()
-    return
+    if res is None:
+        return None
+    invalidate(("event", res[0]))
+    slot_deleted(res[0], slot_id, res[2])
+    return res[1]
+
+def delete_orphans(db:str) -> list[tuple[str,int]]:
+    """! @brief Removes the references to records that don't exist anymore.
+    @param db: string, the path to the database file
+    @return list[tuple[str,int]], the number of records fixed in each table,
+    structured as (table,count), only for the tables with at least one. The
+    records deleted by the cascades, like the slots of an orphan event, are
+    not counted
+
+    Databases created before the foreign keys were enforced can hold events of
+    deleted fairs, slots of deleted events, and bookings, waitlist entries and
+    events of deleted users. This function deletes the events, slots and waitlist
+    entries whose parent record is missing, and detaches the bookings and the
+    events from the missing users. It runs once when <code>create_db.py</code>
+    migrates the database, after that the database keeps the references valid.
+    """
+    statements = (
+        ("events", "DELETE FROM events WHERE fair_id NOT IN (SELECT fair_id FROM fairs);"),
+        ("events", "UPDATE events SET owner_id=NULL WHERE owner_id NOT IN (SELECT user_id FROM users);"),
+        ("slots", "DELETE FROM slots WHERE event_id NOT IN (SELECT event_id FROM events);"),
+        ("slots", "UPDATE slots SET user_id=NULL WHERE user_id NOT IN (SELECT user_id FROM users);"),
+        ("waitlist", "DELETE FROM waitlist WHERE event_id NOT IN (SELECT event_id FROM events) " +
+                     "OR user_id NOT IN (SELECT user_id FROM users);")
+    )
+    con = connect(db)
+    con.execute("BEGIN IMMEDIATE;")
+    counts = {}
+    for table, statement in statements:
+        counts[table] = counts.get(table, 0) + con.execute(statement).rowcount
+    con.commit()
+    con.close()
+    invalidate_all()
+    forget_availability()
+    forget_event_index()
+    return [(table, count) for table, count in counts.items() if count > 0]
@@ -0,0 +1,154 @@
+"""!
+@file event_index.py
+@brief In-memory prefix index over the names of the events and their fairs.
+
+This file contains the implementation of the index used to answer the inline
+queries. Every word of an event's name and of its fair's name is stored in a
+sorted list, so the events matching a prefix are found with a binary search
+instead of a query to the database. A query of several words returns the
+events matching all of them.
+
+The index is built at the first search and kept until an event is added,
+renamed, moved or deleted, or a fair is renamed or deleted: the functions in
+<code>db_write.py</code> drop it with <code>forget_event_index</code>, and
+<code>sync_changes</code> drops it when another process changes the entities
+<code>("events",)</code> or <code>("fairs",)</code>, see <code>db_connection.py</code>.
+Then it is rebuilt at the next search. The results of the most recent queries
+are cached inside the index itself.
+"""
+
+import re, unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+from utils.db_read import get_events_with_fair
+from utils.db_connection import add_change_listener, sync_changes
+
+# Maximum number of query results cached by an index
+MAX_CACHED_QUERIES = 256
+
+_WORD_SEPARATOR = re.compile(r"\W+")
+
+# The current index, None until the next search builds it
+_index: "EventIndex|None" = None
+
+
+
+
+
+def normalize(text:str) -> list[str]:
+    """! @brief Splits a text into lowercase words without accents.
+    @param text: string, the text to split
+    @return list[str], the words of the text, in order
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [word for word in _WORD_SEPARATOR.split(text) if word]
+
+
+
+class EventIndex:
+    """! @brief Sorted list of (word, event) pairs, searched by prefix.
+
+    Built from the rows of the records of <code>get_events_with_fair</code>, the index
+    must not be modified after being built.
+    """
+
+    __slots__ = ("_words", "_event_ids", "_events", "_results")
+
+    def __init__(self, events:list[tuple[int,str,str,int,str]]):
+        """! @brief Builds the index.
+        @param events: list[tuple[int,str,str,int,str]], the event records, each
+        one structured as (event_id,name,description,fair_id,fair_name), ordered by name
+        """
+        entries = sorted({
+            (word, event_id)
+            for event_id, name, _, _, fair_name in events
+            for word in normalize(name + " " + fair_name)
+        })
+        self._words = [word for word, _ in entries]
+        self._event_ids = [event_id for _, event_id in entries]
+        # Insertion order is the order by name of the events
+        self._events = {event_id: (name, fair_name) for event_id, name, _, _, fair_name in events}
+        self._results: OrderedDict = OrderedDict()
+
+    def search(self, text:str) -> tuple[int, ...]:
+        """! @brief Finds the events matching every word of a text.
+        @param text: string, the text typed by the user
+        @return tuple[int], the IDs of the events ordered by name, all of them
+        if the text has no words
+
+        A word of the text matches an event if it is a prefix of a word of the
+        event's name or of its fair's name.
+        """
+        words = tuple(sorted(set(normalize(text))))
+        result = self._results.get(words)
+        if result is not None:
+            self._results.move_to_end(words)
+            return result
+
+        matching = None
+        for word in words:
+            start = bisect_left(self._words, word)
+            end = bisect_left(self._words, word + "\U0010ffff", start)
+            found = set(self._event_ids[start:end])
+            matching = found if matching is None else matching & found
+            if not matching:
+                break
+
+        if matching is None:
+            result = tuple(self._events)
+        else:
+            result = tuple(sorted(matching, key=self._order))
+
+        self._results[words] = result
+        if len(self._results) > MAX_CACHED_QUERIES:
+            self._results.popitem(last=False)
+        return result
+
+    def event(self, event_id:int) -> tuple[str, str]:
+        """! @brief Returns the names of an indexed event.
+        @param event_id: integer, the ID of the event
+        @return tuple[str,str], the name of the event and the name of its fair
+        """
+        return self._events[event_id]
+
+    def _order(self, event_id:int) -> tuple[str, int]:
+        """! @brief Sorting key that orders the events by name, like the database.
+        @param event_id: integer, the ID of the event
+        @return tuple[str,int], the name of the event and its ID
+        """
+        return self._events[event_id][0], event_id
+
+
+
+def get_event_index(db:str) -> EventIndex:
+    """! @brief Returns the index of the events, building it if missing.
+    @param db: string, the path to the database file
+    @return EventIndex, the current index
+    """
+    global _index
+    sync_changes(db)
+    if _index is None:
+        _index = EventIndex(get_events_with_fair(db).rows)
+    return _index
+
+def forget_event_index() -> None:
+    """! @brief Drops the index, to be built again at the next search.
+    @return None
+
+    Used by the write functions changing the names of the events or of the
+    fairs, or the fair of an event.
+    """
+    global _index
+    _index = None
+
+def _forget_changed(entities:tuple|None) -> None:
+    """! @brief Drops the index if other processes changed the events or the fairs, see <code>add_change_listener</code>.
+    @param entities: tuple, the changed entities, None if they are unknown
+    @return None
+    """
+    if entities is None or ("events",) in entities or ("fairs",) in entities:
+        forget_event_index()
+
+add_change_listener(_forget_changed)
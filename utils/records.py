@@ -0,0 +1,158 @@
+"""!
+@file records.py
+@brief Typed records returned by the read functions.
+
+This file contains the definition of the records the functions in
+<code>db_read.py</code> return in place of plain tuples, so the handlers can
+read the fields by name, e.g. <code>slot.start_time</code> instead of
+<code>slot[2]</code>. The records are named tuples: a record has the same size
+as a plain tuple, since the field names are stored once in the class, and can
+still be unpacked and indexed like before.
+
+The read functions don't convert the rows fetched by SQLite: they return them
+in a <code>RecordList</code>, which makes a record of a row only when the row
+is taken from it, by copying the row into a tuple of the record class. So the
+result of a query takes exactly the time and memory of the plain tuples, and
+each record taken costs one small allocation, freed as soon as the record is
+not used anymore. The script <code>benchmark_records.py</code> compares the
+two ways, reading the rows and then their fields.
+"""
+
+from collections.abc import Sequence
+from itertools import repeat
+from typing import Iterator, NamedTuple
+
+
+
+
+
+# Records of the tables
+
+class User(NamedTuple):
+    """! @brief A record of the "users" table."""
+    user_id: int
+    name: str
+    username: str
+
+class Fair(NamedTuple):
+    """! @brief A record of the "fairs" table."""
+    fair_id: int
+    name: str
+    description: str
+
+class Event(NamedTuple):
+    """! @brief A record of the "events" table."""
+    event_id: int
+    fair_id: int
+    owner_id: int|None
+    name: str
+    description: str
+
+class Slot(NamedTuple):
+    """! @brief A record of the "slots" table, with the times as stored."""
+    slot_id: int
+    event_id: int
+    user_id: int|None
+    start_time: int
+    end_time: int
+
+
+
+
+
+# Records of the joins
+
+class UserSlot(NamedTuple):
+    """! @brief A slot booked by a user, with the name and description of its event."""
+    slot_id: int
+    event_id: int
+    start_time: int
+    end_time: int
+    event_name: str
+    event_description: str
+
+class EventSlot(NamedTuple):
+    """! @brief A slot of an event, with the name and username of the user that booked it."""
+    slot_id: int
+    user_id: int|None
+    start_time: int
+    end_time: int
+    user_name: str|None
+    username: str|None
+
+class EventWithFair(NamedTuple):
+    """! @brief An event, with the name of its fair."""
+    event_id: int
+    name: str
+    description: str
+    fair_id: int
+    fair_name: str
+
+class SlotSchedule(NamedTuple):
+    """! @brief The times of a slot of an event, and whether it is free."""
+    slot_id: int
+    start_time: int
+    end_time: int
+    is_free: bool
+
+class SearchResult(NamedTuple):
+    """! @brief A fair or event matching a full-text search."""
+    kind: str
+    record_id: int
+    name: str
+    snippet: str
+
+class SlotTime(NamedTuple):
+    """! @brief A free slot of a day, with the times as "HH:MM:SS"."""
+    slot_id: int
+    start_time: str
+    end_time: str
+
+
+
+
+
+class RecordList(Sequence):
+    """! @brief The rows returned by a query, taken as records of a type.
+
+    The rows are kept as fetched, as plain tuples in <code>rows</code>, and
+    copied into a record only when taken. The code reading just the fields by
+    position, like the in-memory indexes, can iterate <code>rows</code> directly.
+    """
+
+    __slots__ = ("rows", "record")
+
+    def __init__(self, rows:list[tuple], record:type):
+        """! @brief Wraps the rows of a query.
+        @param rows: list[tuple], the rows, with the fields of the record in the same order
+        @param record: type, one of the record classes of this file
+        """
+        self.rows = rows
+        self.record = record
+
+    def __len__(self) -> int:
+        """! @brief Counts the rows.
+        @return integer, the number of rows
+        """
+        return len(self.rows)
+
+    def __getitem__(self, index:int|slice):
+        """! @brief Takes a row, or a part of the list.
+        @param index: integer or slice, the position of the row or the part to take
+        @return the row as a record, or a RecordList for a slice
+        """
+        if isinstance(index, slice):
+            return RecordList(self.rows[index], self.record)
+        return tuple.__new__(self.record, self.rows[index])
+
+    def __iter__(self) -> Iterator[tuple]:
+        """! @brief Takes all the rows in order, as records.
+        @return Iterator, the records
+        """
+        return map(tuple.__new__, repeat(self.record), self.rows)
+
+    def __repr__(self) -> str:
+        """! @brief Describes the list, for debugging.
+        @return string, the records
+        """
+        return "RecordList(" + repr(list(self)) + ")"
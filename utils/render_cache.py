@@ -0,0 +1,154 @@
+"""!
+@file render_cache.py
+@brief Cache of rendered outputs, invalidated by the database writes.
+
+This file contains the implementation of a small in-memory cache for the outputs
+the handlers build from the database, like inline keyboards and response texts.
+Every output is stored together with the versions of the database entities it
+was built from, e.g. <code>("event", 42)</code> or <code>("fairs",)</code>.
+The functions in <code>db_write.py</code> bump the version of the entities they
+modify, so that a cached output is served only if none of its entities changed
+since it was rendered.
+
+The cache is bounded: when full, the least recently used output is evicted.
+
+When the bot runs in several processes, each one has its own cache: the
+invalidations of a process are sent to the others through the function set by
+<code>set_publisher</code>, and applied there by <code>apply_remote</code>.
+
+The database can also be changed by processes not sending invalidations, e.g.
+<code>edit_db.py</code>. So every lookup first calls <code>sync_changes</code>,
+which reads the entities those processes changed from the change counters of
+the database and invalidates them here, without publishing. The commits of this
+process, or to the tables of no entity, invalidate nothing more.
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+from utils.db_connection import add_change_listener, sync_changes
+
+# Maximum number of outputs kept in memory
+MAX_ENTRIES = 1024
+
+# Current version of each entity, missing entities are at version 0
+_versions: dict[Hashable, int] = {}
+
+# Bumped to invalidate every output at once
+_epoch = 0
+
+# Maps each output key to (epoch, value, ((entity, version), ...))
+_outputs: OrderedDict = OrderedDict()
+
+# Called with the entities of each invalidation, None for all of them, if set
+_publish: Callable[[tuple|None], None]|None = None
+
+
+
+
+
+# Invalidation, used by the write functions
+
+def invalidate(*entities:Hashable) -> None:
+    """! @brief Marks some entities as modified.
+    @param entities: the keys of the modified entities, e.g. ("event", 42)
+    @return None
+
+    This function bumps the version of each given entity, so that all the
+    outputs rendered from them are discarded at their next lookup.
+    """
+    for entity in entities:
+        _versions[entity] = _versions.get(entity, 0) + 1
+    if _publish is not None:
+        _publish(entities)
+
+def invalidate_all() -> None:
+    """! @brief Discards every cached output.
+    @return None
+
+    Used by the write functions whose effects are too wide to track precisely,
+    like moving an event to another fair.
+    """
+    global _epoch
+    _epoch += 1
+    _outputs.clear()
+    if _publish is not None:
+        _publish(None)
+
+
+
+
+
+# Invalidation across processes
+
+def set_publisher(publish:Callable[[tuple|None], None]|None) -> None:
+    """! @brief Sets the function sending the invalidations of this process to the others.
+    @param publish: function, called with the tuple of the invalidated entities,
+    or None if every output was discarded; None to stop publishing
+    @return None
+    """
+    global _publish
+    _publish = publish
+
+def apply_remote(entities:tuple|None) -> None:
+    """! @brief Applies an invalidation received from another process, without publishing it.
+    @param entities: tuple, the invalidated entities, None to discard every output
+    @return None
+    """
+    global _publish
+    publish, _publish = _publish, None
+    try:
+        if entities is None:
+            invalidate_all()
+        else:
+            invalidate(*entities)
+    finally:
+        _publish = publish
+
+
+
+
+
+# Lookup, used by the handlers
+
+def get_rendered(db:str, key:Hashable) -> Any|None:
+    """! @brief Retrieves a cached output.
+    @param db: string, the path to the database file the outputs are rendered from
+    @param key: the key of the output, e.g. ("event_text", 42)
+    @return the cached output, None if it's missing or outdated
+    """
+    sync_changes(db)
+    entry = _outputs.get(key)
+    if entry is None:
+        return None
+
+    epoch, value, dependencies = entry
+    if epoch != _epoch or any(_versions.get(entity, 0) != version for entity, version in dependencies):
+        del _outputs[key]
+        return None
+
+    _outputs.move_to_end(key)
+    return value
+
+def store_rendered(key:Hashable, value:Any, entities:Iterable[Hashable]) -> Any:
+    """! @brief Caches an output.
+    @param key: the key of the output, e.g. ("event_text", 42)
+    @param value: the output, it must not be modified after being cached
+    @param entities: the keys of the entities the output was rendered from
+    @return the value itself, for convenience
+
+    The current versions of the entities are saved with the output. Since the
+    handlers don't yield between reading the database and storing the output,
+    no write of this process can happen in between. A commit of another process
+    can, but <code>sync_changes</code> reports its entities at the next lookup,
+    so the output is discarded then.
+    """
+    dependencies = tuple((entity, _versions.get(entity, 0)) for entity in entities)
+    _outputs[key] = (_epoch, value, dependencies)
+    _outputs.move_to_end(key)
+    if len(_outputs) > MAX_ENTRIES:
+        _outputs.popitem(last=False)
+    return value
+
+# The changes of the other processes are applied like the invalidations they publish
+add_change_listener(apply_remote)
@@ -0,0 +1,102 @@
+"""!
+@file slot_time.py
+@brief Conversions between the stored slot times and their readable form.
+
+This file contains the implementation of the only layer that knows how the
+times of the slots are stored. The database keeps them as integers, the seconds
+since 1970-01-01 00:00:00 of the wall-clock time of the event, i.e. the time read
+as if it were UTC: in this way the conversions don't depend on the timezone of
+the server nor on daylight saving time, and a day is always 86400 seconds long.
+
+The write functions convert the datetimes and the ISO-8601 strings they receive
+with <code>to_epoch</code>, the handlers show the stored times with the
+<code>format_*</code> functions, in the same "YYYY-MM-DD HH:MM:SS" form used
+before.
+"""
+
+from datetime import datetime, timedelta
+
+# Format of the readable times, ISO-8601 without the "T"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Seconds in a day
+DAY = 86400
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+
+
+
+# From the readable form to the stored one
+
+def to_epoch(time:str|datetime) -> int:
+    """! @brief Converts a time to the integer stored in the database.
+    @param time: datetime or string ISO-8601, e.g. "YYYY-MM-DD HH:MM:SS" or "YYYY-MM-DD",
+    without timezone
+    @return integer, the seconds since the epoch of the wall-clock time
+    """
+    if isinstance(time, str):
+        time = datetime.fromisoformat(time)
+    return (time - _EPOCH) // _SECOND
+
+def day_range(day:str) -> tuple[int, int]:
+    """! @brief Gives the stored times a day spans.
+    @param day: string, the day as "YYYY-MM-DD"
+    @return tuple[int,int], the start of the day and the start of the next one
+    """
+    start = to_epoch(day)
+    return start, start + DAY
+
+def month_range(month:str) -> tuple[int, int]:
+    """! @brief Gives the stored times a month spans.
+    @param month: string, the month as "YYYY-MM"
+    @return tuple[int,int], the start of the month and the start of the next one
+    """
+    year, month_number = int(month[:4]), int(month[5:7])
+    if month_number == 12:
+        year, month_number = year + 1, 0
+    return to_epoch(month + "-01"), to_epoch(datetime(year, month_number + 1, 1))
+
+
+
+
+
+# From the stored form to the readable one
+
+def from_epoch(epoch:int) -> datetime:
+    """! @brief Converts a stored time to a datetime.
+    @param epoch: integer, the time as stored in the database
+    @return datetime, the wall-clock time, without timezone
+    """
+    return _EPOCH + timedelta(seconds=epoch)
+
+def format_time(epoch:int) -> str:
+    """! @brief Formats a stored time as shown to the users.
+    @param epoch: integer, the time as stored in the database
+    @return string, the time as "YYYY-MM-DD HH:MM:SS"
+    """
+    return (_EPOCH + timedelta(seconds=epoch)).isoformat(" ")
+
+def format_day(epoch:int) -> str:
+    """! @brief Formats the day of a stored time.
+    @param epoch: integer, the time as stored in the database
+    @return string, the day as "YYYY-MM-DD"
+    """
+    return (_EPOCH + timedelta(days=epoch // DAY)).isoformat()[:10]
+
+def format_clock(epoch:int) -> str:
+    """! @brief Formats the time of the day of a stored time.
+    @param epoch: integer, the time as stored in the database
+    @return string, the time as "HH:MM:SS"
+    """
+    seconds = epoch % DAY
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def format_month(epoch:int) -> str:
+    """! @brief Formats the month of a stored time.
+    @param epoch: integer, the time as stored in the database
+    @return string, the month as "YYYY-MM"
+    """
+    return format_day(epoch)[:7]
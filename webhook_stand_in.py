@@ -0,0 +1,90 @@
+"""!
+@file webhook_stand_in.py
+@brief Local stand-in for Telegram that posts updates to the webhook server.
+
+This script emulates the requests Telegram sends to a bot running with
+<code>BOT_MODE=webhook</code>: it posts text-message updates to the address
+configured in the .env file, including the secret token header, and reports
+the HTTP status of each request. It allows to test the webhook mode end-to-end
+without exposing the server to the internet. Usage:
+
+<code>python webhook_stand_in.py CHAT_ID TEXT [--count N]</code>
+
+Note that the bot answers through the real Bot API, so CHAT_ID must be a chat
+that has already talked with the bot for the replies to be delivered.
+"""
+
+import sys, json, time, argparse
+from urllib import request, error
+
+from utils.config import load_config
+
+# Load environment variables
+config = load_config()
+webhook_listen = config.webhook_listen
+webhook_port = str(config.webhook_port)
+webhook_path = config.webhook_path
+webhook_secret = config.webhook_secret
+
+
+
+def build_update(update_id:int, chat_id:int, text:str) -> dict:
+    """! @brief Builds a text-message update as Telegram would send it.
+    @param update_id: integer, identifier of the update
+    @param chat_id: integer, the private chat the message comes from
+    @param text: string, the message text, commands start with /
+    @return dictionary, the update in the Bot API JSON format
+    """
+    chat = {"id": chat_id, "type": "private", "first_name": "Stand-in", "last_name": "User",
+            "username": "stand_in_user"}
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": chat,
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Stand-in"},
+        "text": text
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+def post_update(url:str, update:dict) -> int:
+    """! @brief Posts an update to the webhook server.
+    @param url: string, the local address of the webhook
+    @param update: dictionary, the update to post
+    @return integer, the HTTP status returned by the server
+    """
+    headers = {"Content-Type": "application/json"}
+    if webhook_secret is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = webhook_secret
+
+    req = request.Request(url, data=json.dumps(update).encode(), headers=headers, method="POST")
+    try:
+        with request.urlopen(req, timeout=10) as res:
+            return res.status
+    except error.HTTPError as exc:
+        return exc.code
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Post updates to the local webhook server.")
+    parser.add_argument("chat_id", type=int, help="chat the updates come from")
+    parser.add_argument("text", help="message text, e.g. /help")
+    parser.add_argument("--count", type=int, default=1, help="number of updates to post")
+    args = parser.parse_args()
+
+    url = "http://" + webhook_listen + ":" + webhook_port + "/" + webhook_path
+    print("Posting to " + url)
+
+    first_id = int(time.time())
+    failures = 0
+    for i in range(args.count):
+        status = post_update(url, build_update(first_id + i, args.chat_id, args.text))
+        if status != 200:
+            failures += 1
+            print("Update " + str(first_id + i) + " refused with status " + str(status))
+
+    print(str(args.count - failures) + " out of " + str(args.count) + " updates accepted.")
+    if failures:
+        sys.exit(1)